@@ -0,0 +1,120 @@
+"""
+Бенчмарк поиска похожих клиентов (services/lookalikes.py) на базе в миллионы клиентов.
+
+Векторы синтетические, в размерности индекса на схеме benchmarks/synthetic_data.py: доли трат
+по категориям и объёма переводов по типам (распределение Дирихле с весами из выборки) и баланс.
+Меряет сборку и задержку запроса точного перебора, деревьев sklearn (KD-tree, BallTree)
+и кластерного индекса с разным числом просматриваемых кластеров, а также recall@k
+кластерного индекса относительно точного ответа. Результат — JSON, как у benchmarks.run.
+
+    python -m benchmarks.lookalikes --clients 1000000 --probes 8 16 32
+"""
+import argparse
+import json
+import os
+import platform
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.run import _git_commit, _percentiles
+from benchmarks.synthetic_data import CATEGORIES, TRANSFER_TYPES
+from services import config
+from services.lookalikes import LookalikeIndex, cluster_vectors
+
+
+def synthetic_vectors(clients: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    parts = []
+    for weights in (CATEGORIES, TRANSFER_TYPES):
+        alpha = np.array([weight for weight, _ in weights.values()], dtype=np.float64)
+        shares = rng.dirichlet(alpha / alpha.sum() * 3, clients)
+        # Неиспользуемые категории в реальных векторах — нули, а не субнормальные доли от Дирихле
+        shares[shares < 1e-6] = 0.0
+        parts.append((shares / shares.sum(axis=1, keepdims=True)).astype(np.float32))
+    parts.append(rng.uniform(0.4, 0.9, (clients, 1)).astype(np.float32))
+    return np.hstack(parts)
+
+
+def _latencies(query, vectors: np.ndarray, sample: np.ndarray, k: int) -> List[float]:
+    latencies = []
+    for row in sample:
+        started = time.perf_counter()
+        query(vectors[row], k, row)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def run(clients: int, samples: int, k: int, probes: List[int], trees: bool, seed: int) -> Dict:
+    result: Dict = {}
+    vectors = synthetic_vectors(clients, seed)
+    result['dimensions'] = vectors.shape[1]
+    codes = np.arange(clients, dtype=np.int64)
+    norms = np.einsum('ij,ij->i', vectors, vectors)
+    sample = np.random.default_rng(seed + 1).choice(clients, size=min(samples, clients), replace=False)
+
+    exact = LookalikeIndex([str(i) for i in range(vectors.shape[1])], codes, vectors, norms)
+    truth = {int(row): {code for code, _ in exact.query(vectors[row], k, exclude=int(row))} for row in sample}
+    result['exact'] = _percentiles(_latencies(lambda v, k, row: exact.query(v, k, exclude=int(row)),
+                                              vectors, sample, k))
+
+    if trees:
+        from sklearn.neighbors import NearestNeighbors
+        for algorithm in ('kd_tree', 'ball_tree'):
+            started = time.perf_counter()
+            tree = NearestNeighbors(algorithm=algorithm).fit(vectors)
+            build_s = time.perf_counter() - started
+            latencies = _latencies(lambda v, k, row: tree.kneighbors(v[None, :], k + 1), vectors, sample[:20], k)
+            result[algorithm] = {'build_s': build_s, **_percentiles(latencies)}
+
+    started = time.perf_counter()
+    clusters = cluster_vectors(vectors, int(np.sqrt(clients)), seed)
+    result['clusters'] = {'count': len(clusters.centroids), 'build_s': time.perf_counter() - started,
+                          'max_size': int(np.diff(clusters.offsets).max())}
+    index = LookalikeIndex(exact.dimensions, codes, vectors, norms, clusters)
+    default_probes = config.LOOKALIKE_IVF_PROBES
+    try:
+        for count in probes:
+            config.LOOKALIKE_IVF_PROBES = count
+            recall = [len(truth[int(row)] & {code for code, _ in index.query(vectors[row], k, exclude=int(row))}) / k
+                      for row in sample]
+            result[f'ivf_probes_{count}'] = {
+                f'recall_at_{k}': float(np.mean(recall)),
+                **_percentiles(_latencies(lambda v, k, row: index.query(v, k, exclude=int(row)), vectors, sample, k)),
+            }
+    finally:
+        config.LOOKALIKE_IVF_PROBES = default_probes
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк поиска похожих клиентов")
+    parser.add_argument('--clients', type=int, default=1000000)
+    parser.add_argument('--samples', type=int, default=200, help="запросов для замера задержки и recall")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--probes', type=int, nargs='+', default=[8, 16, 32, 64],
+                        help="сколько кластеров просматривать (config.LOOKALIKE_IVF_PROBES)")
+    parser.add_argument('--no-trees', action='store_true', help="не мерить деревья sklearn (их сборка долгая)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="куда записать JSON (по умолчанию — stdout)")
+    args = parser.parse_args()
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'params': vars(args),
+        'results': run(args.clients, args.samples, args.k, args.probes, not args.no_trees, args.seed),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Бенчмарк загрузки, онлайн-диагностики и пакетной генерации рекомендаций.
+
+Генерирует синтетические данные (или берёт готовый --data-dir), собирает хранилище и меряет:
+время сборки и открытия хранилища, построение таблицы признаков, перцентили задержки
+диагностики одного клиента (онлайн-путь движка до и после сборки таблицы признаков и полный
+запрос /api/diagnose через ASGI-приложение), пропускную способность
+пакетного скоринга и CSV-генератора, пиковый RSS. Результат — JSON для сравнения между коммитами.
+
+    python -m benchmarks.run --clients 20000 --clients-per-file 1000 --output bench.json
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.synthetic_data import generate
+
+
+def _peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss — в килобайтах на Linux и в байтах на macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    values = np.array(samples) * 1000
+    return {
+        'count': len(values),
+        'mean_ms': float(values.mean()),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p90_ms': float(np.percentile(values, 90)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max()),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(data_dir: str, store_dir: str, samples: int, workers: int, chunk_size: int, seed: int) -> Dict:
+    result: Dict = {}
+
+    from services.store import build_store
+    started = time.perf_counter()
+    meta = build_store(data_dir, store_dir)
+    result['store_build_s'] = time.perf_counter() - started
+    result['rows'] = {name: info['rows'] for name, info in meta['tables'].items()}
+
+    # main.py загружает данные при импорте — пути задаются через окружение до импорта
+    os.environ['DATA_DIR'] = data_dir
+    os.environ['STORE_DIR'] = store_dir
+    from services import config
+    importlib.reload(config)
+    started = time.perf_counter()
+    main = importlib.import_module('main')
+    result['api_load_s'] = time.perf_counter() - started
+    result['clients'] = len(main.client_code_to_analyzer)
+
+    client_codes = np.array(sorted(main.client_code_to_analyzer))
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(client_codes, size=min(samples, len(client_codes)), replace=False)
+
+    # Онлайн-путь: срез по индексу на каждого клиента. Анализатор API открывает таблицу признаков
+    # из поколения, поэтому онлайн-путь меряется на отдельном анализаторе без производных массивов
+    from services.analytics import ONLINE, ClientAnalyzer
+    analyzer = ClientAnalyzer.from_store(store_dir, use_derived=False)
+
+    def diagnose_latencies() -> List[float]:
+        latencies = []
+        for client_code in sample:
+            started = time.perf_counter()
+            next(analyzer.recommend([int(client_code)], top_k=3, mode=ONLINE))
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    result['diagnose_online'] = _percentiles(diagnose_latencies())
+    assert analyzer._features is None, "online path must not build the feature table"
+
+    started = time.perf_counter()
+    features = analyzer.features
+    result['features_build_s'] = time.perf_counter() - started
+
+    # Тот же путь после сборки таблицы признаков — чтение строки
+    result['diagnose_features'] = _percentiles(diagnose_latencies())
+
+    # Полный путь /api/diagnose: маршрутизация, валидация, пул аналитики, кэш, сериализация
+    # (ASGI-приложение в процессе, без сети; каждый клиент запрашивается один раз — без попаданий в кэш)
+    from fastapi.testclient import TestClient
+    latencies = []
+    with TestClient(main.app) as client:
+        for client_code in sample:
+            started = time.perf_counter()
+            response = client.post('/api/diagnose', json={'client_code': int(client_code)})
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+    result['diagnose_http'] = _percentiles(latencies)
+
+    from services.scoring import score_batch
+    started = time.perf_counter()
+    score_batch(features.matrix(features.rows()))
+    elapsed = time.perf_counter() - started
+    result['batch_scoring'] = {'seconds': elapsed, 'clients_per_s': len(features.rows()) / elapsed}
+
+    started = time.perf_counter()
+    main._diagnose_many(client_codes.tolist())
+    elapsed = time.perf_counter() - started
+    result['diagnose_all'] = {'seconds': elapsed, 'clients_per_s': len(client_codes) / elapsed}
+
+    import csv_generator
+    output = os.path.join(store_dir, 'recommendations.csv')
+    started = time.perf_counter()
+    written = csv_generator.generate_recommendations_csv_sharded(output, data_dir, workers, chunk_size)
+    elapsed = time.perf_counter() - started
+    result['csv_sharded'] = {'seconds': elapsed, 'clients_per_s': written / elapsed, 'workers': workers,
+                             'chunk_size': chunk_size}
+
+    result['peak_rss_mb'] = _peak_rss_mb()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк анализатора, API и пакетной генерации")
+    parser.add_argument('--data-dir', help="готовые CSV; по умолчанию генерируются синтетические")
+    parser.add_argument('--clients', type=int, default=5000)
+    parser.add_argument('--transactions-per-client', type=int, default=300)
+    parser.add_argument('--transfers-per-client', type=int, default=300)
+    parser.add_argument('--clients-per-file', type=int, default=500)
+    parser.add_argument('--samples', type=int, default=1000, help="клиентов для замера задержки")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="куда записать JSON (по умолчанию — stdout)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        report = {
+            'commit': _git_commit(),
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'params': vars(args),
+        }
+        data_dir = args.data_dir
+        if data_dir is None:
+            data_dir = os.path.join(work_dir, 'data')
+            report['generate'] = generate(data_dir, args.clients, args.transactions_per_client,
+                                          args.transfers_per_client, args.clients_per_file, args.seed)
+        report['results'] = run(data_dir, os.path.join(work_dir, 'store'), args.samples, args.workers,
+                                args.chunk_size, args.seed)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Генератор синтетических данных в схеме data/client_*_transactions_3m.csv и *_transfers_3m.csv.
+
+Распределения категорий, типов переводов и медианы сумм по умолчанию взяты из выборки в data/;
+их можно переопределить JSON-файлом (--distributions) вида
+{"categories": {"Такси": [weight, median], ...}, "transfer_types": {"p2p_out": [weight, median], ...}}.
+
+    python -m benchmarks.synthetic_data --out-dir /tmp/bench_data --clients 100000 \\
+        --transactions-per-client 300 --transfers-per-client 300 --clients-per-file 1000
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from services.fx import FX_RATES_FILE
+from services.store import TRANSACTION_COLUMNS, TRANSFER_COLUMNS
+
+# Категория -> (вес, медиана суммы, ₸)
+CATEGORIES: Dict[str, Tuple[float, float]] = {
+    'АЗС': (432, 18800),
+    'Едим дома': (1922, 5000),
+    'Играем дома': (1809, 4900),
+    'Кафе и рестораны': (3652, 6800),
+    'Кино': (1648, 4900),
+    'Косметика и Парфюмерия': (118, 22200),
+    'Отели': (54, 49500),
+    'Продукты питания': (2948, 13700),
+    'Путешествия': (35, 61900),
+    'Развлечения': (25, 8100),
+    'Смотрим дома': (1856, 4800),
+    'Такси': (2901, 4900),
+    'Ювелирные украшения': (20, 150000),
+}
+
+# Тип перевода -> (вес, медиана суммы, ₸); направление задаётся суффиксом/типом
+TRANSFER_TYPES: Dict[str, Tuple[float, float]] = {
+    'atm_withdrawal': (1152, 35100),
+    'card_in': (981, 12500),
+    'card_out': (8829, 17800),
+    'cashback_in': (540, 12200),
+    'cc_repayment_out': (108, 90500),
+    'deposit_topup_out': (108, 70300),
+    'family_in': (18, 24300),
+    'fx_buy': (216, 184000),
+    'fx_sell': (54, 181200),
+    'gold_buy_out': (18, 1259600),
+    'gold_sell_in': (18, 1399900),
+    'installment_payment_out': (108, 43700),
+    'invest_in': (36, 92100),
+    'invest_out': (144, 125700),
+    'loan_payment_out': (612, 60100),
+    'p2p_out': (3600, 18200),
+    'refund_in': (360, 11900),
+    'salary_in': (171, 440900),
+    'stipend_in': (9, 37500),
+    'utilities_out': (918, 29600),
+}
+OUT_TYPES = {'atm_withdrawal', 'fx_buy'}
+
+NAMES = ['Айгерим', 'Данияр', 'Сабина', 'Арман', 'Камилла', 'Руслан', 'Алия', 'Ержан', 'Мадина', 'Тимур',
+         'Асель', 'Нуркен', 'Динара', 'Санжар', 'Жанель', 'Серик']
+PRODUCTS = ['Карта для путешествий', 'Премиальная карта', 'Кредитная карта', 'Обмен валют', 'Кредит наличными',
+            'Депозит Мультивалютный', 'Депозит Сберегательный', 'Депозит Накопительный', 'Инвестиции',
+            'Золотые слитки']
+STATUSES = ['Зарплатный клиент', 'Премиальный клиент', 'Стандартный клиент', 'Студент']
+CITIES = ['Алматы', 'Астана', 'Шымкент', 'Караганда', 'Павлодар', 'Кызылорда', 'Усть-Каменогорск', 'Тараз',
+          'Костанай']
+
+PERIOD_START = pd.Timestamp('2025-06-01')
+PERIOD_SECONDS = 92 * 24 * 3600
+EUR_SHARE = 0.001
+# Курс EUR на начало периода и недельный прирост, ₸ (для fx_rates.csv набора)
+EUR_RATE = (583.10, 3.1)
+
+
+def _direction(transfer_type: str) -> str:
+    if transfer_type in OUT_TYPES or transfer_type.endswith('_out'):
+        return 'out'
+    return 'in'
+
+
+def _sample(rng: np.random.Generator, table: Dict[str, Tuple[float, float]], size: int):
+    names = list(table)
+    weights = np.array([table[name][0] for name in names], dtype=np.float64)
+    medians = np.array([table[name][1] for name in names], dtype=np.float64)
+    codes = rng.choice(len(names), size=size, p=weights / weights.sum())
+    amounts = np.round(medians[codes] * rng.lognormal(0.0, 0.6, size=size), 2)
+    return np.array(names, dtype=object)[codes], amounts
+
+
+def _profiles(rng: np.random.Generator, client_codes: np.ndarray) -> pd.DataFrame:
+    n = len(client_codes)
+    return pd.DataFrame({
+        'client_code': client_codes,
+        'name': np.array(NAMES, dtype=object)[rng.integers(len(NAMES), size=n)],
+        'product': np.array(PRODUCTS, dtype=object)[rng.integers(len(PRODUCTS), size=n)],
+        'status': np.array(STATUSES, dtype=object)[rng.integers(len(STATUSES), size=n)],
+        'city': np.array(CITIES, dtype=object)[rng.integers(len(CITIES), size=n)],
+    })
+
+
+def _rows(rng: np.random.Generator, profiles: pd.DataFrame, per_client: int) -> pd.DataFrame:
+    """Профильные колонки и отсортированные даты для per_client строк на клиента"""
+    rows = profiles.loc[profiles.index.repeat(per_client)].reset_index(drop=True)
+    seconds = np.sort(rng.integers(PERIOD_SECONDS, size=(len(profiles), per_client)), axis=1).ravel()
+    rows['date'] = (PERIOD_START + pd.to_timedelta(seconds, unit='s')).strftime('%Y-%m-%d %H:%M:%S')
+    return rows
+
+
+def generate(out_dir: str, clients: int, transactions_per_client: int = 300, transfers_per_client: int = 300,
+             clients_per_file: int = 1, seed: int = 0, distributions: Optional[Dict] = None) -> Dict:
+    """Записать синтетические CSV; в файле client_{i}_* — clients_per_file клиентов подряд"""
+    categories = CATEGORIES
+    transfer_types = TRANSFER_TYPES
+    if distributions:
+        categories = {name: tuple(value) for name, value in distributions.get('categories', categories).items()}
+        transfer_types = {name: tuple(value)
+                          for name, value in distributions.get('transfer_types', transfer_types).items()}
+
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    files = 0
+    for first in range(1, clients + 1, clients_per_file):
+        client_codes = np.arange(first, min(first + clients_per_file, clients + 1))
+        profiles = _profiles(rng, client_codes)
+        file_no = (first - 1) // clients_per_file + 1
+
+        transactions = _rows(rng, profiles, transactions_per_client)
+        transactions['category'], transactions['amount'] = _sample(rng, categories, len(transactions))
+        transactions['currency'] = np.where(rng.random(len(transactions)) < EUR_SHARE, 'EUR', 'KZT')
+        transactions[TRANSACTION_COLUMNS].to_csv(
+            os.path.join(out_dir, f"client_{file_no}_transactions_3m.csv"), index=False, encoding='utf-8-sig')
+
+        transfers = _rows(rng, profiles, transfers_per_client)
+        transfers['type'], transfers['amount'] = _sample(rng, transfer_types, len(transfers))
+        transfers['direction'] = [_direction(t) for t in transfers['type']]
+        transfers['currency'] = 'KZT'
+        transfers[TRANSFER_COLUMNS].to_csv(
+            os.path.join(out_dir, f"client_{file_no}_transfers_3m.csv"), index=False, encoding='utf-8-sig')
+        files += 1
+
+    weeks = pd.date_range(PERIOD_START - pd.Timedelta(days=7), PERIOD_START + pd.Timedelta(seconds=PERIOD_SECONDS),
+                          freq='7D')
+    pd.DataFrame({'date': weeks.strftime('%Y-%m-%d'), 'currency': 'EUR',
+                  'rate': np.round(EUR_RATE[0] + EUR_RATE[1] * np.arange(-1, len(weeks) - 1), 2)}).to_csv(
+        os.path.join(out_dir, FX_RATES_FILE), index=False)
+
+    return {
+        'out_dir': out_dir,
+        'clients': clients,
+        'files': files,
+        'transactions': clients * transactions_per_client,
+        'transfers': clients * transfers_per_client,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетические данные клиентов для бенчмарков")
+    parser.add_argument('--out-dir', required=True)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--transactions-per-client', type=int, default=300)
+    parser.add_argument('--transfers-per-client', type=int, default=300)
+    parser.add_argument('--clients-per-file', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--distributions', help="JSON с весами и медианами категорий/типов переводов")
+    args = parser.parse_args()
+
+    distributions = None
+    if args.distributions:
+        with open(args.distributions, encoding='utf-8') as f:
+            distributions = json.load(f)
+
+    result = generate(args.out_dir, args.clients, args.transactions_per_client, args.transfers_per_client,
+                      args.clients_per_file, args.seed, distributions)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,274 +1,257 @@
-import pandas as pd
-import numpy as np
-from typing import Dict, List, Tuple
-from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import argparse
 import csv
+import heapq
+import math
 import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
+import pandas as pd
 
-class ClientAnalyzer:
-    def __init__(self, transactions_path: str, transfers_path: str):
-        self.transactions_df = pd.read_csv(transactions_path)
-        self.transfers_df = pd.read_csv(transfers_path)
-
-        # Преобразование дат
-        self.transactions_df['date'] = pd.to_datetime(self.transactions_df['date'])
-        self.transfers_df['date'] = pd.to_datetime(self.transfers_df['date'])
-
-    def get_all_clients(self) -> List[Dict]:
-        """Получить список всех клиентов"""
-        clients = self.transactions_df.groupby('client_code').first().reset_index()
-        return clients[['client_code', 'name', 'product', 'status', 'city']].to_dict('records')
-
-    def analyze_client(self, client_code: int) -> Dict:
-        """Анализ данных одного клиента"""
-        client_trans = self.transactions_df[self.transactions_df['client_code'] == client_code].copy()
-        client_transfers = self.transfers_df[self.transfers_df['client_code'] == client_code].copy()
-
-        if client_trans.empty:
-            return None
-
-        # Базовая информация
-        client_info = {
-            'client_code': client_code,
-            'name': client_trans['name'].iloc[0],
-            'status': client_trans['status'].iloc[0],
-            'city': client_trans['city'].iloc[0],
-        }
-
-        # Анализ транзакций
-        category_spending = client_trans.groupby('category')['amount'].agg(['sum', 'count']).round(2)
-        category_spending = category_spending.sort_values('sum', ascending=False)
-
-        # Анализ переводов
-        transfers_in = client_transfers[client_transfers['direction'] == 'in']
-        transfers_out = client_transfers[client_transfers['direction'] == 'out']
-
-        total_in = transfers_in['amount'].sum() if not transfers_in.empty else 0
-        total_out = transfers_out['amount'].sum() if not transfers_out.empty else 0
-        avg_monthly_balance = (total_in - total_out) / 3
-
-        # Метрики
-        metrics = {
-            'total_spending': float(client_trans['amount'].sum()),
-            'travel_spending': float(
-                client_trans[client_trans['category'].isin(['Путешествия', 'Отели', 'Такси'])]['amount'].sum()),
-            'restaurant_spending': float(client_trans[client_trans['category'] == 'Кафе и рестораны']['amount'].sum()),
-            'online_spending': float(
-                client_trans[client_trans['category'].isin(['Едим дома', 'Смотрим дома', 'Играем дома'])][
-                    'amount'].sum()),
-            'luxury_spending': float(
-                client_trans[client_trans['category'].isin(['Ювелирные украшения', 'Косметика и Парфюмерия'])][
-                    'amount'].sum()),
-            'has_fx': bool(
-                transfers_out['type'].isin(['fx_buy', 'fx_sell']).any()) if not transfers_out.empty else False,
-            'has_gold': bool(transfers_out['type'].isin(
-                ['gold_buy_out', 'gold_sell_in']).any()) if not transfers_out.empty else False,
-            'has_investments': bool(
-                transfers_out['type'].isin(['invest_out', 'invest_in']).any()) if not transfers_out.empty else False,
-            'atm_withdrawals': float(transfers_out[transfers_out['type'] == 'atm_withdrawal'][
-                                         'amount'].sum()) if not transfers_out.empty else 0,
-            'avg_monthly_balance': float(avg_monthly_balance),
-            'top_categories': category_spending.head(3).index.tolist()
-        }
-
-        client_info['metrics'] = metrics
-        return client_info
-
-    def calculate_product_scores(self, client_info: Dict) -> List[Tuple[str, float, float]]:
-        """Расчет выгоды и уверенности для каждого продукта"""
-        metrics = client_info['metrics']
-        products = []
-
-        # 1. Карта для путешествий
-        travel_benefit = metrics['travel_spending'] * 0.04
-        travel_confidence = min(95, 50 + (metrics['travel_spending'] / metrics['total_spending'] * 100) if metrics[
-                                                                                                               'total_spending'] > 0 else 0)
-        if travel_benefit > 1000:
-            products.append(('Карта для путешествий', travel_benefit, travel_confidence))
-
-        # 2. Премиальная карта
-        premium_benefit = metrics['total_spending'] * 0.02
-        premium_benefit += metrics['restaurant_spending'] * 0.02
-        premium_benefit += metrics['luxury_spending'] * 0.02
-        premium_confidence = min(92, 60 + (metrics['avg_monthly_balance'] / 500000 * 30) if metrics[
-                                                                                                'avg_monthly_balance'] > 0 else 60)
-        if metrics['avg_monthly_balance'] > 500000:
-            premium_benefit *= 1.5
-            products.append(('Премиальная карта', premium_benefit, premium_confidence))
-
-        # 3. Кредитная карта
-        credit_benefit = metrics['online_spending'] * 0.10
-        top_spending = sum([metrics.get(f'{cat.lower()}_spending', 0) for cat in metrics['top_categories'][:3]])
-        credit_benefit += top_spending * 0.10
-        credit_confidence = min(88, 70 + (metrics['online_spending'] / metrics['total_spending'] * 50) if metrics[
-                                                                                                              'total_spending'] > 0 else 70)
-        if credit_benefit > 2000:
-            products.append(('Кредитная карта', credit_benefit, credit_confidence))
-
-        # 4. Обмен валют
-        if metrics['has_fx']:
-            fx_confidence = 85
-            products.append(('Обмен валют', 50000, fx_confidence))
-
-        # 5. Депозиты
-        if metrics['avg_monthly_balance'] > 100000:
-            deposit_benefit = metrics['avg_monthly_balance'] * 0.15 / 12 * 3
-            if metrics['avg_monthly_balance'] > 1000000:
-                products.append(('Депозит сберегательный', deposit_benefit * 1.2, 90))
-            else:
-                products.append(('Депозит накопительный', deposit_benefit, 85))
-
-        # 6. Инвестиции
-        if metrics['has_investments'] or metrics['avg_monthly_balance'] > 500000:
-            invest_benefit = metrics['avg_monthly_balance'] * 0.20 / 12 * 3
-            products.append(('Инвестиции', invest_benefit, 82))
-
-        # 7. Золотые слитки
-        if metrics['has_gold']:
-            products.append(('Золотые слитки', 100000, 95))
-
-        # Сортировка по выгоде
-        products.sort(key=lambda x: x[1], reverse=True)
-        return products[:4]  # Топ-4 продукта
-
-    def generate_notification(self, client_info: Dict, product: str, metrics: Dict) -> str:
-        """Генерация персонализированного уведомления"""
-        name = client_info['name']
-
-        templates = {
-            'Карта для путешествий': f"{name}, в последние месяцы у вас много расходов на поездки и такси ({metrics['travel_spending']:.0f} ₸). С картой для путешествий вернули бы {metrics['travel_spending'] * 0.04:.0f} ₸ кешбэка. Оформить карту.",
-
-            'Премиальная карта': f"{name}, у вас стабильный остаток на счету и активные траты. Премиальная карта даст до 4% кешбэка и бесплатные снятия. Подключить сейчас.",
-
-            'Кредитная карта': f"{name}, ваши топ-категории — {', '.join(metrics['top_categories'][:2])}. Кредитная карта даёт до 10% в любимых категориях. Оформить карту.",
-
-            'Обмен валют': f"{name}, вы совершаете валютные операции. В приложении выгодный обмен без скрытых комиссий. Настроить обмен.",
-
-            'Депозит накопительный': f"{name}, у вас остаются свободные средства. Разместите их на вкладе — получайте до 15% годовых. Открыть вклад.",
-
-            'Депозит сберегательный': f"{name}, ваш высокий остаток может работать. Сберегательный депозит даст максимальную ставку. Открыть вклад.",
-
-            'Инвестиции': f"{name}, попробуйте инвестиции с низким порогом входа. Начните с малого. Открыть счёт.",
-
-            'Золотые слитки': f"{name}, вы уже инвестируете в золото. Расширьте портфель с выгодными условиями. Узнать больше.",
-
-            'Кредит наличными': f"{name}, нужны средства на крупные покупки? Кредит с гибкими условиями. Узнать лимит."
-        }
-
-        notification = templates.get(product, f"{name}, откройте новые возможности с {product}. Узнать больше.")
+from services import config
+from services.analytics import OFFLINE, ClientAnalyzer, recommend_features
+from services.manifest import file_pairs
+from services.streaming import stream_data_dir, stream_features
 
-        if len(notification) > 220:
-            notification = notification[:217] + "..."
 
-        return notification
+FIELDNAMES = ['client_code', 'product', 'push_notification']
 
 
-def generate_recommendations_csv(output_file: str = "client_recommendations.csv"):
+def _best_recommendations(analyzers: List[ClientAnalyzer]) -> List[Dict]:
     """
-    Генерирует CSV файл с рекомендациями для всех клиентов
+    Лучшая рекомендация и уведомление для каждого клиента — офлайн-стратегия общего движка
+    (таблица признаков и пакетный скоринг), та же логика, что и в API
     """
-
-    # Хранилище результатов
     recommendations = []
-
-    # Инициализация анализаторов для всех 60 клиентов
-    for i in range(60):
+    for analyzer in analyzers:
+        for client_code, client_info, products in analyzer.recommend(top_k=1, mode=OFFLINE):
+            if products:  # Если есть хотя бы одна рекомендация
+                best_product, benefit, confidence, notification = products[0]
+                recommendations.append({
+                    'client_code': int(client_code),
+                    'product': best_product,
+                    'push_notification': notification
+                })
+    return recommendations
+
+
+def _print_product_stats(product_stats: Dict[str, int]):
+    print("\nProduct recommendations statistics:")
+    for product, count in sorted(product_stats.items(), key=lambda x: x[1], reverse=True):
+        print(f"  {product}: {count}")
+
+
+def _first_client_code(pair: Tuple[str, str]) -> float:
+    """Наименьший client_code файла транзакций (рекомендации строятся по клиентам с транзакциями)"""
+    try:
+        codes = pd.read_csv(pair[0], usecols=['client_code'])['client_code']
+    except Exception:
+        # Файл не читается — анализатор пары тоже не соберётся (ошибка будет в _process_shard)
+        return math.inf
+    return float(codes.min()) if len(codes) else math.inf
+
+
+def _process_shard(pairs: List[Tuple[str, str]]) -> List[Dict]:
+    """Рекомендации для одного шарда файловых пар (выполняется в процессе-воркере)"""
+    analyzers = []
+    for transactions_file, transfers_file in pairs:
         try:
-            transactions_file = f"data/client_{i + 1}_transactions_3m.csv"
-            transfers_file = f"data/client_{i + 1}_transfers_3m.csv"
-
-            # Проверяем существование файлов
-            if not os.path.exists(transactions_file) or not os.path.exists(transfers_file):
-                print(f"Warning: Files for client {i + 1} not found, skipping...")
-                continue
-
-            # Создаем анализатор
-            analyzer = ClientAnalyzer(transactions_file, transfers_file)
-
-            # Получаем всех клиентов из этого файла
-            clients = analyzer.get_all_clients()
-
-            for client in clients:
-                client_code = client['client_code']
-
-                try:
-                    # Анализируем клиента
-                    client_info = analyzer.analyze_client(client_code)
-                    if not client_info:
-                        continue
-
-                    # Получаем топ рекомендации
-                    products = analyzer.calculate_product_scores(client_info)
-
-                    if products:  # Если есть хотя бы одна рекомендация
-                        # Берем лучшую рекомендацию
-                        best_product, benefit, confidence = products[0]
+            analyzers.append(ClientAnalyzer(transactions_file, transfers_file))
+        except Exception as e:
+            print(f"Error initializing analyzer for {transactions_file}: {e}")
+    return sorted(_best_recommendations(analyzers), key=lambda rec: rec['client_code'])
 
-                        # Генерируем персонализированное уведомление
-                        notification = analyzer.generate_notification(
-                            client_info,
-                            best_product,
-                            client_info['metrics']
-                        )
 
-                        # Добавляем в результаты
-                        recommendations.append({
-                            'client_code': client_code,
-                            'product': best_product,
-                            'push_notification': notification
-                        })
+def _plan_shards(pairs: List[Tuple[str, str]], first_codes: List[float],
+                 chunk_size: int) -> Tuple[List[List[Tuple[str, str]]], List[float]]:
+    """
+    Шарды по chunk_size файловых пар в порядке наименьшего client_code пары и нижние границы
+    client_code шардов (не убывают от шарда к шарду)
+    """
+    order = sorted(range(len(pairs)), key=lambda i: first_codes[i])
+    starts = range(0, len(order), chunk_size)
+    shards = [[pairs[i] for i in order[start:start + chunk_size]] for start in starts]
+    return shards, [first_codes[order[start]] for start in starts]
 
-                        print(f"Processed client {client_code}: {best_product}")
 
-                except Exception as e:
-                    print(f"Error processing client {client_code}: {e}")
-                    continue
+def _in_client_order(completed: Iterable[Tuple[int, List[Dict]]], lower_bounds: List[float]) -> Iterator[Dict]:
+    """
+    Строки шардов по возрастанию client_code. completed — (номер шарда, его строки по client_code)
+    в любом порядке завершения; строка отдаётся, как только она меньше нижней границы всех
+    незавершённых шардов, так что в памяти только строки, которые ещё нельзя записать.
+    """
+    rows: Dict[int, List[Dict]] = {}
+    heap: List[Tuple[int, int, int]] = []
+    finished = set()
+    low = 0
+    for shard, shard_rows in completed:
+        finished.add(shard)
+        if shard_rows:
+            rows[shard] = shard_rows
+            heapq.heappush(heap, (shard_rows[0]['client_code'], shard, 0))
+        while low in finished:
+            finished.discard(low)
+            low += 1
+        bound = lower_bounds[low] if low < len(lower_bounds) else math.inf
+        while heap and heap[0][0] < bound:
+            _, shard, i = heapq.heappop(heap)
+            yield rows[shard][i]
+            if i + 1 < len(rows[shard]):
+                heapq.heappush(heap, (rows[shard][i + 1]['client_code'], shard, i + 1))
+            else:
+                del rows[shard]
 
-        except Exception as e:
-            print(f"Error initializing analyzer for client {i + 1}: {e}")
-            continue
 
-    # Записываем результаты в CSV
-    if recommendations:
-        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['client_code', 'product', 'push_notification']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+def _write_recommendations(output_file: str, recommendations: Iterable[Dict]) -> Tuple[int, Dict[str, int]]:
+    """Записать строки в CSV по мере поступления: (сколько записано, статистика по продуктам)"""
+    product_stats: Dict[str, int] = {}
+    written = 0
+    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for rec in recommendations:
+            writer.writerow(rec)
+            product_stats[rec['product']] = product_stats.get(rec['product'], 0) + 1
+            written += 1
+    return written, product_stats
 
-            writer.writeheader()
-            for rec in recommendations:
-                writer.writerow(rec)
 
-        print(f"\nСуccessfully generated {output_file} with {len(recommendations)} recommendations")
+def generate_recommendations_csv(output_file: str = "client_recommendations.csv", data_dir: str = "data") -> int:
+    """
+    Генерирует CSV файл с рекомендациями для всех клиентов из файловых пар data_dir.
+    Пары обрабатываются по одной (в памяти один анализатор), строки пишутся по мере расчёта
+    в порядке client_code — как и в шардированном режиме
+    """
+    pairs = file_pairs(data_dir)
+    shards, lower_bounds = _plan_shards(pairs, [_first_client_code(pair) for pair in pairs], 1)
+    written, product_stats = _write_recommendations(
+        output_file, _in_client_order(((i, _process_shard(shard)) for i, shard in enumerate(shards)), lower_bounds))
 
+    if written:
+        print(f"\nСуccessfully generated {output_file} with {written} recommendations")
         # Показываем статистику по продуктам
-        product_stats = {}
-        for rec in recommendations:
-            product = rec['product']
-            product_stats[product] = product_stats.get(product, 0) + 1
+        _print_product_stats(product_stats)
+    else:
+        print("No recommendations generated!")
+    return written
 
-        print("\nProduct recommendations statistics:")
-        for product, count in sorted(product_stats.items(), key=lambda x: x[1], reverse=True):
-            print(f"  {product}: {count}")
 
+def _completed_shards(executor: ProcessPoolExecutor, shards: List[List[Tuple[str, str]]],
+                      max_pending: int) -> Iterator[Tuple[int, List[Dict]]]:
+    """
+    (номер шарда, строки) по мере завершения. В работе не больше max_pending шардов, считая
+    от первого незавершённого: шарды, которые ждут его, чтобы попасть в файл, не копятся без меры
+    """
+    pending = {}
+    finished = set()
+    next_submit = 0
+    low = 0
+    while low < len(shards):
+        while next_submit < len(shards) and next_submit - low < max_pending:
+            pending[executor.submit(_process_shard, shards[next_submit])] = next_submit
+            next_submit += 1
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            shard = pending.pop(future)
+            finished.add(shard)
+            yield shard, future.result()
+        while low in finished:
+            finished.discard(low)
+            low += 1
+
+
+def generate_recommendations_csv_sharded(output_file: str = "client_recommendations.csv", data_dir: str = "data",
+                                         workers: int = os.cpu_count() or 1, chunk_size: int = 8) -> int:
+    """
+    Параллельная генерация CSV: файловые пары делятся на шарды по chunk_size и
+    обрабатываются в ProcessPoolExecutor. Строки готовых шардов сливаются по client_code
+    и дописываются в файл, как только ни один незавершённый шард не может дать client_code
+    меньше (нижние границы шардов — по первому client_code файлов, читается только эта колонка).
+    Вывод детерминирован и совпадает с однопроцессным, а в памяти держатся только строки,
+    ожидающие своей очереди.
+    """
+    pairs = file_pairs(data_dir)
+    workers = max(1, workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        first_codes = list(executor.map(_first_client_code, pairs, chunksize=max(1, len(pairs) // (workers * 4))))
+        shards, lower_bounds = _plan_shards(pairs, first_codes, chunk_size)
+        written, product_stats = _write_recommendations(
+            output_file, _in_client_order(_completed_shards(executor, shards, workers * 2), lower_bounds))
+
+    print(f"\nСуccessfully generated {output_file} with {written} recommendations "
+          f"({len(shards)} shards, {workers} workers)")
+    _print_product_stats(product_stats)
+    return written
+
+
+def generate_recommendations_csv_streaming(output_file: str = "client_recommendations.csv", data_dir: str = "data",
+                                           chunk_rows: int = config.STREAM_CHUNK_ROWS,
+                                           transactions: Optional[List[str]] = None,
+                                           transfers: Optional[List[str]] = None) -> int:
+    """
+    Генерация CSV для данных больше памяти: CSV читаются блоками по chunk_rows строк и сворачиваются
+    в таблицу признаков (services/streaming.py), рекомендации пишутся в файл по мере пакетного расчёта.
+    transactions/transfers — явные списки CSV (например, полная выгрузка), иначе — CSV из data_dir.
+    """
+    if transactions or transfers:
+        features = stream_features(transactions or [], transfers or [], chunk_rows)
     else:
-        print("No recommendations generated!")
+        features = stream_data_dir(data_dir, chunk_rows)
+
+    product_stats: Dict[str, int] = {}
+    written = 0
+    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for client_code, client_info, products in recommend_features(features, top_k=1):
+            if products:
+                best_product, benefit, confidence, notification = products[0]
+                writer.writerow({'client_code': int(client_code), 'product': best_product,
+                                 'push_notification': notification})
+                product_stats[best_product] = product_stats.get(best_product, 0) + 1
+                written += 1
+
+    print(f"\nСуccessfully generated {output_file} with {written} recommendations "
+          f"(streaming, {chunk_rows} rows per chunk)")
+    _print_product_stats(product_stats)
+    return written
 
 
 def main():
     """
     Основная функция для запуска генерации CSV
     """
+    parser = argparse.ArgumentParser(description="Генерация CSV с рекомендациями для клиентов")
+    parser.add_argument('--output', default="client_recommendations.csv")
+    parser.add_argument('--data-dir', default="data")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="число процессов; больше 1 — шардированный режим")
+    parser.add_argument('--chunk-size', type=int, default=8, help="файловых пар в одном шарде")
+    parser.add_argument('--stream', action='store_true',
+                        help="потоковый режим для данных больше памяти: CSV читаются блоками")
+    parser.add_argument('--chunk-rows', type=int, default=config.STREAM_CHUNK_ROWS,
+                        help="строк CSV в одном блоке потокового режима")
+    parser.add_argument('--transactions', nargs='+', help="CSV транзакций для потокового режима (вместо --data-dir)")
+    parser.add_argument('--transfers', nargs='+', help="CSV переводов для потокового режима (вместо --data-dir)")
+    args = parser.parse_args()
+
     print("Starting CSV generation for client recommendations...")
     print("This process will analyze all available client data and generate recommendations.")
     print("-" * 70)
 
     # Генерируем CSV файл
-    generate_recommendations_csv("client_recommendations.csv")
+    if args.stream:
+        generate_recommendations_csv_streaming(args.output, args.data_dir, args.chunk_rows,
+                                               args.transactions, args.transfers)
+    elif args.workers > 1:
+        generate_recommendations_csv_sharded(args.output, args.data_dir, args.workers, args.chunk_size)
+    else:
+        generate_recommendations_csv(args.output, args.data_dir)
 
     print("-" * 70)
     print("Process completed!")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
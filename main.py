@@ -1,11 +1,51 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import asyncio
-from services.analytics import ClientAnalyzer
+import os
+import threading
+import time
+from services import config
+from services.analytics import OFFLINE, ONLINE, ClientAnalyzer
+from services.analyzer_pool import AnalyzerPool
+from services.cache import ResultCache
+from services.concurrency import AnalyticsPool, PoolOverloaded
+from services.directory import ClientDirectory
+from services.ingest import apply_delta, read_delta
+from services.jobs import JobManager, chunked
+from services.loader import derive_generation
+from services.manifest import load_manifest
+from services.metrics import REGISTRY, REQUEST_SECONDS, REQUESTS_TOTAL, stage_timer
+from services.outbox import JournalLocked, Outbox, make_sink
+from services.profiler import SamplingProfiler
+from services.segments import DIMENSIONS
+from services.serialization import JSON, NDJSON, available_types, encode, json_value, ndjson_line, negotiate
+from services.simulator import SIMULATION_TOP_K, parameter_grid, simulate
+from services.store import current_generation, ensure_store, store_exists
+from services.templates import get_templates, reload_templates
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Outbox поднимает недоставленное из журнала при старте и останавливается вместе с приложением;
+    # недоставленное остаётся в журнале до следующего запуска
+    global outbox, outbox_error
+    if outbox is not None:
+        try:
+            await outbox.start()
+        except JournalLocked as e:
+            # uvicorn --workers N: журнал ведёт воркер, который первым взял блокировку; в этом outbox выключен
+            print(f"Warning: outbox disabled in this worker: {e}")
+            outbox, outbox_error = None, str(e)
+    yield
+    if outbox is not None:
+        await outbox.stop()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS настройки
 app.add_middleware(
@@ -19,6 +59,25 @@ app.add_middleware(
 
 class ClientRequest(BaseModel):
     client_code: int
+    # Локаль текстов уведомлений (по умолчанию — config.NOTIFICATION_LOCALE или локаль шаблонов)
+    locale: Optional[str] = None
+
+
+class ClientBatchRequest(BaseModel):
+    client_codes: List[int]
+    locale: Optional[str] = None
+
+
+class OutboxPushRequest(BaseModel):
+    # None — все клиенты
+    client_codes: Optional[List[int]] = None
+    locale: Optional[str] = None
+
+
+class SimulationRequest(BaseModel):
+    # Параметр ScoringParams -> значения; сценарии — все сочетания
+    grid: Dict[str, List[float]] = {}
+    top_k: int = SIMULATION_TOP_K
 
 
 class Recommendation(BaseModel):
@@ -32,152 +91,757 @@ class DiagnosticResponse(BaseModel):
     recommendations: List[Recommendation]
 
 
+class IngestRequest(BaseModel):
+    # Имена CSV-файлов дельты в config.INGEST_DIR
+    transactions_file: Optional[str] = None
+    transfers_file: Optional[str] = None
+    window_days: Optional[int] = None
+
+
 # Хранилище созданных анализаторов и маппинг client_code -> analyzer
 analyzers: List[ClientAnalyzer] = []
 client_code_to_analyzer: Dict[int, ClientAnalyzer] = {}
+# Справочник клиентов для /api/clients, пересобирается вместе с анализаторами
+client_directory = ClientDirectory.from_analyzers([])
+# Ленивый режим (config.ANALYZER_MODE == "lazy"): анализаторы шардов по манифесту, с вытеснением
+analyzer_pool: Optional[AnalyzerPool] = None
+# Ошибка последней загрузки данных (для /api/ready)
+load_error: Optional[str] = None
+
+# Дельты /api/ingest применяются по одной: каждая — к копии последнего опубликованного анализатора
+ingest_lock = threading.Lock()
+
+# Пул для синхронной аналитики с ограничением параллелизма и очереди
+analytics_pool = AnalyticsPool(
+    workers=config.ANALYTICS_WORKERS,
+    max_concurrency=config.ANALYTICS_MAX_CONCURRENCY,
+    max_queue=config.ANALYTICS_MAX_QUEUE,
+)
+
+# Фоновые задания диагностики всех клиентов
+job_manager = JobManager(analytics_pool, chunk_size=config.JOB_CHUNK_SIZE, max_jobs=config.JOB_RETENTION)
+
+# Кэш результатов диагностики: ключ — (client_code, версия данных анализатора)
+result_cache = ResultCache(max_size=config.RESULT_CACHE_SIZE, ttl=config.RESULT_CACHE_TTL)
+
+# Outbox push-уведомлений (по умолчанию выключен, см. config.OUTBOX_SINK). Журнал config.OUTBOX_JOURNAL
+# ведёт один процесс: при нескольких воркерах outbox работает в одном из них, в остальных
+# /api/outbox* отвечают 409 с причиной из outbox_error
+outbox: Optional[Outbox] = None
+outbox_error: Optional[str] = None
+if config.OUTBOX_SINK:
+    outbox = Outbox(make_sink(config.OUTBOX_SINK,
+                              config.OUTBOX_URL if config.OUTBOX_SINK == "http" else config.OUTBOX_PATH))
+
+# Профилировщик медленных запросов (по умолчанию выключен, см. config.PROFILE_SLOW_MS)
+profiler = SamplingProfiler(config.PROFILE_DIR, slow_ms=config.PROFILE_SLOW_MS,
+                            interval_ms=config.PROFILE_INTERVAL_MS)
+
+# Состояние пула и кэша читается в момент запроса /metrics
+REGISTRY.register_stats("analytics_pool", "Пул аналитики", analytics_pool.stats)
+REGISTRY.register_stats("result_cache", "Кэш результатов диагностики", lambda: result_cache.stats())
+REGISTRY.register_stats("analyzer_pool", "Пул анализаторов шардов",
+                        lambda: analyzer_pool.stats() if analyzer_pool is not None else {})
+REGISTRY.register_stats("outbox", "Outbox push-уведомлений", lambda: outbox.stats() if outbox is not None else {})
+REGISTRY.gauge("clients_loaded", "Клиентов в загруженных данных", function=lambda: len(client_directory))
+
+
+def _load_lazy(rebuild: bool) -> bool:
+    """Ленивый режим: открыть манифест, анализаторы шардов загружаются по первому запросу"""
+    global analyzers, client_code_to_analyzer, client_directory, analyzer_pool
+
+    manifest, rebuilt = load_manifest(config.DATA_DIR, config.MANIFEST_PATH, rebuild)
+    pool = AnalyzerPool(manifest, max_analyzers=config.ANALYZER_POOL_SIZE,
+                        max_bytes=int(config.ANALYZER_POOL_MAX_MB * 1024 * 1024))
+
+    # Прогрев запускается до публикации пула: /api/ready не увидит пул без состояния прогрева
+    warmup = min(config.ANALYZER_WARMUP, len(manifest.shards))
+    if warmup > 0:
+        pool.start_warm_up(range(warmup))
 
-# Инициализация анализаторов
-for i in range(60):
+    analyzers, client_code_to_analyzer, analyzer_pool = [], {}, pool
+    client_directory = ClientDirectory(manifest.clients, manifest.source)
+    result_cache.invalidate()
+    return rebuilt
+
+
+def load_analyzers(rebuild: bool = False) -> bool:
+    """
+    Открыть текущее поколение колоночного хранилища (собрав его из CSV, если его нет или rebuild
+    и исходные данные изменились) и подменить analyzers / client_code_to_analyzer. Возвращает True,
+    если хранилище (или манифест в ленивом режиме) пересобиралось.
+    При config.STORE_AUTO_BUILD = 0 хранилище не собирается — его собирает services/loader.py.
+    """
+    global analyzers, client_code_to_analyzer, client_directory, analyzer_pool
+
+    # Тексты уведомлений перечитываются вместе с данными; кэш результатов сбрасывается ниже
+    reload_templates()
+
+    if config.ANALYZER_MODE == "lazy":
+        return _load_lazy(rebuild)
+
+    rebuilt = False
+    if config.STORE_AUTO_BUILD:
+        # Воркеры собирают по очереди (блокировка в ensure_store): первый собирает, остальные открывают
+        rebuilt = ensure_store(config.DATA_DIR, config.STORE_DIR, rebuild, derive=derive_generation)
+    elif not store_exists(config.STORE_DIR):
+        raise RuntimeError(f"Column store {config.STORE_DIR} is not built yet (python -m services.loader)")
+
+    # Сводка по сегментам и индекс похожих клиентов открываются из поколения, если loader их записал;
+    # иначе строятся по первому запросу /api/segments и /api/lookalikes (в пуле), а не при старте
+    analyzer = ClientAnalyzer.from_store(config.STORE_DIR)
+    mapping = {c["client_code"]: analyzer for c in analyzer.get_all_clients()}
+
+    analyzers, client_code_to_analyzer, analyzer_pool = [analyzer], mapping, None
+    client_directory = ClientDirectory.from_analyzers(analyzers)
+    result_cache.invalidate()
+    return rebuilt
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """
+    Гистограмма времени ответа и счётчик запросов по эндпоинтам (шаблон пути, а не сам путь);
+    медленные запросы — в профилировщик. Для потоковых ответов меряется время до первого байта.
+    """
+    started = time.perf_counter()
+    token = profiler.begin()
+    status = 500
     try:
-        analyzer = ClientAnalyzer(
-            f"data/client_{i+1}_transactions_3m.csv",
-            f"data/client_{i+1}_transfers_3m.csv",
-        )
-        analyzers.append(analyzer)
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        REQUEST_SECONDS.observe(elapsed, method=request.method, path=path)
+        REQUESTS_TOTAL.inc(method=request.method, path=path, status=status)
+        profiler.end(token, f"{request.method} {path}", elapsed)
 
 
-        try:
-            clients_part = analyzer.get_all_clients()
-            if isinstance(clients_part, list):
-                for c in clients_part:
-                    cid = c.get("client_code")
-                    if cid is not None:
-                        # если несколько анализаторов возвращают один и тот же client_code,
-                        # последний перезапишет, что обычно нормально (или можно сохранить список)
-                        client_code_to_analyzer[cid] = analyzer
-        except Exception:
-            # Если analyzer не поддерживает get_all_clients или упал — пропускаем маппинг
-            pass
+def _shard_of(client_code: int):
+    """Ключ, по которому группируются клиенты: анализатор (режим store) или номер шарда (lazy)"""
+    if analyzer_pool is not None:
+        return analyzer_pool.manifest.shard_of(client_code)
+    return client_code_to_analyzer.get(client_code)
 
-    except Exception as e:
-        print(f"Warning: failed to initialize analyzer for client {i+1}: {e}")
-        continue
 
+def _get_analyzer(shard) -> ClientAnalyzer:
+    """Анализатор по ключу из _shard_of; в ленивом режиме может загрузить шард (вызывать в пуле)"""
+    return analyzer_pool.get(shard) if analyzer_pool is not None else shard
 
-@app.get("/api/clients")
-async def get_clients():
+
+def _all_client_codes() -> List[int]:
+    """Все client_code по возрастанию"""
+    if analyzer_pool is not None:
+        return analyzer_pool.manifest.client_codes.tolist()
+    return sorted(client_code_to_analyzer.keys())
+
+
+def _data_version(client_code: int):
+    """Версия данных клиента для ключа кэша — без загрузки шарда"""
+    if analyzer_pool is not None:
+        return analyzer_pool.manifest.version_of(client_code)
+    analyzer = client_code_to_analyzer.get(client_code)
+    # revision — номер дельты /api/ingest: результат, посчитанный по прежнему анализатору, не попадёт под новый ключ
+    return (analyzer.version, analyzer.revision) if analyzer is not None else None
+
+
+def _loaded_generation() -> Optional[str]:
+    return analyzers[0].generation if analyzers else None
+
+
+def _watch_generations():
     """
-    Возвращает агрегированный список клиентов (уникальные по client_code).
+    Переключение на новое поколение хранилища, опубликованное другим процессом (загрузчиком,
+    services.ingest или соседним воркером): раз в config.STORE_POLL_SECONDS читается CURRENT.
     """
-    clients: List[Dict[str, Any]] = []
-    seen_client_codes = set()
+    global load_error
 
-    # Если есть метод get_all_clients у анализаторов — соберём их
-    for analyzer in analyzers:
+    while True:
+        time.sleep(config.STORE_POLL_SECONDS)
         try:
-            part = analyzer.get_all_clients()
-            for c in part:
-                cid = c.get("client_code")
-                if cid is None:
-                    continue
-                if cid not in seen_client_codes:
-                    seen_client_codes.add(cid)
-                    clients.append(c)
+            generation = current_generation(config.STORE_DIR)
+            if generation is not None and generation != _loaded_generation():
+                load_analyzers()
+                load_error = None
         except Exception as e:
-            print(f"Warning: failed to read clients from one analyzer: {e}")
-            continue
+            load_error = str(e)
 
-    # Если не удалось получить через get_all_clients, можно заполнить из маппинга
-    if not clients and client_code_to_analyzer:
-        for cid in client_code_to_analyzer.keys():
-            clients.append({"client_code": cid})
 
-    if not clients:
-        raise HTTPException(status_code=404, detail="Клиенты не найдены")
+# Инициализация анализатора: колоночное хранилище собирается из CSV один раз,
+# дальше все процессы открывают его через mmap
+try:
+    load_analyzers()
+except Exception as e:
+    load_error = str(e)
+    print(f"Warning: failed to open column store {config.STORE_DIR}: {e}")
 
-    return {"clients": clients}
+if config.ANALYZER_MODE != "lazy" and config.STORE_POLL_SECONDS > 0:
+    threading.Thread(target=_watch_generations, name="store-generations", daemon=True).start()
 
 
-@app.post("/api/diagnose", response_model=DiagnosticResponse)
-async def diagnose_client(request: ClientRequest) -> DiagnosticResponse:
+@app.get("/api/clients")
+async def get_clients(
+        response: Response,
+        offset: int = Query(0, ge=0),
+        limit: Optional[int] = Query(None, ge=1),
+        status: Optional[str] = None,
+        city: Optional[str] = None,
+        if_none_match: Optional[str] = Header(None),
+):
     """
-    Запустить диагностику для одного клиента (по client_code).
+    Возвращает список клиентов (уникальные по client_code) из справочника, собранного при загрузке.
+    Поддерживает пагинацию (offset/limit), фильтры status и city и ETag / If-None-Match.
     """
-    try:
-        # Небольшая имитация задержки для UX; не блокирует event loop.
-        await asyncio.sleep(0.1)
-
-        analyzer = client_code_to_analyzer.get(request.client_code)
-        if analyzer is None:
-            raise HTTPException(status_code=404, detail="Клиент не найден (analyzer не найден)")
+    directory = client_directory
+    if not len(directory):
+        raise HTTPException(status_code=404, detail="Клиенты не найдены")
 
-        client_info = analyzer.analyze_client(request.client_code)
-        if not client_info:
-            raise HTTPException(status_code=404, detail="Клиент не найден (данные)")
+    etag = directory.etag(offset, limit, status, city)
+    if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
 
-        products = analyzer.calculate_product_scores(client_info)
+    total, clients = directory.page(offset, limit, status, city)
+    response.headers["ETag"] = etag
+    return {"clients": clients, "total": total, "offset": offset, "limit": limit}
 
-        recommendations: List[Recommendation] = []
-        for product, benefit, confidence in products[:3]:  # Топ-3 рекомендации
-            message = analyzer.generate_notification(client_info, product, client_info.get("metrics", {}))
-            recommendations.append(Recommendation(
-                product=product,
-                message=message,
-                confidence=float(confidence)
-            ))
 
+def _diagnose_client(client_code: int, locale: Optional[str] = None) -> DiagnosticResponse:
+    """
+    Синхронная часть диагностики: анализ, скоринг, уведомления (выполняется в пуле).
+    Онлайн-стратегия движка — срез данных одного клиента, без таблицы признаков.
+    """
+    shard = _shard_of(client_code)
+    if shard is None:
+        raise HTTPException(status_code=404, detail="Клиент не найден (analyzer не найден)")
+    analyzer = _get_analyzer(shard)
+
+    # Топ-3 рекомендации
+    _, client_info, products = next(analyzer.recommend([client_code], top_k=3, mode=ONLINE, locale=locale))
+    if not client_info:
+        raise HTTPException(status_code=404, detail="Клиент не найден (данные)")
+
+    recommendations: List[Recommendation] = []
+    for product, benefit, confidence, message in products:
+        recommendations.append(Recommendation(
+            product=product,
+            message=message,
+            confidence=float(confidence)
+        ))
+
+    with stage_timer("response_model"):
         return DiagnosticResponse(
-            client_name=client_info.get("name", f"client_{request.client_code}"),
+            client_name=client_info.get("name", f"client_{client_code}"),
             recommendations=recommendations
         )
 
+
+@app.post("/api/diagnose", response_model=DiagnosticResponse)
+async def diagnose_client(request: ClientRequest) -> DiagnosticResponse:
+    """
+    Запустить диагностику для одного клиента (по client_code).
+    """
+    try:
+        # Имитация задержки для UX — только если включена в конфиге
+        if config.DIAGNOSE_DELAY > 0:
+            await asyncio.sleep(config.DIAGNOSE_DELAY)
+
+        locale = request.locale or config.NOTIFICATION_LOCALE
+        version = (_data_version(request.client_code), get_templates().version, locale)
+        cached = result_cache.get(request.client_code, version)
+        if cached is not None:
+            return cached
+
+        # pandas/numpy-часть не выполняется на event loop
+        response = await analytics_pool.run(_diagnose_client, request.client_code, locale)
+        result_cache.put(request.client_code, version, response)
+        return response
+
     except HTTPException:
         raise
+    except PoolOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/diagnose_all")
-async def diagnose_all():
+def _diagnose_window(client_code: int, months: int, locale: Optional[str]) -> Dict[str, Any]:
+    """Диагностика по последним months месяцам календарного куба (выполняется в пуле)"""
+    shard = _shard_of(client_code)
+    if shard is None:
+        raise HTTPException(status_code=404, detail="Клиент не найден (analyzer не найден)")
+    result = _get_analyzer(shard).recommend_window(client_code, months, top_k=3, locale=locale)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Клиент не найден (данные)")
+    client_info, products = result
+    return {
+        "client_code": client_code,
+        "client_name": client_info.get("name"),
+        "window_months": client_info["window_months"],
+        "metrics": client_info["metrics"],
+        "recommendations": [
+            {"product": product, "message": message, "confidence": float(confidence)}
+            for product, benefit, confidence, message in products
+        ],
+    }
+
+
+@app.get("/api/diagnose/window")
+async def diagnose_window(client_code: int, months: int = Query(1, ge=1), locale: Optional[str] = None):
+    """
+    Диагностика за последние months календарных месяцев данных: метрики окна (траты, баланс,
+    последний месяц, тренд к предыдущему месяцу, регулярность зарплаты) из предвычисленного куба
+    клиент x месяц и рекомендации по ним — без прохода по строкам транзакций.
+    Окно больше числа месяцев в данных сужается до всех данных.
+    """
+    try:
+        return await analytics_pool.run(_diagnose_window, client_code, months,
+                                        locale or config.NOTIFICATION_LOCALE)
+    except PoolOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/api/stats")
+async def get_stats():
+    """Состояние пула аналитики (очередь, время ожидания), кэша результатов и пула анализаторов"""
+    stats = {"analytics_pool": analytics_pool.stats(), "result_cache": result_cache.stats(),
+             "store_generation": _loaded_generation()}
+    if analyzer_pool is not None:
+        stats["analyzer_pool"] = analyzer_pool.stats()
+    return stats
+
+
+@app.get("/api/ready")
+async def ready(response: Response):
+    """
+    Готовность к приёму трафика: данные открыты, клиенты есть, прогрев шардов (ленивый режим,
+    config.ANALYZER_WARMUP) завершён. Пока не готов — 503.
+    """
+    warmup = analyzer_pool.warmup if analyzer_pool is not None else {"done": True}
+    is_ready = load_error is None and len(client_directory) > 0 and warmup["done"]
+    if not is_ready:
+        response.status_code = 503
+    state = {
+        "ready": is_ready,
+        "mode": config.ANALYZER_MODE,
+        "clients": len(client_directory),
+        "generation": _loaded_generation(),
+        "error": load_error,
+        "warmup": dict(warmup),
+    }
+    if analyzer_pool is not None:
+        state["analyzer_pool"] = analyzer_pool.stats()
+    if outbox is not None:
+        # Доставка не влияет на готовность, но сбои потребителя видны здесь (failures, restarts, last_error)
+        state["outbox"] = outbox.stats()
+    elif outbox_error is not None:
+        state["outbox"] = {"error": outbox_error}
+    return state
+
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики в текстовом формате Prometheus: время стадий анализатора и эндпоинтов, пул, кэш"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/profiler")
+async def get_profiler():
+    return profiler.stats()
+
+
+@app.post("/api/profiler")
+async def configure_profiler(slow_ms: float = Query(..., ge=0), interval_ms: Optional[float] = Query(None, gt=0)):
+    """
+    Включить профилировщик (slow_ms > 0) или выключить (slow_ms = 0). Стеки запросов дольше
+    slow_ms пишутся в config.PROFILE_DIR в формате collapsed stacks для flamegraph.
+    """
+    profiler.configure(slow_ms, interval_ms)
+    return profiler.stats()
+
+
+@app.post("/api/reload")
+async def reload_data():
+    """
+    Перечитать данные: пересобрать хранилище, если исходные CSV изменились,
+    открыть его заново и сбросить кэш результатов. В ленивом режиме — то же для манифеста,
+    пул анализаторов создаётся заново.
+    """
+    global load_error
+
+    try:
+        rebuilt = await analytics_pool.run(load_analyzers, True)
+    except Exception as e:
+        load_error = str(e)
+        raise HTTPException(status_code=500, detail=str(e))
+    load_error = None
+    if analyzer_pool is not None:
+        versions = [analyzer_pool.manifest.source]
+    else:
+        versions = sorted({analyzer.version for analyzer in analyzers})
+    return {
+        "rebuilt": rebuilt,
+        "versions": versions,
+        "generation": _loaded_generation(),
+        "clients": len(client_directory),
+    }
+
+
+def _group_by_shard(client_codes) -> Dict[Any, List[int]]:
+    """Разложить client_code по анализаторам (шардам), которые их обслуживают"""
+    groups: Dict[Any, List[int]] = {}
+    for client_code in client_codes:
+        shard = _shard_of(client_code)
+        if shard is not None:
+            groups.setdefault(shard, []).append(client_code)
+    return groups
+
+
+def _diagnose_many(client_codes: List[int],
+                   locale: Optional[str] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
     """
-    Запустить диагностику для всех доступных клиентов (используя client_code_to_analyzer).
-    Возвращает список результатов и ошибок.
+    Диагностика группы клиентов офлайн-стратегией движка: метрики из таблицы признаков
+    анализатора (один проход по данным), скоринг — пакетным расчётом.
+    В ленивом режиме шарды загружаются по одному, по мере обработки.
+    Возвращает (results, errors) в порядке client_codes.
     """
+    locale = locale or config.NOTIFICATION_LOCALE
     results = []
     errors = []
 
-    # Если у вас очень много клиентов и тяжелая обработка — подумайте об батчировании/фоновом исполнении.
-    for client_code, analyzer in client_code_to_analyzer.items():
-        try:
-            client_info = analyzer.analyze_client(client_code)
-            if not client_info:
+    groups = _group_by_shard(client_codes)
+    for client_code in client_codes:
+        if _shard_of(client_code) is None:
+            errors.append({"client_code": client_code, "error": "client not found"})
+
+    for shard, codes in groups.items():
+        analyzer = _get_analyzer(shard)
+        recommended = analyzer.recommend(codes, top_k=3, mode=OFFLINE, locale=locale)
+        for client_code, client_info, products in recommended:
+            if client_info is None:
                 errors.append({"client_code": client_code, "error": "client data not found"})
                 continue
-
-            products = analyzer.calculate_product_scores(client_info)
-            recs = []
-            for product, benefit, confidence in products[:3]:
-                message = analyzer.generate_notification(client_info, product, client_info.get("metrics", {}))
-                recs.append({
-                    "product": product,
-                    "message": message,
-                    "confidence": float(confidence)
-                })
-
             results.append({
                 "client_code": client_code,
                 "client_name": client_info.get("name"),
-                "recommendations": recs
+                "recommendations": [
+                    {"product": product, "message": message, "confidence": float(confidence)}
+                    for product, benefit, confidence, message in products
+                ]
             })
 
-            # Небольшая пауза, чтобы не перегружать ресурсы (опционально)
-            await asyncio.sleep(0.01)
+    # Шарды считаются группами — результаты и ошибки возвращаются в порядок client_codes
+    position: Dict[int, int] = {}
+    for i, client_code in enumerate(client_codes):
+        position.setdefault(client_code, i)
+    results.sort(key=lambda item: position[item["client_code"]])
+    errors.sort(key=lambda item: position[item["client_code"]])
+    return results, errors
+
+
+@app.post("/api/diagnose_all")
+async def diagnose_all():
+    """
+    Запустить диагностику для всех доступных клиентов.
+    Возвращает {"results", "errors"} по возрастанию client_code. Результаты считаются блоками
+    по config.JOB_CHUNK_SIZE и отдаются по мере расчёта, ошибки — в конце ответа. Для большого
+    числа клиентов удобнее /api/diagnose_all/jobs или /api/diagnose_all/stream.
+    """
+    client_codes = _all_client_codes()
+
+    async def body():
+        yield b'{"results":['
+        errors: List[Dict[str, Any]] = []
+        separator = b""
+        for chunk in chunked(client_codes, config.JOB_CHUNK_SIZE):
+            results, chunk_errors = await analytics_pool.run(_diagnose_many, chunk)
+            errors += chunk_errors
+            for item in results:
+                yield separator + json_value(item)
+                separator = b","
+        yield b'],"errors":' + json_value(errors) + b"}"
+
+    return StreamingResponse(body(), media_type=JSON)
+
+
+@app.post("/api/diagnose_all/jobs")
+async def create_diagnose_job():
+    """
+    Поставить диагностику всех клиентов в фон. Возвращает job_id; прогресс и результаты
+    постранично — через GET /api/diagnose_all/jobs/{job_id}.
+    """
+    job = job_manager.submit(_all_client_codes(), _diagnose_many)
+    return job.progress()
+
+
+@app.get("/api/diagnose_all/jobs/{job_id}")
+async def get_diagnose_job(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000),
+                           errors_offset: int = Query(0, ge=0),
+                           errors_limit: Optional[int] = Query(None, ge=1, le=1000)):
+    """
+    Прогресс задания, страница результатов [offset, offset + limit) и страница ошибок
+    [errors_offset, errors_offset + errors_limit) — у ошибок свой курсор (errors_count в прогрессе)
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job.page(offset, limit, errors_offset, errors_limit)
+
+
+@app.get("/api/diagnose_all/stream")
+async def stream_diagnose_all():
+    """
+    Диагностика всех клиентов потоком NDJSON: одна строка на клиента
+    ({"client_code", "client_name", "recommendations"} или {"client_code", "error"}),
+    блоки отдаются по мере расчёта.
+    """
+    client_codes = _all_client_codes()
+
+    async def lines():
+        for chunk in chunked(client_codes, config.JOB_CHUNK_SIZE):
+            results, errors = await analytics_pool.run(_diagnose_many, chunk)
+            for item in results + errors:
+                yield ndjson_line(item)
+
+    return StreamingResponse(lines(), media_type=NDJSON)
+
+
+def _diagnose_batch(client_codes: List[int], locale: Optional[str], media_type: str) -> bytes:
+    """
+    Пакетная диагностика: повторы client_code считаются один раз, результаты и ошибки
+    возвращаются в порядке запроса, сразу сериализованными (выполняется в пуле).
+    """
+    results, errors = _diagnose_many(list(dict.fromkeys(client_codes)), locale)
+    by_code = {item["client_code"]: item for item in results + errors}
+    with stage_timer("serialize"):
+        return encode((by_code[client_code] for client_code in client_codes), media_type)
 
-        except Exception as e:
-            errors.append({"client_code": client_code, "error": str(e)})
-            continue
 
-    return {"results": results, "errors": errors}
+@app.post("/api/diagnose_batch")
+async def diagnose_batch(request: ClientBatchRequest, accept: Optional[str] = Header(None)):
+    """
+    Диагностика списка клиентов одним запросом: клиенты раскладываются по шардам, каждый шард
+    считается одним пакетным вызовом движка. Ответ — по элементу на client_code в порядке запроса
+    ({"client_code", "client_name", "recommendations"} или {"client_code", "error"}):
+    NDJSON (по умолчанию), JSON-массив при Accept: application/json или поток MessagePack
+    при Accept: application/x-msgpack.
+    """
+    media_type = negotiate(accept)
+    if media_type is None:
+        raise HTTPException(status_code=406, detail=f"Поддерживаемые форматы: {', '.join(available_types())}")
+    if len(request.client_codes) > config.DIAGNOSE_BATCH_MAX:
+        raise HTTPException(status_code=413,
+                            detail=f"Не больше {config.DIAGNOSE_BATCH_MAX} клиентов в одном запросе")
+
+    try:
+        body = await analytics_pool.run(_diagnose_batch, request.client_codes, request.locale, media_type)
+    except PoolOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return Response(content=body, media_type=media_type)
+
+
+def _query_segments(analyzer: ClientAnalyzer, dimensions: List[str],
+                    filters: Dict[str, Optional[str]]) -> List[Dict[str, Any]]:
+    return analyzer.segments.query(dimensions, filters)
+
+
+@app.get("/api/segments")
+async def get_segments(
+        group_by: str = Query(",".join(DIMENSIONS), description="Измерения через запятую: city, status, product"),
+        city: Optional[str] = None,
+        status: Optional[str] = None,
+        product: Optional[str] = None,
+):
+    """
+    Сводка по сегментам (город x статус x текущий продукт): число клиентов, траты по категориям,
+    объём переводов по типам и распределение рекомендаций. Отвечает из сводки, собранной при загрузке
+    и обновляемой при /api/ingest, без прохода по клиентам.
+    """
+    if analyzer_pool is not None:
+        raise HTTPException(status_code=409, detail="Сводка по сегментам недоступна в ленивом режиме")
+    if not analyzers:
+        raise HTTPException(status_code=503, detail="Данные не загружены")
+
+    analyzer = analyzers[0]
+    dimensions = [dim.strip() for dim in group_by.split(",") if dim.strip()]
+    try:
+        # Первый запрос строит сводку, если её нет в поколении, — не на event loop
+        segments = await analytics_pool.run(_query_segments, analyzer, dimensions,
+                                            {"city": city, "status": status, "product": product})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {
+        "group_by": dimensions,
+        "segments": segments,
+        "generation": analyzer.generation,
+        "revision": analyzer.revision,
+    }
+
+
+@app.get("/api/lookalikes")
+async def get_lookalikes(client_code: int, k: int = Query(10, ge=1, le=config.LOOKALIKE_MAX_K)):
+    """
+    k клиентов, похожих на client_code по долям трат по категориям, структуре переводов и балансу
+    (для таргетинга кампаний). Чем меньше distance, тем ближе клиент.
+    """
+    if analyzer_pool is not None:
+        raise HTTPException(status_code=409, detail="Поиск похожих клиентов недоступен в ленивом режиме")
+    analyzer = client_code_to_analyzer.get(client_code)
+    if analyzer is None:
+        raise HTTPException(status_code=404, detail="Клиент не найден")
+
+    try:
+        lookalikes = await analytics_pool.run(analyzer.find_lookalikes, client_code, k)
+    except PoolOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if lookalikes is None:
+        raise HTTPException(status_code=404, detail="Клиент не найден (данные)")
+    return {"client_code": client_code, "k": k, "lookalikes": lookalikes}
+
+
+@app.post("/api/outbox/push")
+async def outbox_push(request: OutboxPushRequest):
+    """
+    Поставить в outbox уведомление о лучшем продукте клиентов (по умолчанию — всех). Повтор пары
+    клиент-продукт в пределах config.OUTBOX_COOLDOWN_SECONDS не ставится; при заполненной очереди
+    запрос ждёт, пока доставка её разгрузит. Доставка — в фоне, пакетами, с лимитом скорости и повторами.
+    """
+    if outbox is None:
+        raise HTTPException(status_code=409, detail=outbox_error or "Outbox выключен (OUTBOX_SINK)")
+    client_codes = _all_client_codes() if request.client_codes is None else list(dict.fromkeys(request.client_codes))
+
+    queued = deduplicated = 0
+    errors: List[Dict[str, Any]] = []
+    for chunk in chunked(client_codes, config.JOB_CHUNK_SIZE):
+        try:
+            results, chunk_errors = await analytics_pool.run(_diagnose_many, chunk, request.locale)
+        except PoolOverloaded as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        errors += chunk_errors
+        # Одна групповая запись журнала на блок клиентов
+        chunk_queued, chunk_deduplicated = await outbox.put_many(
+            (item["client_code"], item["recommendations"][0]["product"], item["recommendations"][0]["message"])
+            for item in results if item["recommendations"])
+        queued += chunk_queued
+        deduplicated += chunk_deduplicated
+    return {"queued": queued, "deduplicated": deduplicated, "errors": errors, "outbox": outbox.stats()}
+
+
+@app.get("/api/outbox")
+async def outbox_stats():
+    """Состояние outbox: очередь, недоставленные, отправленные, повторы и dead letter"""
+    if outbox is None:
+        raise HTTPException(status_code=409, detail=outbox_error or "Outbox выключен (OUTBOX_SINK)")
+    return outbox.stats()
+
+
+def _simulate(scenarios, top_k: int) -> List[Dict[str, Any]]:
+    features = analyzers[0].features
+    return simulate(features.matrix(features.rows()), scenarios, top_k)
+
+
+@app.post("/api/simulate")
+async def simulate_scoring(request: SimulationRequest):
+    """
+    What-if по константам правил продуктов (travel_rate, premium_balance, credit_threshold, deposit_rate,
+    invest_rate): все клиенты пересчитываются для каждого сочетания значений grid за один проход.
+    По сценарию — распределение рекомендаций, средняя выгода лучшего продукта и сколько клиентов его сменили.
+    """
+    if analyzer_pool is not None:
+        raise HTTPException(status_code=409, detail="Симуляция недоступна в ленивом режиме")
+    if not analyzers:
+        raise HTTPException(status_code=503, detail="Данные не загружены")
+    try:
+        scenarios = parameter_grid(request.grid)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(scenarios) > config.SIMULATION_MAX_SCENARIOS:
+        raise HTTPException(status_code=413,
+                            detail=f"Не больше {config.SIMULATION_MAX_SCENARIOS} сценариев в одном запросе")
+    if request.top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k должен быть не меньше 1")
+
+    try:
+        scenarios = await analytics_pool.run(_simulate, scenarios, request.top_k)
+    except PoolOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"scenarios": scenarios, "generation": analyzers[0].generation, "revision": analyzers[0].revision}
+
+
+def _ingest_path(file_name: Optional[str]) -> Optional[str]:
+    """Путь к файлу дельты; разрешены только файлы внутри config.INGEST_DIR"""
+    if not file_name:
+        return None
+    root = os.path.realpath(config.INGEST_DIR)
+    path = os.path.realpath(os.path.join(root, file_name))
+    if os.path.dirname(path) != root or not os.path.isfile(path):
+        raise HTTPException(status_code=400, detail=f"Файл дельты не найден: {file_name}")
+    return path
+
+
+def _ingest(transactions_path: Optional[str], transfers_path: Optional[str], window_days: int) -> Dict[str, Any]:
+    """
+    Дописать дельту и обновить только затронутых клиентов (выполняется в пуле). Дельта применяется
+    к копии анализатора (ClientAnalyzer.copy), а запросы переключаются на неё заменой ссылок:
+    идущие в это время запросы дочитывают прежнее согласованное состояние.
+    """
+    global analyzers, client_code_to_analyzer, client_directory
+
+    with ingest_lock:
+        current = analyzers[0]
+        analyzer = current.copy()
+        affected = apply_delta(analyzer, read_delta(transactions_path), read_delta(transfers_path), window_days)
+
+        mapping = {client_code: (analyzer if owner is current else owner)
+                   for client_code, owner in client_code_to_analyzer.items()}
+        for client_code in affected.tolist():
+            if analyzer.transactions_index.bounds(client_code) is not None:
+                mapping[client_code] = analyzer
+            elif mapping.get(client_code) is analyzer:
+                del mapping[client_code]
+        updated = [analyzer if item is current else item for item in analyzers]
+
+        # Публикация: каждая ссылка заменяется целиком
+        analyzers, client_code_to_analyzer = updated, mapping
+        client_directory = ClientDirectory.from_analyzers(updated)
+
+    invalidated = result_cache.invalidate(affected.tolist())
+    return {
+        "affected_clients": len(affected),
+        "invalidated_cache_entries": invalidated,
+        "clients": len(mapping),
+        "revision": analyzer.revision,
+    }
+
+
+@app.post("/api/ingest")
+async def ingest(request: IngestRequest):
+    """
+    Инкрементальная загрузка дельты (новые транзакции/переводы) без перезагрузки данных.
+    Кэш результатов сбрасывается только для затронутых клиентов.
+    """
+    if analyzer_pool is not None:
+        raise HTTPException(status_code=409, detail="Инкрементальная загрузка недоступна в ленивом режиме")
+    if config.STORE_POLL_SECONDS > 0:
+        # Дельта в памяти одного воркера разошлась бы с остальными — пишется новое поколение
+        raise HTTPException(status_code=409, detail="При нескольких воркерах дельты загружаются через "
+                                                    "python -m services.ingest (новое поколение хранилища)")
+    if not analyzers:
+        raise HTTPException(status_code=503, detail="Данные не загружены")
+    transactions_path = _ingest_path(request.transactions_file)
+    transfers_path = _ingest_path(request.transfers_file)
+    if transactions_path is None and transfers_path is None:
+        raise HTTPException(status_code=400, detail="Нужен transactions_file и/или transfers_file")
+
+    window_days = config.DATA_WINDOW_DAYS if request.window_days is None else request.window_days
+    try:
+        return await analytics_pool.run(_ingest, transactions_path, transfers_path, window_days)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/")
@@ -1,78 +1,559 @@
+import copy
+import os
+import threading
+
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from datetime import datetime
 
+from services import config
+from services.features import (ClientFeatures, FeatureLayout, build_features, derive_metrics,
+                               derive_window_metrics, metrics_dict, month_ordinals, month_range, top_category_codes,
+                               window_sums)
+from services.fx import AMOUNT_COLUMN, FxTable, fx_table_for, normalize_amounts
+from services.lookalikes import LookalikeIndex, client_vectors
+from services.metrics import stage_timer, timed
+from services.scoring import PRODUCTS, score_batch, scores_to_tuples, top_categories_spending
+from services.segments import SegmentRollup
+from services.store import CATEGORICAL_COLUMNS, load_store
+from services.templates import LazyColumns, get_templates
+
+# Стратегии ClientAnalyzer.recommend: online — по одному клиенту с минимальной задержкой,
+# offline — все клиенты сразу с максимальной пропускной способностью
+ONLINE = 'online'
+OFFLINE = 'offline'
+
+# (client_code, client_info или None, [(product, benefit, confidence, message), ...])
+RecommendationRow = Tuple[int, Optional[Dict], List[Tuple[str, float, float, str]]]
+
+
+class ClientIndex:
+    """
+    Индекс client_code -> диапазон строк [start, end) в таблице, отсортированной по client_code.
+    Поиск — бинарный по массиву уникальных кодов, без масок по всей таблице.
+    """
+
+    def __init__(self, client_codes: np.ndarray):
+        self.codes, self.starts = np.unique(client_codes, return_index=True)
+        self.ends = np.append(self.starts[1:], len(client_codes)).astype(self.starts.dtype)
+
+    @classmethod
+    def from_arrays(cls, codes: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> 'ClientIndex':
+        """Индекс из готовых массивов (например, открытых через mmap из поколения хранилища)"""
+        index = cls.__new__(cls)
+        index.codes, index.starts, index.ends = codes, starts, ends
+        return index
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def bounds(self, client_code: int) -> Optional[Tuple[int, int]]:
+        i = int(np.searchsorted(self.codes, client_code))
+        if i < len(self.codes) and self.codes[i] == client_code:
+            return int(self.starts[i]), int(self.ends[i])
+        return None
+
+
+def _batch_messages(features: ClientFeatures, rows: List[int], client_codes: List[int], scores,
+                    locale: Optional[str]) -> List[List[Optional[str]]]:
+    """Уведомления для каждого места топа (scores.products[:, j]) одним пакетным рендером"""
+    rows = np.asarray(rows, dtype=np.int64)
+    loaders = {name: (lambda values=values: values[rows]) for name, values in features.metrics.items()}
+    loaders['name'] = lambda: features.profile_column('name')[rows]
+    loaders['top_categories'] = lambda: [
+        [features.layout.categories[c] for c in codes if c >= 0] for codes in features.top_codes[rows]
+    ]
+    columns = LazyColumns(loaders)
+
+    templates = get_templates()
+    return [
+        templates.render_batch([PRODUCTS[p] if p >= 0 else None for p in scores.products[:, j]],
+                               columns, client_codes, locale)
+        for j in range(scores.products.shape[1])
+    ]
+
+
+def recommend_features(features: ClientFeatures, client_codes: Optional[Iterable[int]] = None, top_k: int = 3,
+                       chunk_size: int = 65536, locale: Optional[str] = None) -> Iterator[RecommendationRow]:
+    """
+    Офлайн-стратегия движка поверх готовой таблицы признаков (ClientAnalyzer.recommend с mode=OFFLINE,
+    services/streaming.py): пакетный скоринг и рендер уведомлений блоками по chunk_size клиентов.
+    """
+    if client_codes is None:
+        rows = features.rows()
+        client_codes = features.client_codes[rows].tolist()
+    else:
+        client_codes = list(client_codes)
+        rows = [features.position(client_code) for client_code in client_codes]
+
+    # Блоками по chunk_size: в памяти одновременно только матрица, скоринг и уведомления одного блока
+    for start in range(0, len(client_codes), chunk_size):
+        chunk_codes = client_codes[start:start + chunk_size]
+        chunk_rows = rows[start:start + chunk_size]
+        found = [row for row in chunk_rows if row is not None]
+        found_codes = [code for code, row in zip(chunk_codes, chunk_rows) if row is not None]
+        with stage_timer('batch_scoring'):
+            scores = score_batch(features.matrix(found), top_k=top_k)
+        with stage_timer('batch_notification'):
+            messages = _batch_messages(features, found, found_codes, scores, locale)
+
+        i = 0
+        for client_code, row in zip(chunk_codes, chunk_rows):
+            if row is None:
+                yield client_code, None, []
+                continue
+            yield client_code, features.client_info_at(row), [
+                (product, benefit, confidence, messages[j][i])
+                for j, (product, benefit, confidence) in enumerate(scores_to_tuples(scores, i))
+            ]
+            i += 1
+
 
 class ClientAnalyzer:
     def __init__(self, transactions_path: str, transfers_path: str):
-        self.transactions_df = pd.read_csv(transactions_path)
-        self.transfers_df = pd.read_csv(transfers_path)
+        transactions_df = pd.read_csv(transactions_path)
+        transfers_df = pd.read_csv(transfers_path)
 
         # Преобразование дат
-        self.transactions_df['date'] = pd.to_datetime(self.transactions_df['date'])
-        self.transfers_df['date'] = pd.to_datetime(self.transfers_df['date'])
+        transactions_df['date'] = pd.to_datetime(transactions_df['date'])
+        transfers_df['date'] = pd.to_datetime(transfers_df['date'])
+
+        # Суммы в тенге по таблице курсов из каталога данных — один раз на загрузку
+        fx = fx_table_for(os.path.dirname(transactions_path), config.FX_RATES)
+        normalize_amounts(transactions_df, fx)
+        normalize_amounts(transfers_df, fx)
+
+        # Версия данных — по размеру и mtime исходных файлов
+        version = ":".join(f"{os.path.getsize(path)}-{os.stat(path).st_mtime_ns}"
+                           for path in (transactions_path, transfers_path))
+        self._init_frames(transactions_df, transfers_df, version, fx)
+
+    @classmethod
+    def from_store(cls, store_dir: str, use_derived: bool = True) -> 'ClientAnalyzer':
+        """
+        Анализатор поверх текущего поколения колоночного хранилища (см. services/store.py),
+        данные открываются через mmap. Если в поколении есть производные массивы
+        (services/loader.py), индексы и таблица признаков тоже открываются, а не считаются
+        (use_derived=False — посчитать заново, например для проверки паритета).
+        """
+        transactions_df, transfers_df, meta = load_store(store_dir)
+        analyzer = cls.__new__(cls)
+        fx = FxTable.from_records(meta.get('fx_rates', []))
+        derived = meta.get('derived') if use_derived else None
+        if derived is not None:
+            derived = dict(derived, path=os.path.join(meta['path'], derived['path']))
+        analyzer._init_frames(transactions_df, transfers_df, meta['version'], fx, derived)
+        analyzer.generation = meta.get('generation')
+        return analyzer
+
+    def copy(self) -> 'ClientAnalyzer':
+        """
+        Копия для инкрементального обновления (copy-on-write): append/expire копии не трогают
+        состояние, которое в это время читают запросы к оригиналу. Таблицы строк, индексы
+        и колонки-массивы общие — append/expire их не меняют, а заменяют новыми; таблица признаков,
+        сводка по сегментам и маска индекса похожих клиентов копируются.
+        """
+        analyzer = copy.copy(self)
+        analyzer._features_lock = threading.Lock()
+        with self._features_lock:
+            analyzer._features = self._features.copy() if self._features is not None else None
+            analyzer._segments = self._segments.copy() if self._segments is not None else None
+            analyzer._lookalikes = self._lookalikes.copy() if self._lookalikes is not None else None
+        return analyzer
+
+    def save_derived(self, path: str) -> Dict:
+        """
+        Записать производные массивы — индексы клиентов, коды месяцев и переводов по строкам,
+        таблицу признаков, сводку по сегментам и индекс похожих клиентов — для подключения через mmap (from_store).
+        Возвращает описание для meta.
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = {'transactions_month': self._tx_month, 'transfers_month': self._tr_month,
+                  'transfers_flow': self._tr_flow}
+        for name, index in (('transactions', self.transactions_index), ('transfers', self.transfers_index)):
+            arrays[f'{name}_codes'] = index.codes
+            arrays[f'{name}_starts'] = index.starts
+            arrays[f'{name}_ends'] = index.ends
+        for name, values in arrays.items():
+            np.save(os.path.join(path, f'{name}.npy'), values)
+        features = self.features.save(os.path.join(path, 'features'))
+        segments = self.segments.save(os.path.join(path, 'segments'))
+        lookalikes = self.lookalikes.save(os.path.join(path, 'lookalikes'))
+        return {'path': os.path.basename(path), 'months': self.layout.months.tolist(), 'features': features,
+                'segments': segments, 'lookalikes': lookalikes}
+
+    @staticmethod
+    def _prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+        """Категориальные строки и сортировка по client_code (стабильная)"""
+        for col in CATEGORICAL_COLUMNS:
+            if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype('category')
+        if not df['client_code'].is_monotonic_increasing:
+            df = df.sort_values('client_code', kind='mergesort').reset_index(drop=True)
+        return df
+
+    def _init_frames(self, transactions_df: pd.DataFrame, transfers_df: pd.DataFrame, version: str, fx: FxTable,
+                     derived: Optional[Dict] = None):
+        # Версия данных: меняется при пересборке хранилища, входит в ключ кэша результатов
+        self.version = version
+        # Поколение хранилища, из которого открыт анализатор (None — не из хранилища)
+        self.generation = None
+        # Курсы, по которым посчитан amount_kzt, — ими же пересчитываются дописываемые дельты
+        self.fx = fx
+        # Номер инкрементального обновления (append/expire) поверх version
+        self.revision = 0
+
+        # Таблица признаков всех клиентов строится по требованию (см. features)
+        self._features: Optional[ClientFeatures] = None
+        self._features_lock = threading.Lock()
+        # Сводка по сегментам строится из таблицы признаков (см. segments) и обновляется вместе с ней
+        self._segments: Optional[SegmentRollup] = None
+        # Индекс похожих клиентов — тоже из таблицы признаков (см. lookalikes)
+        self._lookalikes: Optional[LookalikeIndex] = None
+
+        if derived is None:
+            self._set_frames(transactions_df, transfers_df)
+            return
+
+        # Производные массивы поколения: открываются через mmap, не считаются заново
+        def array(name: str) -> np.ndarray:
+            return np.load(os.path.join(derived['path'], f'{name}.npy'), mmap_mode='r')
+
+        self._set_frames(transactions_df, transfers_df, {
+            'months': np.asarray(derived['months'], dtype=np.int64),
+            'transactions_index': ClientIndex.from_arrays(array('transactions_codes'), array('transactions_starts'),
+                                                          array('transactions_ends')),
+            'transfers_index': ClientIndex.from_arrays(array('transfers_codes'), array('transfers_starts'),
+                                                       array('transfers_ends')),
+            'transactions_month': array('transactions_month'),
+            'transfers_month': array('transfers_month'),
+            'transfers_flow': array('transfers_flow'),
+        })
+        self._features = ClientFeatures.load(os.path.join(derived['path'], 'features'), self.layout,
+                                             derived['features'])
+        if 'segments' in derived:
+            self._segments = SegmentRollup.load(os.path.join(derived['path'], 'segments'), self.layout,
+                                                derived['segments'])
+        if 'lookalikes' in derived:
+            self._lookalikes = LookalikeIndex.load(os.path.join(derived['path'], 'lookalikes'), derived['lookalikes'])
+
+    def _set_frames(self, transactions_df: pd.DataFrame, transfers_df: pd.DataFrame,
+                    derived: Optional[Dict] = None):
+        """Таблицы строк, индексы и колонки-массивы (без таблицы признаков); derived — готовые индексы и коды"""
+        self.transactions_df = self._prepare_frame(transactions_df)
+        self.transfers_df = self._prepare_frame(transfers_df)
+
+        if derived is None:
+            tx_months = month_ordinals(self.transactions_df['date'])
+            tr_months = month_ordinals(self.transfers_df['date'])
+            months = month_range(tx_months, tr_months)
+        else:
+            months = derived['months']
+
+        # Колонки в виде numpy-массивов: коды категорий, суммы в тенге и месяцы календарного куба
+        self.layout = FeatureLayout(
+            self.transactions_df['category'].cat.categories,
+            self.transfers_df['type'].cat.categories,
+            self.transfers_df['direction'].cat.categories,
+            months,
+        )
+        self._tx_category = self.transactions_df['category'].cat.codes.to_numpy()
+        self._tx_amount = self.transactions_df[AMOUNT_COLUMN].to_numpy()
+        self._tr_amount = self.transfers_df[AMOUNT_COLUMN].to_numpy()
+
+        if derived is not None:
+            self.transactions_index = derived['transactions_index']
+            self.transfers_index = derived['transfers_index']
+            self._tx_month = derived['transactions_month']
+            self._tr_month = derived['transfers_month']
+            self._tr_flow = derived['transfers_flow']
+            return
+
+        # Индексы client_code -> диапазон строк
+        self.transactions_index = ClientIndex(self.transactions_df['client_code'].to_numpy())
+        self.transfers_index = ClientIndex(self.transfers_df['client_code'].to_numpy())
+        # Коды месяцев и переводов по строкам — int16, их столько же, сколько строк
+        self._tx_month = self.layout.month_codes(tx_months).astype(np.int16)
+        self._tr_month = self.layout.month_codes(tr_months).astype(np.int16)
+        self._tr_flow = self.layout.flow_codes(self.transfers_df['type'].cat.codes.to_numpy(),
+                                               self.transfers_df['direction'].cat.codes.to_numpy()).astype(np.int16)
+
+    @property
+    def features(self) -> ClientFeatures:
+        """Таблица признаков всех клиентов, собранная за один проход (services/features.py)"""
+        if self._features is None:
+            # Запросы из пула потоков не должны строить таблицу параллельно
+            with self._features_lock:
+                if self._features is None:
+                    with stage_timer('build_features'):
+                        self._features = build_features(self.transactions_df, self.transfers_df, self.layout)
+        return self._features
+
+    @property
+    def segments(self) -> SegmentRollup:
+        """Сводка по сегментам город x статус x продукт (services/segments.py)"""
+        if self._segments is None:
+            features = self.features
+            with self._features_lock:
+                if self._segments is None:
+                    with stage_timer('build_segments'):
+                        self._segments = SegmentRollup.build(features)
+        return self._segments
+
+    @property
+    def lookalikes(self) -> LookalikeIndex:
+        """Индекс похожих клиентов (services/lookalikes.py)"""
+        if self._lookalikes is None:
+            features = self.features
+            with self._features_lock:
+                if self._lookalikes is None:
+                    with stage_timer('build_lookalikes'):
+                        self._lookalikes = LookalikeIndex.build(features)
+        return self._lookalikes
+
+    def _conform(self, delta: Optional[pd.DataFrame], base: pd.DataFrame) -> pd.DataFrame:
+        """
+        Привести новые строки к схеме таблицы: даты, суммы в тенге, категории с общим словарём.
+        Новые значения категорий дописываются в конец словаря base, старые коды не меняются.
+        """
+        if delta is None:
+            return base.iloc[:0].copy()
+        delta = delta[[col for col in base.columns if col != AMOUNT_COLUMN]].copy()
+        delta['date'] = pd.to_datetime(delta['date'])
+        delta = normalize_amounts(delta, self.fx)[list(base.columns)]
+        for col in CATEGORICAL_COLUMNS:
+            if col not in base.columns:
+                continue
+            categories = list(base[col].cat.categories)
+            values = delta[col].astype(str)
+            extra = sorted(set(values.unique()) - set(categories))
+            if extra:
+                base[col] = base[col].cat.add_categories(extra)
+            delta[col] = pd.Categorical(values, categories=categories + extra)
+        return delta
+
+    @timed('append')
+    def append(self, transactions_df: Optional[pd.DataFrame] = None,
+               transfers_df: Optional[pd.DataFrame] = None) -> np.ndarray:
+        """
+        Дописать новые транзакции и переводы (например, дневную дельту) без перечитывания данных.
+        Если таблица признаков собрана, её суммы и счётчики обновляются только по новым строкам,
+        сводка по сегментам — только по затронутым клиентам. Возвращает client_code затронутых клиентов.
+        """
+        base_tx = self.transactions_df.copy(deep=False)
+        base_tr = self.transfers_df.copy(deep=False)
+        delta_tx = self._conform(transactions_df, base_tx)
+        delta_tr = self._conform(transfers_df, base_tr)
+
+        self._set_frames(pd.concat([base_tx, delta_tx], ignore_index=True),
+                         pd.concat([base_tr, delta_tr], ignore_index=True))
+
+        affected = np.union1d(delta_tx['client_code'].to_numpy(dtype=np.int64),
+                              delta_tr['client_code'].to_numpy(dtype=np.int64))
+        if self._features is not None:
+            with self._features_lock:
+                if self._segments is not None:
+                    self._segments.apply(self._features, affected, sign=-1)
+                self._features.extend_layout(self.layout)
+                self._features.apply(build_features(delta_tx, delta_tr, self.layout))
+                if self._segments is not None:
+                    self._segments.extend_layout(self.layout)
+                    self._segments.apply(self._features, affected)
+                if self._lookalikes is not None:
+                    self._lookalikes = self._lookalikes.update(self._features, affected)
+        self.revision += 1
+        return affected
+
+    @timed('expire')
+    def expire(self, before) -> np.ndarray:
+        """
+        Удалить строки с датой раньше before (скользящее окно). Суммы таблицы признаков
+        уменьшаются только на удалённые строки. Возвращает client_code затронутых клиентов.
+        """
+        before = pd.Timestamp(before)
+        old_tx = (self.transactions_df['date'] < before).to_numpy()
+        old_tr = (self.transfers_df['date'] < before).to_numpy()
+        if not old_tx.any() and not old_tr.any():
+            return np.zeros(0, dtype=np.int64)
+
+        expired_tx = self.transactions_df[old_tx]
+        expired_tr = self.transfers_df[old_tr]
+        affected = np.union1d(expired_tx['client_code'].to_numpy(dtype=np.int64),
+                              expired_tr['client_code'].to_numpy(dtype=np.int64))
+        if self._features is not None:
+            with self._features_lock:
+                if self._segments is not None:
+                    self._segments.apply(self._features, affected, sign=-1)
+                self._features.apply(build_features(expired_tx, expired_tr, self.layout), sign=-1)
+
+        self._set_frames(self.transactions_df[~old_tx].reset_index(drop=True),
+                         self.transfers_df[~old_tr].reset_index(drop=True))
+        if self._features is not None:
+            # Окно могло сдвинуть первый месяц — ось месяцев куба перекладывается.
+            # Оконные метрики в формулы продуктов не входят, поэтому сводке по сегментам
+            # достаточно вклада затронутых клиентов
+            with self._features_lock:
+                self._features.extend_layout(self.layout)
+                if self._segments is not None:
+                    self._segments.extend_layout(self.layout)
+                    self._segments.apply(self._features, affected)
+                if self._lookalikes is not None:
+                    self._lookalikes = self._lookalikes.update(self._features, affected)
+        self.revision += 1
+        return affected
+
+    def latest_date(self) -> Optional[pd.Timestamp]:
+        dates = [df['date'].max() for df in (self.transactions_df, self.transfers_df) if len(df)]
+        return max(dates) if dates else None
 
     def get_all_clients(self) -> List[Dict]:
         """Получить список всех клиентов"""
-        clients = self.transactions_df.groupby('client_code').first().reset_index()
+        clients = self.transactions_df.iloc[self.transactions_index.starts]
         return clients[['client_code', 'name', 'product', 'status', 'city']].to_dict('records')
 
+    @timed('client_sums')
+    def _client_sums(self, client_code: int):
+        """
+        Суммы и количества клиента по категориям (1 x n_categories) и по (type, direction)
+        (1 x n_types x n_directions), затем они же с осью месяца (как у features.aggregate).
+        Срез по индексу + bincount, без масок по таблице.
+        """
+        tx = self.transactions_index.bounds(client_code)
+        if tx is None:
+            return None
+        start, end = tx
+        n_categories = len(self.layout.categories)
+        n_months = self.layout.n_months
+        codes = self._tx_category[start:end]
+        amounts = self._tx_amount[start:end]
+        cat_sum = np.bincount(codes, weights=amounts, minlength=n_categories)
+        cat_cnt = np.bincount(codes, minlength=n_categories)
+        key = self._tx_month[start:end].astype(np.int64) * n_categories + codes
+        month_cat_sum = np.bincount(key, weights=amounts, minlength=n_months * n_categories)
+        month_cat_cnt = np.bincount(key, minlength=n_months * n_categories)
+
+        n_flows = self.layout.n_flows
+        tr = self.transfers_index.bounds(client_code)
+        if tr is None:
+            flow_sum = np.zeros(n_flows)
+            flow_cnt = np.zeros(n_flows, dtype=np.int64)
+            month_flow_sum = np.zeros(n_months * n_flows)
+            month_flow_cnt = np.zeros(n_months * n_flows, dtype=np.int64)
+        else:
+            start, end = tr
+            flows = self._tr_flow[start:end].astype(np.int64)
+            amounts = self._tr_amount[start:end]
+            flow_sum = np.bincount(flows, weights=amounts, minlength=n_flows)
+            flow_cnt = np.bincount(flows, minlength=n_flows)
+            key = self._tr_month[start:end].astype(np.int64) * n_flows + flows
+            month_flow_sum = np.bincount(key, weights=amounts, minlength=n_months * n_flows)
+            month_flow_cnt = np.bincount(key, minlength=n_months * n_flows)
+
+        shape = (1, len(self.layout.transfer_types), len(self.layout.directions))
+        month_shape = (1, n_months, len(self.layout.transfer_types), len(self.layout.directions))
+        return (cat_sum[None], cat_cnt[None], flow_sum.reshape(shape), flow_cnt.reshape(shape),
+                month_cat_sum.reshape(1, n_months, n_categories), month_cat_cnt.reshape(1, n_months, n_categories),
+                month_flow_sum.reshape(month_shape), month_flow_cnt.reshape(month_shape))
+
+    def _client_header(self, client_code: int) -> Dict:
+        start = self.transactions_index.bounds(client_code)[0]
+        row = self.transactions_df.iloc[start]
+        return {
+            'client_code': client_code,
+            'name': row['name'],
+            'status': row['status'],
+            'city': row['city'],
+        }
+
+    @timed('analyze')
     def analyze_client(self, client_code: int) -> Dict:
         """Анализ данных одного клиента"""
-        client_trans = self.transactions_df[self.transactions_df['client_code'] == client_code].copy()
-        client_transfers = self.transfers_df[self.transfers_df['client_code'] == client_code].copy()
+        # Если таблица признаков уже собрана — это просто чтение строки
+        if self._features is not None:
+            return self._features.client_info(client_code)
 
-        if client_trans.empty:
+        sums = self._client_sums(client_code)
+        if sums is None:
             return None
+        cat_sum, cat_cnt, flow_sum, flow_cnt, month_cat_sum, _, _, month_flow_cnt = sums
 
         # Базовая информация
-        client_info = {
-            'client_code': client_code,
-            'name': client_trans['name'].iloc[0],
-            'status': client_trans['status'].iloc[0],
-            'city': client_trans['city'].iloc[0],
-        }
-
-        # Анализ транзакций
-        category_spending = client_trans.groupby('category')['amount'].agg(['sum', 'count']).round(2)
-        category_spending = category_spending.sort_values('sum', ascending=False)
-
-        # Анализ переводов
-        transfers_in = client_transfers[client_transfers['direction'] == 'in']
-        transfers_out = client_transfers[client_transfers['direction'] == 'out']
-
-        total_in = transfers_in['amount'].sum() if not transfers_in.empty else 0
-        total_out = transfers_out['amount'].sum() if not transfers_out.empty else 0
-        avg_monthly_balance = (total_in - total_out) / 3
-
-        # Метрики
-        metrics = {
-            'total_spending': float(client_trans['amount'].sum()),
-            'travel_spending': float(
-                client_trans[client_trans['category'].isin(['Путешествия', 'Отели', 'Такси'])]['amount'].sum()),
-            'restaurant_spending': float(client_trans[client_trans['category'] == 'Кафе и рестораны']['amount'].sum()),
-            'online_spending': float(
-                client_trans[client_trans['category'].isin(['Едим дома', 'Смотрим дома', 'Играем дома'])][
-                    'amount'].sum()),
-            'luxury_spending': float(
-                client_trans[client_trans['category'].isin(['Ювелирные украшения', 'Косметика и Парфюмерия'])][
-                    'amount'].sum()),
-            'has_fx': bool(
-                transfers_out['type'].isin(['fx_buy', 'fx_sell']).any()) if not transfers_out.empty else False,
-            'has_gold': bool(transfers_out['type'].isin(
-                ['gold_buy_out', 'gold_sell_in']).any()) if not transfers_out.empty else False,
-            'has_investments': bool(
-                transfers_out['type'].isin(['invest_out', 'invest_in']).any()) if not transfers_out.empty else False,
-            'atm_withdrawals': float(transfers_out[transfers_out['type'] == 'atm_withdrawal'][
-                                         'amount'].sum()) if not transfers_out.empty else 0,
-            'avg_monthly_balance': float(avg_monthly_balance),
-            'top_categories': category_spending.head(3).index.tolist()
-        }
+        client_info = self._client_header(client_code)
+
+        # Метрики — те же формулы, что и для таблицы признаков всех клиентов
+        with stage_timer('metrics'):
+            metrics = derive_metrics(self.layout, cat_sum, cat_cnt, flow_sum, flow_cnt)
+            metrics.update(derive_window_metrics(self.layout, month_cat_sum, month_flow_cnt))
+            top_codes = top_category_codes(self.layout, cat_sum, cat_cnt)
+            client_info['metrics'] = metrics_dict(self.layout, metrics, top_codes, 0)
+        return client_info
 
-        client_info['metrics'] = metrics
+    def analyze_window(self, client_code: int, months: int = 1) -> Optional[Dict]:
+        """
+        Метрики analyze_client за последние months календарных месяцев данных (по кубу;
+        среднемесячный баланс — на длину окна). None — данных клиента нет.
+        """
+        months = max(min(months, self.layout.n_months), 1)
+        if self._features is not None:
+            row = self._features.position(client_code)
+            if row is None:
+                return None
+            metrics, top_codes = self._features.window(months, [row])
+            client_info = self._features.client_info_at(row)
+        else:
+            sums = self._client_sums(client_code)
+            if sums is None:
+                return None
+            window = window_sums(self.layout, months, *sums[4:])
+            metrics = derive_metrics(self.layout, *window, months=months)
+            last = slice(self.layout.n_months - months, self.layout.n_months)
+            metrics.update(derive_window_metrics(self.layout, sums[4][:, last], sums[7][:, last]))
+            top_codes = top_category_codes(self.layout, window[0], window[1])
+            client_info = self._client_header(client_code)
+        client_info['window_months'] = self.layout.month_labels[-months:]
+        client_info['metrics'] = metrics_dict(self.layout, metrics, top_codes, 0)
         return client_info
 
+    def recommend_window(self, client_code: int, months: int = 1, top_k: int = 3,
+                         locale: Optional[str] = None) -> Optional[Tuple[Dict, List[Tuple[str, float, float, str]]]]:
+        """
+        Топ-k рекомендаций по метрикам последних months месяцев (analyze_window) — те же правила
+        продуктов, что и за весь период: (client_info, [(product, benefit, confidence, message)]).
+        None — данных клиента нет.
+        """
+        client_info = self.analyze_window(client_code, months)
+        if client_info is None:
+            return None
+        products = self.calculate_product_scores(client_info)[:top_k]
+        return client_info, [
+            (product, benefit, confidence, self.generate_notification(client_info, product, client_info['metrics'],
+                                                                      locale))
+            for product, benefit, confidence in products
+        ]
+
+    @timed('lookalikes')
+    def find_lookalikes(self, client_code: int, k: int = 10) -> Optional[List[Dict]]:
+        """k клиентов, ближайших к client_code по структуре трат, переводов и балансу. None — клиента нет"""
+        features = self.features
+        row = features.position(client_code)
+        if row is None:
+            return None
+        neighbours = self.lookalikes.query(client_vectors(features, [row])[0], k, exclude=client_code)
+        result = []
+        for code, distance in neighbours:
+            row = features.position(code)
+            result.append({
+                'client_code': code,
+                'name': features.profile_column('name')[row],
+                'city': features.profile_column('city')[row],
+                'status': features.profile_column('status')[row],
+                'product': features.profile_column('product')[row],
+                'distance': distance,
+            })
+        return result
+
+    @timed('scoring')
     def calculate_product_scores(self, client_info: Dict) -> List[Tuple[str, float, float]]:
         """Расчет выгоды и уверенности для каждого продукта"""
         metrics = client_info['metrics']
@@ -97,7 +578,7 @@ class ClientAnalyzer:
 
         # 3. Кредитная карта
         credit_benefit = metrics['online_spending'] * 0.10
-        top_spending = sum([metrics.get(f'{cat.lower()}_spending', 0) for cat in metrics['top_categories'][:3]])
+        top_spending = top_categories_spending(metrics)
         credit_benefit += top_spending * 0.10
         credit_confidence = min(88, 70 + (metrics['online_spending'] / metrics['total_spending'] * 50) if metrics[
                                                                                                               'total_spending'] > 0 else 70)
@@ -130,33 +611,41 @@ class ClientAnalyzer:
         products.sort(key=lambda x: x[1], reverse=True)
         return products[:4]  # Топ-4 продукта
 
-    def generate_notification(self, client_info: Dict, product: str, metrics: Dict) -> str:
-        """Генерация персонализированного уведомления"""
-        name = client_info['name']
-
-        templates = {
-            'Карта для путешествий': f"{name}, в последние месяцы у вас много расходов на поездки и такси ({metrics['travel_spending']:.0f} ₸). С картой для путешествий вернули бы {metrics['travel_spending'] * 0.04:.0f} ₸ кешбэка. Оформить карту.",
-
-            'Премиальная карта': f"{name}, у вас стабильный остаток на счету и активные траты. Премиальная карта даст до 4% кешбэка и бесплатные снятия. Подключить сейчас.",
-
-            'Кредитная карта': f"{name}, ваши топ-категории — {', '.join(metrics['top_categories'][:2])}. Кредитная карта даёт до 10% в любимых категориях. Оформить карту.",
-
-            'Обмен валют': f"{name}, вы совершаете валютные операции. В приложении выгодный обмен без скрытых комиссий. Настроить обмен.",
-
-            'Депозит накопительный': f"{name}, у вас остаются свободные средства. Разместите их на вкладе — получайте до 15% годовых. Открыть вклад.",
-
-            'Депозит сберегательный': f"{name}, ваш высокий остаток может работать. Сберегательный депозит даст максимальную ставку. Открыть вклад.",
-
-            'Инвестиции': f"{name}, попробуйте инвестиции с низким порогом входа. Начните с малого. Открыть счёт.",
-
-            'Золотые слитки': f"{name}, вы уже инвестируете в золото. Расширьте портфель с выгодными условиями. Узнать больше.",
-
-            'Кредит наличными': f"{name}, нужны средства на крупные покупки? Кредит с гибкими условиями. Узнать лимит."
-        }
-
-        notification = templates.get(product, f"{name}, откройте новые возможности с {product}. Узнать больше.")
-
-        if len(notification) > 220:
-            notification = notification[:217] + "..."
-
-        return notification
\ No newline at end of file
+    @timed('notification')
+    def generate_notification(self, client_info: Dict, product: str, metrics: Dict,
+                              locale: Optional[str] = None) -> str:
+        """Генерация персонализированного уведомления по шаблонам из config.NOTIFICATION_TEMPLATES"""
+        return get_templates().render(product, client_info, metrics, locale)
+
+    def _recommend_online(self, client_codes: Iterable[int], top_k: int,
+                          locale: Optional[str]) -> Iterator[RecommendationRow]:
+        for client_code in client_codes:
+            client_info = self.analyze_client(client_code)
+            if not client_info:
+                yield client_code, None, []
+                continue
+            products = self.calculate_product_scores(client_info)[:top_k]
+            yield client_code, client_info, [
+                (product, benefit, confidence,
+                 self.generate_notification(client_info, product, client_info['metrics'], locale))
+                for product, benefit, confidence in products
+            ]
+
+    def recommend(self, client_codes: Optional[Iterable[int]] = None, top_k: int = 3, mode: str = OFFLINE,
+                  chunk_size: int = 65536, locale: Optional[str] = None) -> Iterator[RecommendationRow]:
+        """
+        Топ-k рекомендаций с уведомлениями: (client_code, client_info, [(product, benefit, confidence, message)]).
+        client_info = None — данных клиента нет. client_codes = None — все клиенты с транзакциями.
+
+        Одна логика, две стратегии с одинаковым результатом (см. services/parity.py):
+        ONLINE — по клиенту: срез по индексу и скалярный скоринг, таблица признаков не строится;
+        OFFLINE — таблица признаков всех клиентов за один проход, пакетный скоринг и рендер
+        уведомлений блоками. locale — локаль шаблонов уведомлений (None — по умолчанию).
+        """
+        if mode == ONLINE:
+            if client_codes is None:
+                client_codes = self.transactions_index.codes.tolist()
+            return self._recommend_online(client_codes, top_k, locale)
+        if mode == OFFLINE:
+            return recommend_features(self.features, client_codes, top_k, chunk_size, locale)
+        raise ValueError(f"Unknown mode: {mode}")
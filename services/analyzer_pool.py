@@ -0,0 +1,167 @@
+"""
+Пул анализаторов шардов с вытеснением LRU (ленивый режим, ANALYZER_MODE=lazy).
+
+Анализатор шарда (пары CSV из манифеста) создаётся по первому запросу к его клиенту.
+Пул ограничен числом анализаторов и/или суммарным объёмом их таблиц в памяти;
+при превышении вытесняются давно не использованные. Последний загруженный не
+вытесняется, даже если один превышает лимит по памяти.
+
+Таблица признаков, сводка сегментов и индекс похожих клиентов собираются лениво, уже после
+загрузки, и часто больше самих таблиц — поэтому объём анализатора пересчитывается, когда
+у него появляется новая производная структура (проверяется при каждом обращении к пулу).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from services.analytics import ClientAnalyzer
+from services.manifest import Manifest
+
+
+def derived_state(analyzer: ClientAnalyzer) -> tuple:
+    """Какие производные структуры анализатора собраны (объекты — при пересборке меняются)"""
+    return analyzer._features, analyzer._segments, analyzer._lookalikes
+
+
+def analyzer_bytes(analyzer: ClientAnalyzer) -> int:
+    """
+    Оценка памяти анализатора: строки обеих таблиц и собранные производные структуры
+    (таблица признаков, сводка сегментов, индекс похожих клиентов)
+    """
+    total = 0
+    for df in (analyzer.transactions_df, analyzer.transfers_df):
+        total += int(df.memory_usage(index=True, deep=True).sum())
+    total += sum(structure.nbytes for structure in derived_state(analyzer) if structure is not None)
+    return total
+
+
+class AnalyzerPool:
+    def __init__(self, manifest: Manifest, max_analyzers: int = 0, max_bytes: int = 0):
+        """max_analyzers / max_bytes — лимиты пула, 0 — без ограничения"""
+        self.manifest = manifest
+        self.max_analyzers = max_analyzers
+        self.max_bytes = max_bytes
+        # shard -> (анализатор, оценка памяти, производные структуры на момент оценки)
+        self._items: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Отдельная блокировка на шард: один шард не загружается параллельно дважды
+        self._loading: Dict[int, threading.Lock] = {}
+
+        self.loads = 0
+        self.evictions = 0
+        self.hits = 0
+        self.load_seconds = 0.0
+        self.warmup = {"target": 0, "loaded": 0, "done": True, "error": None}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def bytes(self) -> int:
+        return sum(item[1] for item in self._items.values())
+
+    def _hit(self, shard: int) -> Optional[ClientAnalyzer]:
+        # Под self._lock
+        item = self._items.get(shard)
+        if item is None:
+            return None
+        self._items.move_to_end(shard)
+        self.hits += 1
+        self._remeasure()
+        return item[0]
+
+    def get(self, shard: int) -> ClientAnalyzer:
+        """Анализатор шарда; загружается, если его нет в пуле"""
+        with self._lock:
+            analyzer = self._hit(shard)
+            if analyzer is not None:
+                return analyzer
+            loading = self._loading.setdefault(shard, threading.Lock())
+
+        try:
+            with loading:
+                with self._lock:
+                    analyzer = self._hit(shard)
+                    if analyzer is not None:
+                        return analyzer
+
+                info = self.manifest.shards[shard]
+                started = time.perf_counter()
+                analyzer = ClientAnalyzer(info['transactions'], info['transfers'])
+                elapsed = time.perf_counter() - started
+
+                with self._lock:
+                    self._items[shard] = (analyzer, analyzer_bytes(analyzer), derived_state(analyzer))
+                    self.loads += 1
+                    self.load_seconds += elapsed
+                    self._remeasure()
+                return analyzer
+        finally:
+            # Блокировка нужна только на время загрузки: ждущие её потоки найдут шард в пуле,
+            # а словарь не растёт с числом когда-либо загруженных шардов
+            with self._lock:
+                if self._loading.get(shard) is loading:
+                    del self._loading[shard]
+
+    def for_client(self, client_code: int) -> Optional[ClientAnalyzer]:
+        shard = self.manifest.shard_of(client_code)
+        return None if shard is None else self.get(shard)
+
+    def _remeasure(self):
+        """Пересчитать объём анализаторов, у которых собрались производные структуры, и вытеснить лишнее"""
+        for shard, (analyzer, size, state) in list(self._items.items()):
+            current = derived_state(analyzer)
+            if any(a is not b for a, b in zip(current, state)):
+                self._items[shard] = (analyzer, analyzer_bytes(analyzer), current)
+        self._evict()
+
+    def _evict(self):
+        while len(self._items) > 1 and (
+                (self.max_analyzers and len(self._items) > self.max_analyzers)
+                or (self.max_bytes and self.bytes > self.max_bytes)):
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def start_warm_up(self, shards: Iterable[int]) -> threading.Thread:
+        """
+        Загрузить шарды заранее в фоновом потоке. Состояние прогрева выставляется до старта потока:
+        /api/ready не должен увидеть done=True от начального состояния, пока поток ещё не начал
+        """
+        shards = list(shards)
+        self.warmup = {"target": len(shards), "loaded": 0, "done": False, "error": None}
+        thread = threading.Thread(target=self._warm_up, args=(shards,), name="analyzer-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def warm_up(self, shards: Iterable[int]):
+        """Загрузить шарды заранее (в текущем потоке); прогресс — в self.warmup"""
+        shards = list(shards)
+        self.warmup = {"target": len(shards), "loaded": 0, "done": False, "error": None}
+        self._warm_up(shards)
+
+    def _warm_up(self, shards: List[int]):
+        try:
+            for shard in shards:
+                self.get(shard)
+                self.warmup["loaded"] += 1
+        except Exception as e:
+            self.warmup["error"] = str(e)
+        finally:
+            self.warmup["done"] = True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._remeasure()
+        return {
+            "shards": len(self.manifest.shards),
+            "loaded": len(self._items),
+            "bytes": self.bytes,
+            "max_analyzers": self.max_analyzers,
+            "max_bytes": self.max_bytes,
+            "loads": self.loads,
+            "hits": self.hits,
+            "evictions": self.evictions,
+            "avg_load_ms": self.load_seconds / self.loads * 1000 if self.loads else 0.0,
+            "warmup": dict(self.warmup),
+        }
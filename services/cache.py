@@ -0,0 +1,83 @@
+"""
+LRU-кэш результатов диагностики.
+
+Ключ — (client_code, версия данных): при пересборке хранилища версия меняется,
+и старые записи просто перестают находиться (а затем вытесняются). Явная инвалидация
+по клиентам или целиком — для перезагрузки и инкрементальной загрузки данных.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+
+class ResultCache:
+    def __init__(self, max_size: int, ttl: float = 0):
+        """ttl — время жизни записи в секундах, 0 — без ограничения"""
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: "OrderedDict[Tuple[int, Hashable], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, client_code: int, version: Hashable) -> Optional[Any]:
+        key = (client_code, version)
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            stored_at, value = item
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._items[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, client_code: int, version: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+        key = (client_code, version)
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, client_codes: Optional[Iterable[int]] = None) -> int:
+        """Удалить записи указанных клиентов (всех версий) или весь кэш, если client_codes не задан"""
+        with self._lock:
+            if client_codes is None:
+                removed = len(self._items)
+                self._items.clear()
+            else:
+                codes = set(client_codes)
+                stale = [key for key in self._items if key[0] in codes]
+                for key in stale:
+                    del self._items[key]
+                removed = len(stale)
+            self.invalidations += removed
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
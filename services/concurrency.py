@@ -0,0 +1,87 @@
+"""
+Ограниченный пул для синхронной аналитики (pandas/numpy), вызываемой из async-эндпоинтов.
+
+Тяжёлые вызовы уходят в ThreadPoolExecutor, чтобы не блокировать event loop;
+семафор ограничивает число одновременно выполняемых задач, а длина очереди ожидающих
+ограничена — при переполнении запрос сразу отклоняется (PoolOverloaded), а не копится.
+Потоки, а не процессы: данные анализаторов уже в памяти процесса (mmap), а numpy
+отпускает GIL на векторных операциях.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict
+
+
+class PoolOverloaded(Exception):
+    """Очередь ожидающих задач заполнена"""
+
+
+class AnalyticsPool:
+    def __init__(self, workers: int, max_concurrency: int, max_queue: int):
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analytics")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        # Метрики очереди
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Выполнить fn(*args, **kwargs) в пуле, дождавшись свободного слота"""
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise PoolOverloaded(f"analytics queue is full ({self.queued} waiting)")
+
+        queued_at = time.perf_counter()
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        started = time.perf_counter()
+        self.wait_seconds += started - queued_at
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, partial(fn, *args, **kwargs))
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.run_seconds += time.perf_counter() - started
+            self._semaphore.release()
+
+        self.completed += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.completed + self.failed
+        return {
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_ms": self.wait_seconds / finished * 1000 if finished else 0.0,
+            "avg_run_ms": self.run_seconds / finished * 1000 if finished else 0.0,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,105 @@
+import os
+
+
+# Каталог с исходными CSV (client_{i}_transactions_3m.csv / client_{i}_transfers_3m.csv)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Каталог колоночного хранилища, которое собирается из DATA_DIR один раз (см. services/store.py)
+STORE_DIR = os.getenv("STORE_DIR", "store")
+# Сколько поколений хранилища держать на диске (текущее не удаляется никогда)
+STORE_KEEP_GENERATIONS = int(os.getenv("STORE_KEEP_GENERATIONS", "2"))
+# Несколько воркеров (services/loader.py): собирает ли воркер хранилище сам, если его нет
+# или оно устарело (0 — только подключается к поколению, собранному загрузчиком),
+# и период проверки CURRENT в секундах для переключения на новое поколение (0 — не проверять)
+STORE_AUTO_BUILD = os.getenv("STORE_AUTO_BUILD", "1") != "0"
+STORE_POLL_SECONDS = float(os.getenv("STORE_POLL_SECONDS", "0"))
+
+# Пул для синхронной аналитики в /api/diagnose (services/concurrency.py)
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", str(min(4, os.cpu_count() or 1))))
+ANALYTICS_MAX_CONCURRENCY = int(os.getenv("ANALYTICS_MAX_CONCURRENCY", str(ANALYTICS_WORKERS)))
+ANALYTICS_MAX_QUEUE = int(os.getenv("ANALYTICS_MAX_QUEUE", "256"))
+
+# Искусственная задержка ответа /api/diagnose для UX, секунды (0 — без задержки)
+DIAGNOSE_DELAY = float(os.getenv("DIAGNOSE_DELAY", "0"))
+
+# Максимум client_code в одном запросе /api/diagnose_batch
+DIAGNOSE_BATCH_MAX = int(os.getenv("DIAGNOSE_BATCH_MAX", "10000"))
+
+# Поиск похожих клиентов /api/lookalikes (services/lookalikes.py): максимум k и размер буфера
+# изменившихся клиентов, после которого индекс собирается заново
+LOOKALIKE_MAX_K = int(os.getenv("LOOKALIKE_MAX_K", "100"))
+LOOKALIKE_DELTA_MAX = int(os.getenv("LOOKALIKE_DELTA_MAX", "50000"))
+# Кластерный индекс для больших баз: от LOOKALIKE_IVF_MIN_CLIENTS клиентов векторы делятся k-means
+# на ~sqrt(N) кластеров, и запрос просматривает LOOKALIKE_IVF_PROBES ближайших кластеров вместо всей
+# матрицы (приближённый поиск; меньше — полный перебор)
+LOOKALIKE_IVF_MIN_CLIENTS = int(os.getenv("LOOKALIKE_IVF_MIN_CLIENTS", "200000"))
+LOOKALIKE_IVF_PROBES = int(os.getenv("LOOKALIKE_IVF_PROBES", "16"))
+
+# What-if симулятор констант правил продуктов /api/simulate (services/simulator.py): максимум сценариев в сетке
+SIMULATION_MAX_SCENARIOS = int(os.getenv("SIMULATION_MAX_SCENARIOS", "1000"))
+
+# Потоковая сборка признаков (services/streaming.py, csv_generator.py --stream): строк CSV в одном блоке
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "500000"))
+
+# Outbox push-уведомлений (services/outbox.py, /api/outbox): приёмник — "jsonl" (OUTBOX_PATH), "http" (OUTBOX_URL)
+# или "" (выключен); журнал недоставленных уведомлений для восстановления после перезапуска. Журнал ведёт
+# один процесс (блокировка <journal>.lock): при uvicorn --workers N outbox работает в одном воркере
+OUTBOX_SINK = os.getenv("OUTBOX_SINK", "")
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", os.path.join("outbox", "sent.jsonl"))
+OUTBOX_URL = os.getenv("OUTBOX_URL", "")
+OUTBOX_JOURNAL = os.getenv("OUTBOX_JOURNAL", os.path.join("outbox", "journal.jsonl"))
+# Размер очереди (при заполнении производитель ждёт), пакет отправки: уведомлений и секунд ожидания добора
+OUTBOX_MAX_QUEUE = int(os.getenv("OUTBOX_MAX_QUEUE", "10000"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_BATCH_SECONDS = float(os.getenv("OUTBOX_BATCH_SECONDS", "0.5"))
+# Лимит скорости доставки, уведомлений в секунду (0 — без лимита)
+OUTBOX_RATE = float(os.getenv("OUTBOX_RATE", "1000"))
+# Окно, в котором повтор пары (client_code, продукт) не отправляется, секунды
+OUTBOX_COOLDOWN_SECONDS = float(os.getenv("OUTBOX_COOLDOWN_SECONDS", "86400"))
+# Попыток отправки пакета и пауза перед первым повтором (дальше удваивается)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_SECONDS = float(os.getenv("OUTBOX_RETRY_SECONDS", "1.0"))
+# fsync журнала после каждой групповой записи (0 — только flush: быстрее, но при сбое питания
+# последние принятые уведомления могут потеряться)
+OUTBOX_FSYNC = os.getenv("OUTBOX_FSYNC", "1") != "0"
+# Строк журнала, после которых он сжимается до недоставленных уведомлений и отметок cooldown
+OUTBOX_COMPACT_LINES = int(os.getenv("OUTBOX_COMPACT_LINES", "100000"))
+
+# Фоновые задания /api/diagnose_all/jobs и потоковый /api/diagnose_all/stream (services/jobs.py)
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "256"))
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "100"))
+
+# Кэш результатов /api/diagnose (services/cache.py): размер LRU и TTL в секундах (0 — без TTL)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "0"))
+
+# Инкрементальная загрузка (services/ingest.py): каталог, из которого /api/ingest читает дельты,
+# и скользящее окно данных в днях (0 — строки не удаляются)
+INGEST_DIR = os.getenv("INGEST_DIR", os.path.join(DATA_DIR, "incoming"))
+DATA_WINDOW_DAYS = int(os.getenv("DATA_WINDOW_DAYS", "0"))
+
+# Профилировщик медленных запросов (services/profiler.py): порог в мс (0 — выключен),
+# период сэмплирования стеков и каталог для collapsed stacks
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Режим загрузки данных: "store" — всё колоночное хранилище сразу (mmap), "lazy" — анализатор
+# шарда (пары CSV) загружается по первому запросу, см. services/manifest.py и services/analyzer_pool.py
+ANALYZER_MODE = os.getenv("ANALYZER_MODE", "store")
+MANIFEST_PATH = os.getenv("MANIFEST_PATH", "manifest.json")
+# Лимиты пула анализаторов в ленивом режиме: число шардов и память в МБ (0 — без ограничения)
+ANALYZER_POOL_SIZE = int(os.getenv("ANALYZER_POOL_SIZE", "16"))
+ANALYZER_POOL_MAX_MB = float(os.getenv("ANALYZER_POOL_MAX_MB", "0"))
+# Сколько шардов загрузить заранее при старте в ленивом режиме
+ANALYZER_WARMUP = int(os.getenv("ANALYZER_WARMUP", "0"))
+
+# Шаблоны push-уведомлений (services/templates.py): версионируемый JSON с текстами,
+# A/B-вариантами и локалями; NOTIFICATION_LOCALE — локаль по умолчанию для ответов API
+NOTIFICATION_TEMPLATES = os.getenv(
+    "NOTIFICATION_TEMPLATES",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "notification_templates.json"))
+NOTIFICATION_LOCALE = os.getenv("NOTIFICATION_LOCALE") or None
+
+# Таблица курсов для пересчёта сумм в тенге (services/fx.py); по умолчанию — fx_rates.csv в каталоге данных
+FX_RATES = os.getenv("FX_RATES") or None
@@ -0,0 +1,83 @@
+"""
+Справочник клиентов для /api/clients.
+
+Собирается один раз при загрузке данных: компактная таблица client_code, name, product,
+status, city (строки — коды словаря) и предвычисленные списки строк по status и city.
+Страница отдаётся срезом, фильтр — готовым списком строк, без обхода анализаторов.
+"""
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+DIRECTORY_COLUMNS = ['name', 'product', 'status', 'city']
+FILTER_COLUMNS = ['status', 'city']
+
+
+class ClientDirectory:
+    def __init__(self, clients: pd.DataFrame, version: str):
+        """clients — строки client_code, name, product, status, city (по одной на клиента)"""
+        clients = clients.drop_duplicates('client_code').sort_values('client_code', kind='mergesort')
+        self.version = version
+        self.client_codes = clients['client_code'].to_numpy(dtype=np.int64)
+        self.codes: Dict[str, np.ndarray] = {}
+        self.vocab: Dict[str, List[str]] = {}
+        for col in DIRECTORY_COLUMNS:
+            values = clients[col].astype(str).astype('category')
+            self.codes[col] = values.cat.codes.to_numpy()
+            self.vocab[col] = list(values.cat.categories)
+
+        # Для каждого значения фильтра — отсортированные номера строк
+        self._rows: Dict[str, Dict[str, np.ndarray]] = {}
+        for col in FILTER_COLUMNS:
+            order = np.argsort(self.codes[col], kind='stable')
+            bounds = np.searchsorted(self.codes[col][order], np.arange(len(self.vocab[col]) + 1))
+            self._rows[col] = {
+                value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(self.vocab[col])
+            }
+
+    @classmethod
+    def from_analyzers(cls, analyzers: Iterable) -> 'ClientDirectory':
+        analyzers = list(analyzers)
+        parts = [pd.DataFrame(analyzer.get_all_clients()) for analyzer in analyzers]
+        parts = [part for part in parts if not part.empty]
+        if parts:
+            clients = pd.concat(parts, ignore_index=True)
+        else:
+            clients = pd.DataFrame({col: pd.Series(dtype='object') for col in ['client_code'] + DIRECTORY_COLUMNS})
+        version = "+".join(sorted({f"{analyzer.version}.{analyzer.revision}" for analyzer in analyzers}))
+        return cls(clients, version)
+
+    def __len__(self) -> int:
+        return len(self.client_codes)
+
+    def etag(self, *params) -> str:
+        """ETag ответа: версия данных + параметры запроса"""
+        digest = hashlib.sha1(repr((self.version,) + params).encode()).hexdigest()[:20]
+        return f'"{digest}"'
+
+    def select(self, status: Optional[str] = None, city: Optional[str] = None) -> np.ndarray:
+        """Номера строк, подходящих под фильтры, по возрастанию client_code"""
+        rows = None
+        for col, value in (('status', status), ('city', city)):
+            if value is None:
+                continue
+            matched = self._rows[col].get(value, np.zeros(0, dtype=np.int64))
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        if rows is None:
+            return np.arange(len(self.client_codes))
+        return np.sort(rows)
+
+    def page(self, offset: int = 0, limit: Optional[int] = None, status: Optional[str] = None,
+             city: Optional[str] = None) -> Tuple[int, List[Dict]]:
+        """(число подходящих клиентов, страница [offset, offset + limit))"""
+        rows = self.select(status, city)
+        end = None if limit is None else offset + limit
+        clients = []
+        for row in rows[offset:end]:
+            client = {'client_code': int(self.client_codes[row])}
+            for col in DIRECTORY_COLUMNS:
+                client[col] = self.vocab[col][self.codes[col][row]]
+            clients.append(client)
+        return len(rows), clients
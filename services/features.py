@@ -0,0 +1,587 @@
+"""
+Извлечение признаков клиентов за один проход.
+
+Вместо отдельных отфильтрованных сумм на каждого клиента все транзакции и переводы
+раскладываются одним bincount в сводные таблицы (client_code x category) и
+(client_code x type x direction), из которых затем выводятся метрики analyze_client
+для всех клиентов сразу. Та же функция derive_metrics используется и для одного клиента,
+поэтому результаты совпадают бит в бит.
+
+Рядом строится календарный куб — те же суммы и количества с осью месяца
+(client_code x month x category) и (client_code x month x type x direction).
+Оконные метрики (последний месяц, динамика месяц к месяцу, регулярность зарплаты)
+и запросы за последние N месяцев (window_sums) считаются по кубу, без повторного
+прохода по строкам и без фильтров по датам на запрос.
+"""
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from services.fx import AMOUNT_COLUMN
+from services.scoring import FEATURES
+
+# Группы категорий и типов переводов, из которых собираются метрики
+TRAVEL_CATEGORIES = ['Путешествия', 'Отели', 'Такси']
+RESTAURANT_CATEGORIES = ['Кафе и рестораны']
+ONLINE_CATEGORIES = ['Едим дома', 'Смотрим дома', 'Играем дома']
+LUXURY_CATEGORIES = ['Ювелирные украшения', 'Косметика и Парфюмерия']
+
+FX_TYPES = ['fx_buy', 'fx_sell']
+GOLD_TYPES = ['gold_buy_out', 'gold_sell_in']
+INVEST_TYPES = ['invest_out', 'invest_in']
+ATM_TYPES = ['atm_withdrawal']
+SALARY_TYPES = ['salary_in']
+
+PROFILE_COLUMNS = ['name', 'product', 'status', 'city']
+TOP_CATEGORIES = 3
+
+
+def _positions(categories: List[str], names: List[str]) -> List[int]:
+    """Коды категорий из names, которые есть в словаре (порядок names сохраняется)"""
+    lookup = {name: i for i, name in enumerate(categories)}
+    return [lookup[name] for name in names if name in lookup]
+
+
+def category_codes(series: pd.Series):
+    """Коды и словарь строковой колонки (категориальной или обычной)"""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype('category')
+    return series.cat.codes.to_numpy(), list(series.cat.categories)
+
+
+def month_ordinals(dates: pd.Series) -> np.ndarray:
+    """Календарный месяц каждой даты — число месяцев с 1970-01"""
+    return dates.to_numpy(dtype='datetime64[ns]').astype('datetime64[M]').astype(np.int64)
+
+
+def month_range(*ordinals: np.ndarray) -> np.ndarray:
+    """Все месяцы от первого до последнего встреченного (без пропусков)"""
+    present = [values for values in ordinals if len(values)]
+    if not present:
+        return np.zeros(0, dtype=np.int64)
+    return np.arange(min(values.min() for values in present), max(values.max() for values in present) + 1)
+
+
+class FeatureLayout:
+    """Словари категорий/типов/направлений и предвычисленные позиции групп"""
+
+    def __init__(self, categories: List[str], transfer_types: List[str], directions: List[str],
+                 months: Optional[np.ndarray] = None):
+        self.categories = list(categories)
+        self.transfer_types = list(transfer_types)
+        self.directions = list(directions)
+        # Ось месяцев календарного куба (см. month_range), последний — самый свежий
+        self.months = np.zeros(0, dtype=np.int64) if months is None else np.asarray(months, dtype=np.int64)
+
+        self.travel = _positions(self.categories, TRAVEL_CATEGORIES)
+        self.restaurant = _positions(self.categories, RESTAURANT_CATEGORIES)
+        self.online = _positions(self.categories, ONLINE_CATEGORIES)
+        self.luxury = _positions(self.categories, LUXURY_CATEGORIES)
+        self.fx = _positions(self.transfer_types, FX_TYPES)
+        self.gold = _positions(self.transfer_types, GOLD_TYPES)
+        self.invest = _positions(self.transfer_types, INVEST_TYPES)
+        self.atm = _positions(self.transfer_types, ATM_TYPES)
+        self.salary = _positions(self.transfer_types, SALARY_TYPES)
+        self.direction_in = _positions(self.directions, ['in'])
+        self.direction_out = _positions(self.directions, ['out'])
+
+        # Ранг названия категории — для детерминированного порядка при равных суммах
+        self.category_rank = np.argsort(np.argsort(np.array(self.categories, dtype=object)))
+
+        # Метрика, которую calculate_product_scores подставляет для категории из топа
+        # (metrics.get(f'{cat.lower()}_spending', 0)), или -1, если такой метрики нет
+        self.category_metric = np.array([
+            FEATURES.index(f'{name.lower()}_spending') if f'{name.lower()}_spending' in FEATURES else -1
+            for name in self.categories
+        ], dtype=np.int64)
+
+    @property
+    def n_flows(self) -> int:
+        return len(self.transfer_types) * len(self.directions)
+
+    @property
+    def n_months(self) -> int:
+        return len(self.months)
+
+    @property
+    def month_labels(self) -> List[str]:
+        return [str(month) for month in self.months.astype('datetime64[M]')]
+
+    def month_codes(self, months: np.ndarray) -> np.ndarray:
+        """Номер месяца на оси куба для month_ordinals строк"""
+        first = self.months[0] if self.n_months else 0
+        return months - first
+
+    def flow_codes(self, type_codes: np.ndarray, direction_codes: np.ndarray) -> np.ndarray:
+        """Ключ перевода: type * n_directions + direction"""
+        return type_codes.astype(np.int64) * len(self.directions) + direction_codes
+
+
+def derive_metrics(layout: FeatureLayout, cat_sum: np.ndarray, cat_cnt: np.ndarray,
+                   flow_sum: np.ndarray, flow_cnt: np.ndarray, months: int = 3) -> Dict[str, np.ndarray]:
+    """
+    Метрики analyze_client для строк сводных таблиц:
+    cat_sum/cat_cnt — (n, n_categories), flow_sum/flow_cnt — (n, n_types, n_directions).
+    months — число месяцев, за которые собраны суммы (для среднемесячного баланса).
+    """
+    out_sum = flow_sum[:, :, layout.direction_out].sum(axis=2)
+    out_cnt = flow_cnt[:, :, layout.direction_out].sum(axis=2)
+    total_in = flow_sum[:, :, layout.direction_in].sum(axis=2).sum(axis=1)
+    total_out = out_sum.sum(axis=1)
+
+    return {
+        'total_spending': cat_sum.sum(axis=1),
+        'travel_spending': cat_sum[:, layout.travel].sum(axis=1),
+        'restaurant_spending': cat_sum[:, layout.restaurant].sum(axis=1),
+        'online_spending': cat_sum[:, layout.online].sum(axis=1),
+        'luxury_spending': cat_sum[:, layout.luxury].sum(axis=1),
+        'has_fx': out_cnt[:, layout.fx].sum(axis=1) > 0,
+        'has_gold': out_cnt[:, layout.gold].sum(axis=1) > 0,
+        'has_investments': out_cnt[:, layout.invest].sum(axis=1) > 0,
+        'atm_withdrawals': out_sum[:, layout.atm].sum(axis=1),
+        'avg_monthly_balance': (total_in - total_out) / months,
+    }
+
+
+def derive_window_metrics(layout: FeatureLayout, month_cat_sum: np.ndarray,
+                          month_flow_cnt: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Оконные метрики по календарному кубу: month_cat_sum — (n, n_months, n_categories),
+    month_flow_cnt — (n, n_months, n_types, n_directions), весь куб или его последние месяцы
+    (окно window_sums). Последний месяц — последний месяц данных (он может быть неполным,
+    если данные обрываются посреди месяца).
+    """
+    n, n_months = month_cat_sum.shape[:2]
+    monthly = month_cat_sum.sum(axis=2)
+    last = monthly[:, -1] if n_months else np.zeros(n)
+    previous = monthly[:, -2] if n_months > 1 else np.zeros(n)
+    trend = (last - previous) / np.where(previous > 0, previous, 1.0)
+
+    salary = month_flow_cnt[:, :, layout.salary].sum(axis=(2, 3)) > 0
+    return {
+        'last_month_spending': last,
+        'spending_trend': np.where(previous > 0, trend, 0.0),
+        'salary_regularity': salary.sum(axis=1) / max(n_months, 1),
+    }
+
+
+def window_sums(layout: FeatureLayout, months: int, month_cat_sum: np.ndarray, month_cat_cnt: np.ndarray,
+                month_flow_sum: np.ndarray, month_flow_cnt: np.ndarray):
+    """Сводные таблицы (как у aggregate) за последние months месяцев куба"""
+    window = slice(max(layout.n_months - months, 0), layout.n_months)
+    return (month_cat_sum[:, window].sum(axis=1), month_cat_cnt[:, window].sum(axis=1),
+            month_flow_sum[:, window].sum(axis=1), month_flow_cnt[:, window].sum(axis=1))
+
+
+def top_category_codes(layout: FeatureLayout, cat_sum: np.ndarray, cat_cnt: np.ndarray,
+                       k: int = TOP_CATEGORIES) -> np.ndarray:
+    """
+    Коды топ-k категорий по убыванию суммы (округлённой до копеек), при равенстве — по названию.
+    Категории без транзакций не попадают в топ; пустые места — -1.
+    """
+    present = cat_cnt > 0
+    key = np.where(present, -np.round(cat_sum, 2), np.inf)
+    rank = np.broadcast_to(layout.category_rank, key.shape)
+    order = np.lexsort((rank, key), axis=1)[:, :k]
+    return np.where(np.take_along_axis(present, order, axis=1), order, -1)
+
+
+def metrics_matrix(layout: FeatureLayout, metrics: Dict[str, np.ndarray], top_codes: np.ndarray) -> np.ndarray:
+    """Матрица (клиенты x scoring.FEATURES) для пакетного скоринга"""
+    matrix = np.zeros((len(top_codes), len(FEATURES)))
+    for j, name in enumerate(FEATURES[:-1]):
+        matrix[:, j] = metrics[name]
+
+    # top_spending: сумма метрик категорий из топа — в том же порядке, что sum() в скалярном пути
+    metric = np.where(top_codes >= 0, layout.category_metric[np.maximum(top_codes, 0)], -1)
+    top_spending = np.zeros(len(top_codes))
+    for j in range(top_codes.shape[1]):
+        values = np.take_along_axis(matrix, np.maximum(metric[:, j:j + 1], 0), axis=1)[:, 0]
+        top_spending = top_spending + np.where(metric[:, j] >= 0, values, 0)
+    matrix[:, -1] = top_spending
+    return matrix
+
+
+def metrics_dict(layout: FeatureLayout, metrics: Dict[str, np.ndarray], top_codes: np.ndarray, row: int) -> Dict:
+    """Словарь metrics одного клиента в формате analyze_client"""
+    result = {}
+    for name, values in metrics.items():
+        value = values[row]
+        result[name] = bool(value) if values.dtype == bool else float(value)
+    result['top_categories'] = [layout.categories[c] for c in top_codes[row] if c >= 0]
+    return result
+
+
+def aggregate(layout: FeatureLayout, client_codes: np.ndarray,
+              tx_clients: np.ndarray, tx_category: np.ndarray, tx_amount: np.ndarray, tx_month: np.ndarray,
+              tr_clients: np.ndarray, tr_flows: np.ndarray, tr_amount: np.ndarray, tr_month: np.ndarray):
+    """
+    Сводные суммы и количества по (client, category) и (client, type, direction)
+    для клиентов client_codes (отсортированы), затем те же таблицы с осью месяца
+    (tx_month/tr_month — layout.month_codes строк). Строки других клиентов пропускаются.
+    """
+    n_clients = len(client_codes)
+    n_categories = len(layout.categories)
+    n_months = layout.n_months
+
+    def positions(clients):
+        pos = np.searchsorted(client_codes, clients)
+        if not n_clients:
+            return pos, np.zeros(len(clients), dtype=bool)
+        return pos, (pos < n_clients) & (client_codes[np.minimum(pos, n_clients - 1)] == clients)
+
+    # (client_code, category)
+    tx_pos, tx_known = positions(tx_clients)
+    key = tx_pos[tx_known] * n_categories + tx_category[tx_known]
+    size = n_clients * n_categories
+    cat_sum = np.bincount(key, weights=tx_amount[tx_known], minlength=size).reshape(n_clients, n_categories)
+    cat_cnt = np.bincount(key, minlength=size).reshape(n_clients, n_categories)
+
+    # (client_code, type, direction)
+    tr_pos, tr_known = positions(tr_clients)
+    key = tr_pos[tr_known] * layout.n_flows + tr_flows[tr_known]
+    size = n_clients * layout.n_flows
+    shape = (n_clients, len(layout.transfer_types), len(layout.directions))
+    flow_sum = np.bincount(key, weights=tr_amount[tr_known], minlength=size).reshape(shape)
+    flow_cnt = np.bincount(key, minlength=size).reshape(shape)
+
+    # Календарный куб: (client_code, month, category) и (client_code, month, type, direction).
+    # Количества — int32: куб в n_months раз больше сводных таблиц
+    key = (tx_pos[tx_known] * n_months + tx_month[tx_known]) * n_categories + tx_category[tx_known]
+    shape = (n_clients, n_months, n_categories)
+    month_cat_sum = np.bincount(key, weights=tx_amount[tx_known], minlength=np.prod(shape)).reshape(shape)
+    month_cat_cnt = np.bincount(key, minlength=np.prod(shape)).astype(np.int32).reshape(shape)
+
+    key = (tr_pos[tr_known] * n_months + tr_month[tr_known]) * layout.n_flows + tr_flows[tr_known]
+    shape = (n_clients, n_months, len(layout.transfer_types), len(layout.directions))
+    month_flow_sum = np.bincount(key, weights=tr_amount[tr_known], minlength=np.prod(shape)).reshape(shape)
+    month_flow_cnt = np.bincount(key, minlength=np.prod(shape)).astype(np.int32).reshape(shape)
+
+    return cat_sum, cat_cnt, flow_sum, flow_cnt, month_cat_sum, month_cat_cnt, month_flow_sum, month_flow_cnt
+
+
+def _pad(values: np.ndarray, axis: int, size: int) -> np.ndarray:
+    """Дополнить массив нулями по оси axis до size (новые категории добавляются в конец словаря)"""
+    missing = size - values.shape[axis]
+    if missing <= 0:
+        return values
+    widths = [(0, 0)] * values.ndim
+    widths[axis] = (0, missing)
+    return np.pad(values, widths)
+
+
+def _realign_months(values: np.ndarray, old_months: np.ndarray, new_months: np.ndarray) -> np.ndarray:
+    """Переложить ось месяцев куба (axis=1) на новый диапазон: новые месяцы — нули, выпавшие — отбрасываются"""
+    result = np.zeros((values.shape[0], len(new_months)) + values.shape[2:], dtype=values.dtype)
+    _, old, new = np.intersect1d(old_months, new_months, return_indices=True)
+    result[:, new] = values[:, old]
+    return result
+
+
+# Сводные таблицы ClientFeatures: строка — клиент (в порядке client_codes)
+TABLES = ['cat_sum', 'cat_cnt', 'flow_sum', 'flow_cnt', 'month_cat_sum', 'month_cat_cnt', 'month_flow_sum',
+          'month_flow_cnt']
+
+
+class ClientFeatures:
+    """
+    Широкая таблица признаков всех клиентов, ключ — client_code.
+    Хранит сводные суммы/количества, календарный куб и выведенные из них метрики. Таблицы
+    поддерживаются инкрементально (apply), метрики пересчитываются только для затронутых строк.
+    Строки есть и у клиентов только с переводами, но для анализа доступны лишь клиенты
+    с транзакциями (как в analyze_client).
+    """
+
+    def __init__(self, layout: FeatureLayout, client_codes: np.ndarray, profile: pd.DataFrame,
+                 cat_sum: np.ndarray, cat_cnt: np.ndarray, flow_sum: np.ndarray, flow_cnt: np.ndarray,
+                 month_cat_sum: np.ndarray, month_cat_cnt: np.ndarray, month_flow_sum: np.ndarray,
+                 month_flow_cnt: np.ndarray):
+        self.layout = layout
+        self.client_codes = client_codes
+        self.profile = profile.reset_index(drop=True)
+        self.cat_sum = cat_sum
+        self.cat_cnt = cat_cnt
+        self.flow_sum = flow_sum
+        self.flow_cnt = flow_cnt
+        self.month_cat_sum = month_cat_sum
+        self.month_cat_cnt = month_cat_cnt
+        self.month_flow_sum = month_flow_sum
+        self.month_flow_cnt = month_flow_cnt
+        self.refresh()
+
+    def _metrics(self, rows) -> Dict[str, np.ndarray]:
+        metrics = derive_metrics(self.layout, self.cat_sum[rows], self.cat_cnt[rows],
+                                 self.flow_sum[rows], self.flow_cnt[rows])
+        metrics.update(derive_window_metrics(self.layout, self.month_cat_sum[rows], self.month_flow_cnt[rows]))
+        return metrics
+
+    def refresh(self, rows: Optional[np.ndarray] = None):
+        """Пересчитать метрики из сводных таблиц — для всех строк или только для rows"""
+        if rows is None:
+            self.metrics = self._metrics(slice(None))
+            self.top_codes = top_category_codes(self.layout, self.cat_sum, self.cat_cnt)
+            self.active = self.cat_cnt.sum(axis=1) > 0
+            return
+
+        for name, values in self._metrics(rows).items():
+            self.metrics[name][rows] = values
+        self.top_codes[rows] = top_category_codes(self.layout, self.cat_sum[rows], self.cat_cnt[rows])
+        self.active[rows] = self.cat_cnt[rows].sum(axis=1) > 0
+
+    def __len__(self) -> int:
+        return len(self.client_codes)
+
+    def copy(self) -> 'ClientFeatures':
+        """Независимая копия таблиц и метрик: apply/extend_layout копии не видны читателям оригинала"""
+        features = self.__class__.__new__(self.__class__)
+        features.layout = self.layout
+        features.client_codes = self.client_codes
+        # Профиль и коды клиентов не меняются на месте (_insert/_remove собирают новые)
+        features.profile = self.profile
+        for name in TABLES:
+            setattr(features, name, np.array(getattr(self, name)))
+        features.metrics = {name: np.array(values) for name, values in self.metrics.items()}
+        features.top_codes = np.array(self.top_codes)
+        features.active = np.array(self.active)
+        return features
+
+    @property
+    def nbytes(self) -> int:
+        """Объём сводных таблиц, куба, метрик и профиля"""
+        return (sum(getattr(self, name).nbytes for name in TABLES)
+                + sum(values.nbytes for values in self.metrics.values())
+                + self.client_codes.nbytes + self.top_codes.nbytes + self.active.nbytes
+                + int(self.profile.memory_usage(index=True, deep=True).sum()))
+
+    def save(self, path: str) -> Dict:
+        """
+        Записать таблицы, метрики и профиль в path (по .npy на массив) для ClientFeatures.load.
+        Возвращает описание, которое нужно передать в load (имена метрик, словари профиля).
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = {'client_codes': self.client_codes, 'top_codes': self.top_codes, 'active': self.active}
+        arrays.update((name, getattr(self, name)) for name in TABLES)
+        arrays.update((f'metric_{name}', values) for name, values in self.metrics.items())
+        profile = {}
+        for col in PROFILE_COLUMNS:
+            values = pd.Categorical(self.profile[col])
+            arrays[f'profile_{col}'] = values.codes
+            profile[col] = values.categories.tolist()
+        for name, values in arrays.items():
+            np.save(os.path.join(path, f'{name}.npy'), np.asarray(values))
+        return {'metrics': list(self.metrics), 'profile': profile}
+
+    @classmethod
+    def load(cls, path: str, layout: FeatureLayout, info: Dict, mmap_mode: Optional[str] = 'c') -> 'ClientFeatures':
+        """
+        Открыть таблицу, записанную save, без пересчёта. По умолчанию массивы — mmap с
+        копированием при записи: процессы делят страницы, пока таблица не меняется (append/expire).
+        layout должен совпадать с тем, в котором таблица собиралась.
+        """
+        def array(name: str) -> np.ndarray:
+            return np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+        features = cls.__new__(cls)
+        features.layout = layout
+        features.client_codes = array('client_codes')
+        features.profile = pd.DataFrame({
+            col: pd.Categorical.from_codes(array(f'profile_{col}'), categories=categories)
+            for col, categories in info['profile'].items()
+        }, copy=False)
+        for name in TABLES:
+            setattr(features, name, array(name))
+        features.metrics = {name: array(f'metric_{name}') for name in info['metrics']}
+        features.top_codes = array('top_codes')
+        features.active = array('active')
+        return features
+
+    @property
+    def profile(self) -> pd.DataFrame:
+        return self._profile
+
+    @profile.setter
+    def profile(self, profile: pd.DataFrame):
+        self._profile = profile
+        self._profile_columns: Dict[str, np.ndarray] = {}
+
+    def profile_column(self, col: str) -> np.ndarray:
+        """Колонка профиля массивом (кэшируется до изменения состава клиентов) — без iloc по строкам"""
+        values = self._profile_columns.get(col)
+        if values is None:
+            values = self._profile_columns[col] = self._profile[col].to_numpy()
+        return values
+
+    def _row(self, client_code: int) -> Optional[int]:
+        i = int(np.searchsorted(self.client_codes, client_code))
+        if i < len(self.client_codes) and self.client_codes[i] == client_code:
+            return i
+        return None
+
+    def position(self, client_code: int) -> Optional[int]:
+        """Строка клиента или None, если клиента нет или у него нет транзакций"""
+        row = self._row(client_code)
+        return row if row is not None and self.active[row] else None
+
+    def rows(self) -> np.ndarray:
+        """Строки клиентов, доступных для анализа (с транзакциями), по возрастанию client_code"""
+        return np.flatnonzero(self.active)
+
+    def extend_layout(self, layout: FeatureLayout):
+        """
+        Перейти на расширенный словарь: новые категории/типы/направления добавлены в конец.
+        Ось месяцев перекладывается на диапазон layout; если он сдвинулся, оконные метрики
+        пересчитываются для всех клиентов (сменился «последний месяц»).
+        """
+        for name in ('cat_sum', 'cat_cnt', 'month_cat_sum', 'month_cat_cnt'):
+            values = getattr(self, name)
+            setattr(self, name, _pad(values, values.ndim - 1, len(layout.categories)))
+        for name in ('flow_sum', 'flow_cnt', 'month_flow_sum', 'month_flow_cnt'):
+            values = getattr(self, name)
+            values = _pad(values, values.ndim - 2, len(layout.transfer_types))
+            setattr(self, name, _pad(values, values.ndim - 1, len(layout.directions)))
+
+        months_changed = not np.array_equal(self.layout.months, layout.months)
+        if months_changed:
+            for name in ('month_cat_sum', 'month_cat_cnt', 'month_flow_sum', 'month_flow_cnt'):
+                setattr(self, name, _realign_months(getattr(self, name), self.layout.months, layout.months))
+        self.layout = layout
+        if months_changed:
+            self.refresh()
+
+    def apply(self, delta: 'ClientFeatures', sign: int = 1) -> np.ndarray:
+        """
+        Прибавить (sign=1) или вычесть (sign=-1) сводные суммы delta, посчитанные в том же layout.
+        Новые клиенты добавляются, клиенты без единой строки — удаляются.
+        Возвращает client_code затронутых клиентов.
+        """
+        if len(delta) == 0:
+            return delta.client_codes
+
+        new = ~np.isin(delta.client_codes, self.client_codes)
+        structural = bool(new.any())
+        if structural:
+            self._insert(delta.client_codes[new], delta.profile[new])
+
+        rows = np.searchsorted(self.client_codes, delta.client_codes)
+        for name in TABLES:
+            getattr(self, name)[rows] += sign * getattr(delta, name)
+
+        # После вычитания суммы опустевших ячеек могут остаться ненулевыми из-за округления
+        for total, count in (('cat_sum', 'cat_cnt'), ('flow_sum', 'flow_cnt'),
+                             ('month_cat_sum', 'month_cat_cnt'), ('month_flow_sum', 'month_flow_cnt')):
+            values = getattr(self, total)
+            values[rows] = np.where(getattr(self, count)[rows] > 0, values[rows], 0.0)
+
+        empty = rows[(self.cat_cnt[rows].sum(axis=1) == 0) & (self.flow_cnt[rows].sum(axis=(1, 2)) == 0)]
+        if len(empty):
+            self._remove(empty)
+            structural = True
+
+        if structural:
+            self.refresh()
+        else:
+            self.refresh(rows)
+        return delta.client_codes
+
+    def _insert(self, client_codes: np.ndarray, profile: pd.DataFrame):
+        codes = np.concatenate([self.client_codes, client_codes])
+        order = np.argsort(codes, kind='stable')
+        zeros = len(client_codes)
+        self.client_codes = codes[order]
+        self.profile = pd.concat([self.profile, profile], ignore_index=True).iloc[order].reset_index(drop=True)
+        for name in TABLES:
+            values = getattr(self, name)
+            setattr(self, name, np.concatenate([values, np.zeros((zeros,) + values.shape[1:],
+                                                                 dtype=values.dtype)])[order])
+
+    def _remove(self, rows: np.ndarray):
+        keep = np.ones(len(self.client_codes), dtype=bool)
+        keep[rows] = False
+        self.client_codes = self.client_codes[keep]
+        self.profile = self.profile[keep].reset_index(drop=True)
+        for name in TABLES:
+            setattr(self, name, getattr(self, name)[keep])
+
+    def window(self, months: int, rows: Optional[np.ndarray] = None):
+        """
+        Метрики analyze_client (включая оконные: последний месяц, тренд, регулярность зарплаты)
+        за последние months месяцев куба — для всех строк или для rows. Возвращает (metrics, top_codes);
+        среднемесячный баланс делится на длину окна. Метрики подходят для metrics_matrix и скоринга.
+        """
+        rows = slice(None) if rows is None else np.asarray(rows, dtype=np.int64)
+        months = max(min(months, self.layout.n_months), 1)
+        sums = window_sums(self.layout, months, self.month_cat_sum[rows], self.month_cat_cnt[rows],
+                           self.month_flow_sum[rows], self.month_flow_cnt[rows])
+        metrics = derive_metrics(self.layout, *sums, months=months)
+        window = slice(self.layout.n_months - months, self.layout.n_months)
+        metrics.update(derive_window_metrics(self.layout, self.month_cat_sum[rows][:, window],
+                                             self.month_flow_cnt[rows][:, window]))
+        return metrics, top_category_codes(self.layout, sums[0], sums[1])
+
+    def matrix(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Матрица метрик (клиенты x scoring.FEATURES) в порядке client_codes или только для строк rows"""
+        if rows is None:
+            return metrics_matrix(self.layout, self.metrics, self.top_codes)
+        rows = np.asarray(rows, dtype=np.int64)
+        metrics = {name: values[rows] for name, values in self.metrics.items()}
+        return metrics_matrix(self.layout, metrics, self.top_codes[rows])
+
+    def client_info_at(self, row: int) -> Dict:
+        """Результат analyze_client для клиента в строке row"""
+        return {
+            'client_code': int(self.client_codes[row]),
+            'name': self.profile_column('name')[row],
+            'status': self.profile_column('status')[row],
+            'city': self.profile_column('city')[row],
+            'metrics': metrics_dict(self.layout, self.metrics, self.top_codes, row),
+        }
+
+    def client_info(self, client_code: int) -> Optional[Dict]:
+        row = self.position(client_code)
+        return None if row is None else self.client_info_at(row)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Широкая таблица: профиль, метрики и топ категорий, индекс — client_code"""
+        rows = self.rows()
+        frame = self.profile.iloc[rows].reset_index(drop=True)
+        for name, values in self.metrics.items():
+            frame[name] = values[rows]
+        frame['top_categories'] = [
+            [self.layout.categories[c] for c in codes if c >= 0] for codes in self.top_codes[rows]
+        ]
+        frame.index = pd.Index(self.client_codes[rows], name='client_code')
+        return frame
+
+
+def build_features(transactions_df: pd.DataFrame, transfers_df: pd.DataFrame,
+                   layout: Optional[FeatureLayout] = None) -> ClientFeatures:
+    """
+    Таблица признаков всех клиентов за один проход по каждой таблице.
+    layout передаётся, если коды категорий в таблицах уже соответствуют его словарям.
+    """
+    category, categories = category_codes(transactions_df['category'])
+    types, transfer_types = category_codes(transfers_df['type'])
+    directions, direction_names = category_codes(transfers_df['direction'])
+
+    tx_clients = transactions_df['client_code'].to_numpy(dtype=np.int64)
+    tr_clients = transfers_df['client_code'].to_numpy(dtype=np.int64)
+    client_codes = np.union1d(tx_clients, tr_clients)
+
+    tx_months = month_ordinals(transactions_df['date'])
+    tr_months = month_ordinals(transfers_df['date'])
+    if layout is None:
+        layout = FeatureLayout(categories, transfer_types, direction_names, month_range(tx_months, tr_months))
+
+    sums = aggregate(layout, client_codes,
+                     tx_clients, category, transactions_df[AMOUNT_COLUMN].to_numpy(dtype=np.float64),
+                     layout.month_codes(tx_months),
+                     tr_clients, layout.flow_codes(types, directions),
+                     transfers_df[AMOUNT_COLUMN].to_numpy(dtype=np.float64), layout.month_codes(tr_months))
+
+    # Профиль — из первой транзакции клиента, для клиентов только с переводами — из первого перевода
+    profile = pd.concat([transactions_df[['client_code'] + PROFILE_COLUMNS],
+                         transfers_df[['client_code'] + PROFILE_COLUMNS]], ignore_index=True)
+    profile = profile.drop_duplicates('client_code').set_index('client_code').loc[client_codes]
+    return ClientFeatures(layout, client_codes, profile, *sums)
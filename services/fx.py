@@ -0,0 +1,114 @@
+"""
+Приведение сумм к тенге по датированной таблице курсов.
+
+Таблица курсов — CSV рядом с данными (data/fx_rates.csv):
+
+    date,currency,rate
+    2025-06-02,EUR,583.10       # сколько тенге за 1 единицу валюты, действует с date
+
+Для строки берётся последний курс её валюты на дату операции или раньше (as-of);
+операции до первого курса валюты считаются по первому курсу. Пересчёт векторный:
+по одному searchsorted на валюту для всей таблицы. Результат хранится колонкой
+amount_kzt (в хранилище — как обычная колонка), поэтому запросы ничего не пересчитывают.
+"""
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+BASE_CURRENCY = 'KZT'
+AMOUNT_COLUMN = 'amount_kzt'
+FX_RATES_FILE = 'fx_rates.csv'
+
+
+class FxTable:
+    def __init__(self, rates: Dict[str, pd.DataFrame]):
+        """rates — currency -> DataFrame(date, rate), курсы в тенге за единицу"""
+        self._dates: Dict[str, np.ndarray] = {}
+        self._rates: Dict[str, np.ndarray] = {}
+        for currency, table in rates.items():
+            table = table.sort_values('date', kind='mergesort')
+            self._dates[currency] = pd.to_datetime(table['date']).to_numpy(dtype='datetime64[ns]').view(np.int64)
+            self._rates[currency] = table['rate'].to_numpy(dtype=np.float64)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'FxTable':
+        return cls({currency: group[['date', 'rate']] for currency, group in df.groupby('currency', sort=True)})
+
+    @classmethod
+    def load(cls, path: str) -> 'FxTable':
+        """Таблица из CSV; если файла нет — пустая (допустимы только суммы в тенге)"""
+        if not os.path.exists(path):
+            return cls({})
+        return cls.from_frame(pd.read_csv(path))
+
+    @classmethod
+    def from_records(cls, records: List[List]) -> 'FxTable':
+        """Из списка [date, currency, rate] (формат meta.json хранилища)"""
+        return cls.from_frame(pd.DataFrame(records, columns=['date', 'currency', 'rate']))
+
+    def to_records(self) -> List[List]:
+        records = []
+        for currency in sorted(self._dates):
+            dates = pd.to_datetime(self._dates[currency]).strftime('%Y-%m-%d')
+            records.extend([date, currency, float(rate)] for date, rate in zip(dates, self._rates[currency]))
+        return records
+
+    @property
+    def currencies(self) -> List[str]:
+        return [BASE_CURRENCY] + sorted(self._dates)
+
+    def rates_for(self, currency: str, dates: np.ndarray) -> np.ndarray:
+        """Курсы валюты на даты (int64 ns) — последний курс на дату или раньше"""
+        if currency == BASE_CURRENCY:
+            return np.ones(len(dates))
+        if currency not in self._dates:
+            raise ValueError(f"No FX rate for {currency} (known: {', '.join(self.currencies)})")
+        pos = np.searchsorted(self._dates[currency], dates, side='right') - 1
+        return self._rates[currency][np.maximum(pos, 0)]
+
+    def convert(self, amounts: np.ndarray, currencies: pd.Series, dates: pd.Series) -> np.ndarray:
+        """Суммы в тенге. currencies — колонка валют (строки или категории), dates — даты операций"""
+        amounts = np.asarray(amounts, dtype=np.float64)
+        if isinstance(currencies.dtype, pd.CategoricalDtype):
+            codes, names = currencies.cat.codes.to_numpy(), list(currencies.cat.categories)
+        else:
+            codes, names = pd.factorize(currencies.astype(str))
+        if len(names) == 1 and names[0] == BASE_CURRENCY:
+            return amounts.copy()
+
+        dates = pd.to_datetime(dates).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        result = amounts.copy()
+        for code, currency in enumerate(names):
+            if currency == BASE_CURRENCY:
+                continue
+            rows = np.flatnonzero(codes == code)
+            if len(rows):
+                result[rows] = amounts[rows] * self.rates_for(currency, dates[rows])
+        return result
+
+
+def normalize_amounts(df: pd.DataFrame, fx: FxTable) -> pd.DataFrame:
+    """Добавить колонку amount_kzt (один проход по всей таблице); таблица без currency — уже в тенге"""
+    if 'currency' not in df.columns:
+        df[AMOUNT_COLUMN] = df['amount'].to_numpy(dtype=np.float64)
+    else:
+        df[AMOUNT_COLUMN] = fx.convert(df['amount'].to_numpy(), df['currency'], df['date'])
+    return df
+
+
+_tables: Dict[str, FxTable] = {}
+_tables_lock = threading.Lock()
+
+
+def fx_table_for(data_dir: str, path: Optional[str] = None) -> FxTable:
+    """Таблица курсов набора данных (data_dir/fx_rates.csv или явный path), кэшируется по пути и mtime"""
+    path = os.path.abspath(path or os.path.join(data_dir, FX_RATES_FILE))
+    key = f"{path}:{os.stat(path).st_mtime_ns if os.path.exists(path) else 0}"
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is None:
+            table = _tables[key] = FxTable.load(path)
+        return table
@@ -0,0 +1,93 @@
+"""
+Инкрементальная загрузка новых транзакций и переводов (например, дневной дельты).
+
+Новые строки дописываются к данным анализатора, а суммы и счётчики таблицы признаков
+обновляются только по ним (см. ClientAnalyzer.append / expire) — без перечитывания CSV.
+Скользящее окно: строки старше window_days от последней даты удаляются так же инкрементально.
+
+Дописать дельту в хранилище на диске (новым поколением, которое подхватят воркеры):
+    python -m services.ingest --transactions delta_tx.csv --transfers delta_tr.csv --window-days 92
+"""
+import argparse
+import hashlib
+import os
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from services import config
+from services.analytics import ClientAnalyzer
+from services.loader import DERIVED_DIR
+from services.store import read_meta, store_lock, write_store
+
+
+def read_delta(path: Optional[str]) -> Optional[pd.DataFrame]:
+    """CSV дельты в схеме data/client_*_{transactions,transfers}_3m.csv"""
+    if not path:
+        return None
+    return pd.read_csv(path)
+
+
+def apply_delta(analyzer: ClientAnalyzer, transactions_df: Optional[pd.DataFrame] = None,
+                transfers_df: Optional[pd.DataFrame] = None, window_days: Optional[int] = None) -> np.ndarray:
+    """Дописать дельту и, если задано окно, удалить устаревшие строки. Возвращает затронутые client_code"""
+    affected = analyzer.append(transactions_df, transfers_df)
+    if window_days:
+        latest = analyzer.latest_date()
+        if latest is not None:
+            expired = analyzer.expire(latest - pd.Timedelta(days=window_days))
+            affected = np.union1d(affected, expired)
+    return affected
+
+
+def _delta_fingerprint(paths) -> str:
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def append_store(store_dir: str, transactions_path: Optional[str] = None, transfers_path: Optional[str] = None,
+                 window_days: Optional[int] = None) -> Dict:
+    """
+    Дописать дельту в хранилище на диске: пишется новое поколение. Производные массивы поколения —
+    состояние анализатора после инкрементального обновления (save_derived), а не пересчёт по всем строкам
+    """
+    with store_lock(store_dir):
+        meta = read_meta(store_dir)
+        analyzer = ClientAnalyzer.from_store(store_dir)
+        affected = apply_delta(analyzer, read_delta(transactions_path), read_delta(transfers_path), window_days)
+
+        paths = [path for path in (transactions_path, transfers_path) if path]
+        version = hashlib.sha1(f"{meta['version']}:{_delta_fingerprint(paths)}".encode()).hexdigest()[:16]
+        tables = {'transactions': analyzer.transactions_df, 'transfers': analyzer.transfers_df}
+        new_meta = write_store(tables, store_dir, source=meta.get('source', meta['version']), version=version,
+                               derive=lambda generation_dir: {
+                                   'derived': analyzer.save_derived(os.path.join(generation_dir, DERIVED_DIR))},
+                               deltas=meta.get('deltas', []) + [os.path.basename(path) for path in paths],
+                               fx_rates=analyzer.fx.to_records())
+    new_meta['affected_clients'] = len(affected)
+    return new_meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Инкрементальная загрузка дельты в колоночное хранилище")
+    parser.add_argument('--store-dir', default=config.STORE_DIR)
+    parser.add_argument('--transactions', help="CSV с новыми транзакциями")
+    parser.add_argument('--transfers', help="CSV с новыми переводами")
+    parser.add_argument('--window-days', type=int, default=config.DATA_WINDOW_DAYS,
+                        help="удалить строки старше N дней от последней даты (0 — не удалять)")
+    args = parser.parse_args()
+    if not args.transactions and not args.transfers:
+        parser.error("нужен --transactions и/или --transfers")
+
+    meta = append_store(args.store_dir, args.transactions, args.transfers, args.window_days)
+    rows = ", ".join(f"{name}: {info['rows']}" for name, info in meta['tables'].items())
+    print(f"Store {args.store_dir} updated to version {meta['version']} "
+          f"({meta['affected_clients']} clients affected; {rows})")
+
+
+if __name__ == "__main__":
+    main()
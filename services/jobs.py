@@ -0,0 +1,120 @@
+"""
+Фоновые задания диагностики большого числа клиентов.
+
+Задание режет список client_code на блоки и обрабатывает их по одному через
+AnalyticsPool, накапливая результаты. Клиент опрашивает прогресс и забирает
+результаты постранично, вместо одного огромного HTTP-ответа.
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.concurrency import AnalyticsPool
+
+# Обработчик блока: client_codes -> (results, errors)
+ChunkHandler = Callable[[List[int]], Tuple[List[Dict], List[Dict]]]
+
+
+def chunked(items: List[Any], size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Job:
+    def __init__(self, client_codes: List[int], chunk_size: int):
+        self.id = uuid.uuid4().hex
+        self.client_codes = client_codes
+        self.chunk_size = chunk_size
+        self.status = "pending"
+        self.processed = 0
+        self.results: List[Dict] = []
+        self.errors: List[Dict] = []
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def total(self) -> int:
+        return len(self.client_codes)
+
+    def progress(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "progress": self.processed / self.total if self.total else 1.0,
+            "results_count": len(self.results),
+            "errors_count": len(self.errors),
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    def page(self, offset: int, limit: int,
+             errors_offset: int = 0, errors_limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Страница результатов [offset, offset + limit) и страница ошибок со своим курсором
+        [errors_offset, errors_offset + errors_limit): ошибок обычно намного меньше, чем результатов,
+        и общий offset пропускал бы их. errors_limit по умолчанию — limit.
+        """
+        errors_limit = limit if errors_limit is None else errors_limit
+        return {
+            **self.progress(),
+            "offset": offset,
+            "limit": limit,
+            "results": self.results[offset:offset + limit],
+            "errors_offset": errors_offset,
+            "errors_limit": errors_limit,
+            "errors": self.errors[errors_offset:errors_offset + errors_limit],
+        }
+
+
+class JobManager:
+    """Хранит последние max_jobs заданий; более старые завершённые вытесняются"""
+
+    def __init__(self, pool: AnalyticsPool, chunk_size: int, max_jobs: int):
+        self.pool = pool
+        self.chunk_size = chunk_size
+        self.max_jobs = max_jobs
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    def submit(self, client_codes: List[int], handler: ChunkHandler) -> Job:
+        job = Job(list(client_codes), self.chunk_size)
+        self.jobs[job.id] = job
+        self._evict()
+        job.task = asyncio.create_task(self._run(job, handler))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def _run(self, job: Job, handler: ChunkHandler):
+        job.status = "running"
+        try:
+            for chunk in chunked(job.client_codes, job.chunk_size):
+                results, errors = await self.pool.run(handler, chunk)
+                job.results.extend(results)
+                job.errors.extend(errors)
+                job.processed += len(chunk)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def _evict(self):
+        while len(self.jobs) > self.max_jobs:
+            for job_id, job in self.jobs.items():
+                if job.finished_at is not None:
+                    del self.jobs[job_id]
+                    break
+            else:
+                break
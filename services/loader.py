@@ -0,0 +1,59 @@
+"""
+Загрузчик данных для развёртывания с несколькими воркерами (uvicorn --workers N).
+
+Поколение хранилища собирается один раз, одним процессом: колонки (services/store.py)
+и производные массивы — индексы клиентов, коды месяцев и переводов по строкам, таблица
+признаков с календарным кубом. Воркеры открывают всё это через mmap только для чтения:
+страницы данных в памяти узла общие, а старт воркера — открытие файлов, без расчётов.
+Новое поколение публикуется атомарной заменой CURRENT; воркеры с STORE_POLL_SECONDS > 0
+переключаются на него сами, старое поколение освобождается, когда его закроет последний.
+
+    python -m services.loader --data-dir data --store-dir store        # собрать, если данные изменились
+    python -m services.loader --force                                  # собрать новое поколение в любом случае
+    STORE_AUTO_BUILD=0 STORE_POLL_SECONDS=5 uvicorn main:app --workers 8
+"""
+import argparse
+import os
+import time
+from typing import Dict
+
+from services import config
+from services.analytics import ClientAnalyzer
+from services.store import build_store, ensure_store, store_lock
+
+DERIVED_DIR = 'derived'
+
+
+def derive_generation(generation_dir: str) -> Dict:
+    """Производные массивы поколения (вызывается write_store до публикации); возвращает дополнение meta"""
+    analyzer = ClientAnalyzer.from_store(generation_dir)
+    return {'derived': analyzer.save_derived(os.path.join(generation_dir, DERIVED_DIR))}
+
+
+def load_generation(data_dir: str = config.DATA_DIR, store_dir: str = config.STORE_DIR,
+                    force: bool = False) -> bool:
+    """Собрать поколение, если данные изменились (или force). Возвращает True, если собрано новое"""
+    if not force:
+        return ensure_store(data_dir, store_dir, rebuild=True, derive=derive_generation)
+    with store_lock(store_dir):
+        build_store(data_dir, store_dir, derive=derive_generation)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка поколения хранилища с производными массивами для воркеров")
+    parser.add_argument('--data-dir', default=config.DATA_DIR)
+    parser.add_argument('--store-dir', default=config.STORE_DIR)
+    parser.add_argument('--force', action='store_true', help="собрать, даже если данные не менялись")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    built = load_generation(args.data_dir, args.store_dir, args.force)
+    analyzer = ClientAnalyzer.from_store(args.store_dir)
+    state = "built" if built else "up to date"
+    print(f"Store {args.store_dir} {state} in {time.perf_counter() - started:.2f}s "
+          f"(generation {analyzer.generation}, {len(analyzer.transactions_index)} clients)")
+
+
+if __name__ == "__main__":
+    main()
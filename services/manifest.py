@@ -0,0 +1,132 @@
+"""
+Манифест данных для ленивой загрузки: client_code -> шард (пара CSV-файлов).
+
+Собирается чтением только профильных колонок (client_code, name, product, status, city)
+из файлов транзакций — без сумм, дат и переводов, — и сохраняется в JSON рядом с данными.
+По манифесту отдаётся справочник клиентов и находится шард клиента; сам анализатор шарда
+загружается по первому запросу (services/analyzer_pool.py).
+
+Сборка:  python -m services.manifest --data-dir data --manifest manifest.json
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from services import config
+from services.directory import DIRECTORY_COLUMNS
+from services.store import data_fingerprint
+
+MANIFEST_FORMAT = 1
+
+
+def file_pairs(data_dir: str) -> List[Tuple[str, str]]:
+    """Пары (транзакции, переводы) в порядке номера файла; файлы без пары пропускаются"""
+    pairs = []
+    for transactions_file in glob.glob(os.path.join(data_dir, "client_*_transactions_3m.csv")):
+        number = os.path.basename(transactions_file)[len("client_"):-len("_transactions_3m.csv")]
+        transfers_file = os.path.join(data_dir, f"client_{number}_transfers_3m.csv")
+        if number.isdigit() and os.path.exists(transfers_file):
+            pairs.append((int(number), transactions_file, transfers_file))
+    return [(transactions_file, transfers_file) for _, transactions_file, transfers_file in sorted(pairs)]
+
+
+def shard_version(transactions_path: str, transfers_path: str) -> str:
+    """Версия данных шарда — так же, как у ClientAnalyzer(transactions_path, transfers_path)"""
+    return ":".join(f"{os.path.getsize(path)}-{os.stat(path).st_mtime_ns}"
+                    for path in (transactions_path, transfers_path))
+
+
+def build_manifest(data_dir: str = config.DATA_DIR, path: str = config.MANIFEST_PATH) -> Dict:
+    started = time.perf_counter()
+    shards = []
+    clients = []
+    for shard, (transactions_path, transfers_path) in enumerate(file_pairs(data_dir)):
+        profiles = pd.read_csv(transactions_path, usecols=['client_code'] + DIRECTORY_COLUMNS)
+        profiles = profiles.drop_duplicates('client_code')
+        shards.append({
+            'transactions': os.path.abspath(transactions_path),
+            'transfers': os.path.abspath(transfers_path),
+            'version': shard_version(transactions_path, transfers_path),
+            'clients': int(len(profiles)),
+        })
+        for record in profiles.to_dict('records'):
+            record['client_code'] = int(record['client_code'])
+            record['shard'] = shard
+            clients.append(record)
+
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'source': data_fingerprint(data_dir),
+        'built_at': time.time(),
+        'shards': shards,
+        'clients': clients,
+    }
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    manifest['build_seconds'] = time.perf_counter() - started
+    return manifest
+
+
+class Manifest:
+    def __init__(self, manifest: Dict):
+        self.source = manifest['source']
+        self.shards: List[Dict] = manifest['shards']
+        self.clients = pd.DataFrame(manifest['clients'],
+                                    columns=['client_code'] + DIRECTORY_COLUMNS + ['shard'])
+        # Клиент, встречающийся в нескольких шардах, закрепляется за первым
+        first = self.clients.drop_duplicates('client_code').sort_values('client_code')
+        self.client_codes = first['client_code'].to_numpy(dtype=np.int64)
+        self._shard = first['shard'].to_numpy(dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.client_codes)
+
+    def shard_of(self, client_code: int) -> Optional[int]:
+        i = int(np.searchsorted(self.client_codes, client_code))
+        if i < len(self.client_codes) and self.client_codes[i] == client_code:
+            return int(self._shard[i])
+        return None
+
+    def version_of(self, client_code: int) -> Optional[str]:
+        shard = self.shard_of(client_code)
+        return None if shard is None else self.shards[shard]['version']
+
+
+def load_manifest(data_dir: str = config.DATA_DIR, path: str = config.MANIFEST_PATH,
+                  rebuild: bool = False) -> Tuple[Manifest, bool]:
+    """
+    Открыть манифест, собрав его, если файла нет, формат устарел или (при rebuild)
+    исходные CSV изменились. Возвращает (manifest, пересобран ли).
+    """
+    manifest = None
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format') != MANIFEST_FORMAT or (rebuild and manifest['source'] != data_fingerprint(data_dir)):
+            manifest = None
+    if manifest is not None:
+        return Manifest(manifest), False
+    return Manifest(build_manifest(data_dir, path)), True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка манифеста client_code -> файлы данных")
+    parser.add_argument('--data-dir', default=config.DATA_DIR)
+    parser.add_argument('--manifest', default=config.MANIFEST_PATH)
+    args = parser.parse_args()
+
+    manifest = build_manifest(args.data_dir, args.manifest)
+    print(f"Manifest {args.manifest} built in {manifest['build_seconds']:.2f}s "
+          f"({len(manifest['shards'])} shards, {len(manifest['clients'])} clients)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,558 @@
+"""
+Outbox push-уведомлений: очередь между генерацией рекомендаций и доставкой.
+
+Производитель (API, CLI) кладёт уведомления в ограниченную asyncio-очередь: при заполнении
+put ждёт (backpressure), offer сразу отказывает. Повтор пары (client_code, product) в пределах
+cooldown отбрасывается. Потребитель собирает пакеты до batch_size уведомлений (или сколько
+накопилось за batch_seconds), выдерживает лимит скорости (token bucket, уведомлений в секунду)
+и отправляет пакет в приёмник одним вызовом: JSONL-файл или HTTP POST. Неудачная отправка
+повторяется с экспоненциальной паузой; после max_attempts пакет уходит в <journal>.dead.jsonl.
+
+Журнал (JSONL, дописывается) фиксирует каждое принятое уведомление и каждую доставку, поэтому
+после перезапуска недоставленные уведомления отправляются снова, а cooldown продолжает действовать.
+Записи копятся в памяти и уходят в файл группами в потоке (asyncio.to_thread), с fsync по
+config.OUTBOX_FSYNC: put возвращается, когда запись уже на диске (одновременные put делят одну
+запись), put_many — одна запись на весь набор, а потребитель дописывает журнал перед каждой
+отправкой, так что уведомление не доставляется раньше, чем попадёт в журнал. Журнал периодически
+сжимается до недоставленных записей.
+
+Ошибка обработки пакета не останавливает потребителя: она пишется в лог и в stats (failures,
+last_error), пакет возвращается в очередь и повторяется после паузы; если задача потребителя
+всё же завершилась, она перезапускается (restarts).
+
+Журнал ведёт один процесс: start берёт эксклюзивную блокировку файла <journal>.lock (flock без
+ожидания) и держит её до stop. При uvicorn --workers N с общим OUTBOX_JOURNAL outbox работает
+в воркере, который первым взял блокировку; в остальных start отказывает (JournalLocked), иначе
+каждый воркер отправлял бы недоставленное из журнала заново, а сжатие журнала (os.replace)
+затирало бы записи других воркеров.
+
+    python -m services.outbox push --store-dir store --sink jsonl --target outbox/sent.jsonl
+    python -m services.outbox push --sink http --target http://127.0.0.1:8099/push
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import urllib.request
+import uuid
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка журнала между процессами недоступна
+    fcntl = None
+
+from services import config
+
+logger = logging.getLogger(__name__)
+
+# Ключ cooldown: (client_code, product)
+Key = Tuple[int, str]
+
+
+class TokenBucket:
+    """Лимит скорости: rate токенов в секунду, не больше capacity накопленных (rate <= 0 — без лимита)"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = max(capacity if capacity is not None else rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, n: int = 1):
+        """Забрать n токенов; больше capacity — частями, по мере пополнения"""
+        if self.rate <= 0:
+            return
+        while n > 0:
+            self._refill()
+            take = min(n, self.capacity)
+            if self.tokens >= take:
+                self.tokens -= take
+                n -= take
+            else:
+                await asyncio.sleep((take - self.tokens) / self.rate)
+
+
+class JsonlSink:
+    """Приёмник-файл: пакет дописывается строками JSON"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, batch: List[Dict]):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in batch))
+
+    async def send(self, batch: List[Dict]):
+        await asyncio.to_thread(self._write, batch)
+
+
+class HttpSink:
+    """Приёмник-HTTP: пакет уходит одним POST {"notifications": [...]}; ответ не 2xx — ошибка"""
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+
+    def _post(self, batch: List[Dict]):
+        body = json.dumps({'notifications': batch}, ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    async def send(self, batch: List[Dict]):
+        await asyncio.to_thread(self._post, batch)
+
+
+def make_sink(kind: str, target: str):
+    if kind == 'jsonl':
+        return JsonlSink(target)
+    if kind == 'http':
+        return HttpSink(target)
+    raise ValueError(f"Unknown outbox sink: {kind!r} (jsonl or http)")
+
+
+class JournalLocked(Exception):
+    """Журнал outbox ведёт другой процесс"""
+
+
+class Journal:
+    """
+    Журнал outbox: строки {"op": "add" | "done" | "seen", ...}. add — принятое уведомление,
+    done — доставленное или отброшенное (по id), seen — отметка cooldown, оставленная при сжатии.
+    """
+
+    def __init__(self, path: str, fsync: bool = config.OUTBOX_FSYNC):
+        self.path = path
+        self.fsync = fsync
+        self.dead_path = os.path.splitext(path)[0] + '.dead.jsonl'
+        self.lock_path = os.path.splitext(path)[0] + '.lock'
+        self.lines = 0
+        self._lock_file = None
+
+    def acquire(self) -> bool:
+        """Взять эксклюзивную блокировку журнала без ожидания; False — её держит другой процесс"""
+        if fcntl is None or self._lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)), exist_ok=True)
+        f = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        # pid владельца — для сообщения в остальных процессах
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self._lock_file = f
+        return True
+
+    def owner(self) -> str:
+        """pid процесса, который держит (или держал последним) блокировку"""
+        try:
+            with open(self.lock_path) as f:
+                return f.read().strip()
+        except OSError:
+            return ''
+
+    def release(self):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def replay(self) -> Tuple[List[Dict], Dict[Key, float]]:
+        """Недоставленные уведомления (в порядке приёма) и время последнего приёма по ключам cooldown"""
+        pending: Dict[str, Dict] = {}
+        seen: Dict[Key, float] = {}
+        if not os.path.exists(self.path):
+            return [], seen
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # строка, недописанная при аварийной остановке
+                self.lines += 1
+                if record['op'] == 'done':
+                    pending.pop(record['id'], None)
+                    continue
+                key = (record['client_code'], record['product'])
+                seen[key] = max(seen.get(key, 0.0), record['ts'])
+                if record['op'] == 'add':
+                    pending[record['id']] = _notification(record)
+        return list(pending.values()), seen
+
+    def append(self, records: List[Dict], path: Optional[str] = None):
+        """Дописать записи одной операцией (блокирующий вызов — из event loop через asyncio.to_thread)"""
+        path = path or self.path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        if path == self.path:
+            self.lines += len(records)
+
+    def compact(self, pending: List[Dict], seen: Dict[Key, float], since: float):
+        """Переписать журнал: недоставленные уведомления и отметки cooldown не старше since"""
+        records = [dict(item, op='add') for item in pending]
+        records += [{'op': 'seen', 'client_code': client_code, 'product': product, 'ts': ts}
+                    for (client_code, product), ts in seen.items() if ts >= since]
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.lines = len(records)
+
+
+def _notification(record: Dict) -> Dict:
+    return {name: record[name] for name in ('id', 'client_code', 'product', 'message', 'ts')}
+
+
+class Outbox:
+    def __init__(self, sink, journal_path: str = config.OUTBOX_JOURNAL, max_queue: int = config.OUTBOX_MAX_QUEUE,
+                 batch_size: int = config.OUTBOX_BATCH_SIZE, batch_seconds: float = config.OUTBOX_BATCH_SECONDS,
+                 rate: float = config.OUTBOX_RATE, cooldown_seconds: float = config.OUTBOX_COOLDOWN_SECONDS,
+                 max_attempts: int = config.OUTBOX_MAX_ATTEMPTS, retry_seconds: float = config.OUTBOX_RETRY_SECONDS):
+        self.sink = sink
+        self.journal = Journal(journal_path)
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.bucket = TokenBucket(rate, max(rate, batch_size))
+        self.cooldown_seconds = cooldown_seconds
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+
+        self._queue: Optional[asyncio.Queue] = None
+        # Недоставленные из журнала — отправляются раньше очереди
+        self._backlog: Deque[Dict] = deque()
+        # Все принятые и ещё не доставленные уведомления (по id) — для drain и сжатия журнала
+        self._pending: Dict[str, Dict] = {}
+        self._seen: Dict[Key, float] = {}
+        # Записи журнала, ещё не записанные в файл (пишутся группой в _sync)
+        self._unsynced: List[Dict] = []
+        self._journal_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.accepted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.sent = 0
+        self.dead = 0
+        self.batches = 0
+        self.retries = 0
+        self.failures = 0
+        self.restarts = 0
+        self.last_error: Optional[str] = None
+
+    async def start(self):
+        """
+        Взять блокировку журнала, поднять недоставленное из него и запустить потребителя (в работающем
+        event loop). JournalLocked — журнал ведёт другой процесс
+        """
+        if self._task is not None:
+            return
+        if not await asyncio.to_thread(self.journal.acquire):
+            raise JournalLocked(f"журнал {self.journal.path} ведёт другой процесс (pid {self.journal.owner()})")
+        try:
+            pending, self._seen = await asyncio.to_thread(self.journal.replay)
+        except BaseException:
+            self.journal.release()
+            raise
+        self._backlog.extend(pending)
+        self._pending.update((item['id'], item) for item in pending)
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._journal_lock = asyncio.Lock()
+        self._spawn()
+
+    def _spawn(self):
+        self._task = asyncio.create_task(self._run(), name='outbox')
+        self._task.add_done_callback(self._on_exit)
+
+    def _on_exit(self, task: asyncio.Task):
+        # Потребитель завершается только отменой (stop); любое другое завершение — сбой, перезапуск
+        if task.cancelled() or task is not self._task:
+            return
+        error = task.exception()
+        self.restarts += 1
+        self.last_error = f"{type(error).__name__}: {error}" if error else "consumer exited"
+        logger.error("Outbox consumer stopped, restarting in %.1fs", self.retry_seconds, exc_info=error)
+        self._task = asyncio.get_running_loop().create_task(self._restart())
+
+    async def _restart(self):
+        # Пауза — чтобы постоянный сбой не перезапускал потребителя в цикле без остановки
+        await asyncio.sleep(self.retry_seconds)
+        self._spawn()
+
+    def _reserve(self, client_code: int, product: str, message: str) -> Optional[Dict]:
+        """Уведомление, если пара (client_code, product) вне cooldown (и отметка cooldown); None — дубликат"""
+        now = time.time()
+        key = (int(client_code), product)
+        if now - self._seen.get(key, float('-inf')) < self.cooldown_seconds:
+            self.deduplicated += 1
+            return None
+        self._seen[key] = now
+        return {'id': uuid.uuid4().hex, 'client_code': int(client_code), 'product': product, 'message': message,
+                'ts': now}
+
+    def _commit(self, item: Dict):
+        # Вызывается сразу после постановки в очередь, без await между ними: запись add оказывается
+        # в буфере журнала раньше, чем потребитель заберёт уведомление (и допишет буфер перед отправкой)
+        self._unsynced.append(dict(item, op='add'))
+        self._pending[item['id']] = item
+        self.accepted += 1
+
+    async def _sync(self):
+        """
+        Записать накопленные записи журнала одной операцией в потоке. Пока идёт запись, новые
+        записи копятся и уходят следующей группой; ждущие put находят свои записи уже записанными.
+        """
+        async with self._journal_lock:
+            if not self._unsynced:
+                return
+            records, self._unsynced = self._unsynced, []
+            try:
+                await asyncio.to_thread(self.journal.append, records)
+            except BaseException:
+                self._unsynced[:0] = records
+                raise
+
+    async def _enqueue(self, client_code: int, product: str, message: str) -> bool:
+        item = self._reserve(client_code, product, message)
+        if item is None:
+            return False
+        try:
+            await self._queue.put(item)
+        except asyncio.CancelledError:
+            # Ожидание места прервано — уведомление не принято, cooldown не действует
+            self._seen.pop((item['client_code'], product), None)
+            raise
+        self._commit(item)
+        return True
+
+    async def put(self, client_code: int, product: str, message: str) -> bool:
+        """
+        Поставить уведомление в очередь; если очередь полна — ждать места. True — принято и записано
+        в журнал, False — дубликат в пределах cooldown
+        """
+        if not await self._enqueue(client_code, product, message):
+            return False
+        await self._sync()
+        return True
+
+    async def put_many(self, notifications: Iterable[Tuple[int, str, str]]) -> Tuple[int, int]:
+        """
+        Поставить набор (client_code, product, message) с одной записью журнала в конце (и теми,
+        что потребитель сделает по пути): (принято, дубликатов)
+        """
+        queued = duplicates = 0
+        for client_code, product, message in notifications:
+            if await self._enqueue(client_code, product, message):
+                queued += 1
+            else:
+                duplicates += 1
+        await self._sync()
+        return queued, duplicates
+
+    def offer(self, client_code: int, product: str, message: str) -> Optional[bool]:
+        """
+        Без ожидания: True — принято, False — дубликат, None — очередь полна. Запись журнала
+        уходит в файл со следующей группой (не позже отправки уведомления)
+        """
+        if self._queue.full():
+            self.rejected += 1
+            return None
+        item = self._reserve(client_code, product, message)
+        if item is None:
+            return False
+        self._queue.put_nowait(item)
+        self._commit(item)
+        return True
+
+    async def _next_batch(self) -> List[Dict]:
+        batch = [self._backlog.popleft() for _ in range(min(self.batch_size, len(self._backlog)))]
+        if not batch:
+            batch.append(await self._queue.get())
+        deadline = time.monotonic() + self.batch_seconds
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._deliver(batch)
+            except Exception as e:
+                # Например, журнал не записался: недоставленное из пакета возвращается в начало
+                # очереди и повторяется после паузы
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.exception("Outbox failed to process a batch of %d notifications", len(batch))
+                self._backlog.extendleft(reversed([item for item in batch if item['id'] in self._pending]))
+                await asyncio.sleep(self.retry_seconds)
+
+    async def _deliver(self, batch: List[Dict]):
+        """
+        Отправить пакет с повторами (пауза retry_seconds * 2^попытка). Остановка посреди отправки
+        оставляет пакет недоставленным в журнале — после перезапуска он уйдёт снова.
+        """
+        # Записи add пакета (и всё накопленное) — в журнал до отправки
+        await self._sync()
+        await self.bucket.acquire(len(batch))
+        payload = [{name: item[name] for name in ('id', 'client_code', 'product', 'message')} for item in batch]
+        for attempt in range(self.max_attempts):
+            try:
+                await self.sink.send(payload)
+                self.sent += len(batch)
+                break
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                if attempt + 1 < self.max_attempts:
+                    self.retries += 1
+                    await asyncio.sleep(self.retry_seconds * 2 ** attempt)
+        else:
+            await asyncio.to_thread(self.journal.append, batch, self.journal.dead_path)
+            self.dead += len(batch)
+        # Пакет снимается с недоставленных до записи done: если она не удастся, записи останутся
+        # в буфере до следующей группы, а пакет не уйдёт повторно
+        for item in batch:
+            self._pending.pop(item['id'], None)
+        self._unsynced += [{'op': 'done', 'id': item['id']} for item in batch]
+        self.batches += 1
+        await self._sync()
+        await self._maybe_compact()
+
+    async def _maybe_compact(self):
+        if self.journal.lines <= max(config.OUTBOX_COMPACT_LINES, 4 * (len(self._pending) + len(self._seen))):
+            return
+        async with self._journal_lock:
+            # Снимок недоставленных и cooldown покрывает все записи буфера — они не нужны
+            since = time.time() - self.cooldown_seconds
+            self._seen = {key: ts for key, ts in self._seen.items() if ts >= since}
+            records, self._unsynced = self._unsynced, []
+            try:
+                await asyncio.to_thread(self.journal.compact, list(self._pending.values()), dict(self._seen), since)
+            except BaseException:
+                self._unsynced[:0] = records
+                raise
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def drain(self, poll: float = 0.05):
+        """Дождаться, пока всё принятое будет доставлено (или уйдёт в dead letter)"""
+        while self._pending:
+            await asyncio.sleep(poll)
+
+    async def stop(self, drain: bool = False):
+        if self._task is None:
+            return
+        if drain:
+            await self.drain()
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        # Принятое через offer и не успевшее в журнал
+        try:
+            await self._sync()
+        finally:
+            self.journal.release()
+
+    def stats(self) -> Dict:
+        return {
+            'running': self._task is not None and not self._task.done(),
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'pending': len(self._pending),
+            'max_queue': self.max_queue,
+            'accepted': self.accepted,
+            'deduplicated': self.deduplicated,
+            'rejected': self.rejected,
+            'sent': self.sent,
+            'dead': self.dead,
+            'batches': self.batches,
+            'retries': self.retries,
+            'failures': self.failures,
+            'restarts': self.restarts,
+            'last_error': self.last_error,
+        }
+
+
+async def push_store(outbox: Outbox, store_dir: str, locale: Optional[str] = None) -> Tuple[int, int]:
+    """Поставить в outbox уведомление о лучшем продукте каждого клиента хранилища: (принято, дубликатов)"""
+    from services.analytics import ClientAnalyzer
+
+    analyzer = await asyncio.to_thread(ClientAnalyzer.from_store, store_dir)
+    rows = await asyncio.to_thread(lambda: list(analyzer.recommend(top_k=1, locale=locale)))
+    return await outbox.put_many((client_code, products[0][0], products[0][3])
+                                 for client_code, client_info, products in rows if client_info is not None and products)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Outbox push-уведомлений")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    push = commands.add_parser('push', help="уведомления о лучшем продукте всех клиентов хранилища")
+    push.add_argument('--store-dir', default=config.STORE_DIR)
+    push.add_argument('--sink', choices=['jsonl', 'http'], default=config.OUTBOX_SINK or 'jsonl')
+    push.add_argument('--target', help="файл (jsonl) или URL (http); по умолчанию OUTBOX_PATH / OUTBOX_URL")
+    push.add_argument('--journal', default=config.OUTBOX_JOURNAL)
+    push.add_argument('--rate', type=float, default=config.OUTBOX_RATE, help="уведомлений в секунду (0 — без лимита)")
+    push.add_argument('--locale', default=None)
+    args = parser.parse_args()
+
+    target = args.target or (config.OUTBOX_URL if args.sink == 'http' else config.OUTBOX_PATH)
+    if not target:
+        parser.error("нужен --target или OUTBOX_URL")
+
+    async def run():
+        outbox = Outbox(make_sink(args.sink, target), args.journal, rate=args.rate)
+        await outbox.start()
+        try:
+            queued, duplicates = await push_store(outbox, args.store_dir, args.locale)
+            await outbox.drain()
+        finally:
+            await outbox.stop()
+        return queued, duplicates, outbox.stats()
+
+    try:
+        queued, duplicates, stats = asyncio.run(run())
+    except JournalLocked as e:
+        # Например, тот же журнал ведёт запущенный API (OUTBOX_JOURNAL) — нужен другой --journal
+        parser.exit(1, f"{e}\n")
+    print(f"Queued {queued} notifications ({duplicates} within cooldown); "
+          f"sent {stats['sent']} in {stats['batches']} batches, dead {stats['dead']}, retries {stats['retries']}")
+
+
+if __name__ == "__main__":
+    main()
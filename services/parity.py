@@ -0,0 +1,87 @@
+"""
+Проверка паритета стратегий движка рекомендаций (ClientAnalyzer.recommend).
+
+Для каждого клиента сравнивает онлайн-путь (срез данных клиента, скалярный скоринг — как в
+/api/diagnose) и офлайн-путь (таблица признаков и пакетный скоринг — как в /api/diagnose_all
+и csv_generator.py): метрики, продукты, порядок, уведомления, выгода и уверенность должны совпадать.
+
+    python -m services.parity                    # колоночное хранилище config.STORE_DIR (онлайн-путь
+                                                 # считается заново, офлайн — по сохранённой таблице признаков)
+    python -m services.parity --data-dir data    # пары CSV, анализатор на каждую пару
+"""
+import argparse
+import math
+import sys
+from typing import Dict, List, Optional
+
+from services import config
+from services.analytics import OFFLINE, ONLINE, ClientAnalyzer
+from services.manifest import file_pairs
+
+
+def _same_metrics(expected: Dict, actual: Dict, tolerance: float) -> bool:
+    if expected.keys() != actual.keys():
+        return False
+    return all(
+        math.isclose(value, actual[name], rel_tol=tolerance, abs_tol=tolerance)
+        if isinstance(value, float) else value == actual[name]
+        for name, value in expected.items())
+
+
+def compare(analyzer: ClientAnalyzer, top_k: int = 3, tolerance: float = 1e-9,
+            offline_analyzer: Optional[ClientAnalyzer] = None) -> List[Dict]:
+    """
+    Расхождения онлайн- и офлайн-стратегий по всем клиентам анализатора (пустой список — паритет).
+    offline_analyzer — другой анализатор тех же данных для офлайн-пути (например, с таблицей
+    признаков из поколения хранилища); по умолчанию — тот же.
+    """
+    client_codes = analyzer.transactions_index.codes.tolist()
+    # Онлайн-путь считается первым: пока таблица признаков не собрана, analyze_client идёт по срезу
+    online = {code: (info, products)
+              for code, info, products in analyzer.recommend(client_codes, top_k, mode=ONLINE)}
+    offline_analyzer = offline_analyzer or analyzer
+    offline = {code: (info, products)
+               for code, info, products in offline_analyzer.recommend(client_codes, top_k, mode=OFFLINE)}
+
+    mismatches = []
+    for client_code in client_codes:
+        (expected_info, expected), (actual_info, actual) = online[client_code], offline[client_code]
+        same = _same_metrics(expected_info['metrics'], actual_info['metrics'], tolerance)
+        same = same and len(expected) == len(actual) and all(
+            e[0] == a[0] and e[3] == a[3]
+            and math.isclose(e[1], a[1], rel_tol=tolerance, abs_tol=tolerance)
+            and math.isclose(e[2], a[2], rel_tol=tolerance, abs_tol=tolerance)
+            for e, a in zip(expected, actual))
+        if not same:
+            mismatches.append({'client_code': client_code, 'online': expected, 'offline': actual})
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Паритет онлайн- и офлайн-стратегий рекомендаций")
+    parser.add_argument('--store-dir', default=config.STORE_DIR)
+    parser.add_argument('--data-dir', help="проверять по парам CSV вместо хранилища")
+    parser.add_argument('--top-k', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.data_dir:
+        pairs = [(ClientAnalyzer(transactions, transfers), None)
+                 for transactions, transfers in file_pairs(args.data_dir)]
+    else:
+        pairs = [(ClientAnalyzer.from_store(args.store_dir, use_derived=False),
+                  ClientAnalyzer.from_store(args.store_dir))]
+
+    checked = 0
+    mismatches = []
+    for analyzer, offline_analyzer in pairs:
+        checked += len(analyzer.transactions_index)
+        mismatches.extend(compare(analyzer, args.top_k, offline_analyzer=offline_analyzer))
+
+    for mismatch in mismatches[:20]:
+        print(f"client {mismatch['client_code']}:\n  online:  {mismatch['online']}\n  offline: {mismatch['offline']}")
+    print(f"{checked} clients checked, {len(mismatches)} mismatches")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Сэмплирующий профилировщик медленных запросов (включается явно).
+
+Пока обрабатывается хотя бы один запрос, фоновый поток раз в interval снимает стеки всех
+потоков (sys._current_frames) в кольцевой буфер. Если запрос шёл дольше порога, сэмплы
+за время его выполнения сворачиваются в формат collapsed stacks ("f1;f2;f3 N") и пишутся
+в out_dir — файл можно открыть flamegraph.pl, speedscope или inferno.
+Потоки, ждущие работы (пустая очередь пула, select event loop), в сэмплы не попадают.
+"""
+import concurrent.futures.thread
+import os
+import queue
+import re
+import selectors
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, Optional
+
+# Стек, верхний кадр которого в этих модулях, — поток простаивает
+_IDLE_MODULES = (threading, queue, selectors, concurrent.futures.thread)
+_IDLE_FILES = {os.path.abspath(module.__file__) for module in _IDLE_MODULES}
+
+
+def _stack(frame) -> Optional[str]:
+    if os.path.abspath(frame.f_code.co_filename) in _IDLE_FILES:
+        return None
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self, out_dir: str, slow_ms: float = 0, interval_ms: float = 5, max_samples: int = 100000):
+        """slow_ms — порог медленного запроса, 0 — профилировщик выключен"""
+        self.out_dir = out_dir
+        self.slow_ms = slow_ms
+        self.interval = interval_ms / 1000
+        self._samples = deque(maxlen=max_samples)
+        self._active = 0
+        self._busy = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        self.dumps = 0
+        self.last_dump: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.slow_ms > 0
+
+    def configure(self, slow_ms: float, interval_ms: Optional[float] = None):
+        """Включить (slow_ms > 0) или выключить профилировщик на лету"""
+        self.slow_ms = slow_ms
+        if interval_ms:
+            self.interval = interval_ms / 1000
+        if not self.enabled:
+            self._samples.clear()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            self._busy.wait()
+            now = time.monotonic()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = _stack(frame)
+                if stack is not None:
+                    self._samples.append((now, stack))
+            time.sleep(self.interval)
+
+    def begin(self) -> Optional[float]:
+        """Начало запроса; возвращает метку для end (None, если профилировщик выключен)"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._active += 1
+            self._busy.set()
+        self._ensure_thread()
+        return time.monotonic()
+
+    def end(self, token: Optional[float], name: str, elapsed: float) -> Optional[str]:
+        """Конец запроса: для медленного — записать стеки за время его выполнения, вернуть путь"""
+        if token is None:
+            return None
+        with self._lock:
+            self._active -= 1
+            if self._active <= 0:
+                self._active = 0
+                self._busy.clear()
+        if not self.enabled or elapsed * 1000 < self.slow_ms:
+            return None
+        return self.dump(name, token, time.monotonic())
+
+    def collapsed(self, since: float, until: float) -> Dict[str, int]:
+        return dict(Counter(stack for at, stack in list(self._samples) if since <= at <= until))
+
+    def dump(self, name: str, since: float, until: float) -> Optional[str]:
+        stacks = self.collapsed(since, until)
+        if not stacks:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_')
+        path = os.path.join(self.out_dir, f"{int(time.time() * 1000)}-{slug}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+        self.dumps += 1
+        self.last_dump = path
+        return path
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "slow_ms": self.slow_ms,
+            "interval_ms": self.interval * 1000,
+            "samples": len(self._samples),
+            "dumps": self.dumps,
+            "last_dump": self.last_dump,
+        }
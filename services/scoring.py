@@ -0,0 +1,229 @@
+"""
+Пакетный расчёт продуктовых рекомендаций.
+
+Та же логика, что и ClientAnalyzer.calculate_product_scores, но для матрицы метрик
+(клиенты x признаки): выгода, уверенность и допустимость каждого продукта считаются
+операциями над массивами, топ-k выбирается через argpartition.
+Результаты совпадают со скалярным путём (тот же порядок арифметических операций
+и тот же порядок при равной выгоде — по порядку продуктов).
+"""
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+# Колонки матрицы метрик
+FEATURES = [
+    'total_spending',
+    'travel_spending',
+    'restaurant_spending',
+    'online_spending',
+    'luxury_spending',
+    'has_fx',
+    'has_gold',
+    'has_investments',
+    'atm_withdrawals',
+    'avg_monthly_balance',
+    # Оконные метрики календарного куба (services/features.py): поля шаблонов уведомлений и ответа
+    # /api/diagnose/window; правила продуктов к ним не обращаются — оконный скоринг применяет те же
+    # правила к метрикам окна (ClientFeatures.window, ClientAnalyzer.recommend_window)
+    'last_month_spending',
+    'spending_trend',
+    'salary_regularity',
+    'top_spending',
+]
+FEATURE_INDEX = {name: i for i, name in enumerate(FEATURES)}
+
+# Продукты в порядке, в котором их добавляет скалярный путь (важно для равной выгоды).
+# Сберегательный и накопительный депозиты взаимоисключающие и занимают одно место в этом порядке.
+PRODUCTS = [
+    'Карта для путешествий',
+    'Премиальная карта',
+    'Кредитная карта',
+    'Обмен валют',
+    'Депозит сберегательный',
+    'Депозит накопительный',
+    'Инвестиции',
+    'Золотые слитки',
+]
+
+DEFAULT_TOP_K = 4
+DEFAULT_CHUNK_SIZE = 262144
+
+
+class ScoringParams(NamedTuple):
+    """
+    Константы правил продуктов (значения по умолчанию — как в calculate_product_scores).
+    Поле может быть массивом формы (сценарии x 1): тогда product_scores считает все сценарии
+    сразу, см. services/simulator.py.
+    """
+    travel_rate: float = 0.04           # кешбэк карты для путешествий
+    premium_balance: float = 500000     # порог баланса премиальной карты
+    credit_threshold: float = 2000      # минимальная выгода кредитной карты
+    deposit_rate: float = 0.15          # годовая ставка депозитов
+    invest_rate: float = 0.20           # годовая доходность инвестиций
+
+
+DEFAULT_PARAMS = ScoringParams()
+
+
+class BatchScores(NamedTuple):
+    """Топ-k продуктов на клиента: индексы в PRODUCTS (-1 — пусто), выгода и уверенность"""
+    products: np.ndarray
+    benefit: np.ndarray
+    confidence: np.ndarray
+
+
+def top_categories_spending(metrics: Dict) -> float:
+    """Траты в топ-3 категориях, как их считает кредитная карта в calculate_product_scores"""
+    return sum([metrics.get(f'{cat.lower()}_spending', 0) for cat in metrics['top_categories'][:3]])
+
+
+def metrics_matrix(metrics_list: List[Dict]) -> np.ndarray:
+    """Матрица (клиенты x FEATURES) из словарей metrics, которые возвращает analyze_client"""
+    matrix = np.zeros((len(metrics_list), len(FEATURES)))
+    for i, metrics in enumerate(metrics_list):
+        row = matrix[i]
+        for j, name in enumerate(FEATURES[:-1]):
+            row[j] = metrics[name]
+        row[-1] = top_categories_spending(metrics)
+    return matrix
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    safe = np.where(denominator > 0, denominator, 1.0)
+    return numerator / safe
+
+
+def product_scores(X: np.ndarray,
+                   params: ScoringParams = DEFAULT_PARAMS) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Выгода, уверенность и допустимость всех продуктов для матрицы метрик X.
+    Возвращает три массива формы (клиенты x PRODUCTS); если поля params — массивы (сценарии x 1),
+    то (сценарии x клиенты x PRODUCTS).
+    """
+    f = FEATURE_INDEX
+    total = X[:, f['total_spending']]
+    travel = X[:, f['travel_spending']]
+    restaurant = X[:, f['restaurant_spending']]
+    online = X[:, f['online_spending']]
+    luxury = X[:, f['luxury_spending']]
+    balance = X[:, f['avg_monthly_balance']]
+    top_spending = X[:, f['top_spending']]
+    has_fx = X[:, f['has_fx']] != 0
+    has_gold = X[:, f['has_gold']] != 0
+    has_investments = X[:, f['has_investments']] != 0
+
+    shape = np.broadcast_shapes((X.shape[0],), *(np.shape(value) for value in params)) + (len(PRODUCTS),)
+    benefit = np.zeros(shape)
+    confidence = np.zeros(shape)
+    eligible = np.zeros(shape, dtype=bool)
+
+    # 1. Карта для путешествий
+    benefit[..., 0] = travel * params.travel_rate
+    confidence[..., 0] = np.minimum(95, np.where(total > 0, 50 + (_ratio(travel, total) * 100), 0))
+    eligible[..., 0] = benefit[..., 0] > 1000
+
+    # 2. Премиальная карта
+    premium = total * 0.02
+    premium += restaurant * 0.02
+    premium += luxury * 0.02
+    eligible[..., 1] = balance > params.premium_balance
+    benefit[..., 1] = np.where(eligible[..., 1], premium * 1.5, premium)
+    confidence[..., 1] = np.minimum(92, np.where(balance > 0, 60 + (balance / params.premium_balance * 30), 60))
+
+    # 3. Кредитная карта
+    credit = online * 0.10
+    credit += top_spending * 0.10
+    benefit[..., 2] = credit
+    confidence[..., 2] = np.minimum(88, np.where(total > 0, 70 + (_ratio(online, total) * 50), 70))
+    eligible[..., 2] = credit > params.credit_threshold
+
+    # 4. Обмен валют
+    benefit[..., 3] = 50000
+    confidence[..., 3] = 85
+    eligible[..., 3] = has_fx
+
+    # 5. Депозиты
+    deposit = balance * params.deposit_rate / 12 * 3
+    benefit[..., 4] = deposit * 1.2
+    confidence[..., 4] = 90
+    eligible[..., 4] = balance > 1000000
+    benefit[..., 5] = deposit
+    confidence[..., 5] = 85
+    eligible[..., 5] = (balance > 100000) & ~eligible[..., 4]
+
+    # 6. Инвестиции
+    benefit[..., 6] = balance * params.invest_rate / 12 * 3
+    confidence[..., 6] = 82
+    eligible[..., 6] = has_investments | (balance > 500000)
+
+    # 7. Золотые слитки
+    benefit[..., 7] = 100000
+    confidence[..., 7] = 95
+    eligible[..., 7] = has_gold
+
+    return benefit, confidence, eligible
+
+
+def top_k_products(benefit: np.ndarray, eligible: np.ndarray, k: int = DEFAULT_TOP_K) -> np.ndarray:
+    """
+    Индексы k лучших допустимых продуктов на клиента по убыванию выгоды
+    (при равной выгоде — в порядке PRODUCTS, как стабильная сортировка скалярного пути).
+    Недостающие места заполняются -1.
+    """
+    n, n_products = benefit.shape
+    k = min(k, n_products)
+    key = np.where(eligible, benefit, -np.inf)
+
+    if k < n_products:
+        selected = np.argpartition(-key, k - 1, axis=1)[:, :k]
+        # Если k-е значение делит место с невыбранным продуктом, argpartition мог взять
+        # не тот из равных — такие строки досортировываем стабильно
+        kth = np.take_along_axis(key, selected, axis=1).min(axis=1)
+        ties = np.isfinite(kth) & ((key >= kth[:, None]).sum(axis=1) > k)
+        if ties.any():
+            selected[ties] = np.argsort(-key[ties], axis=1, kind='stable')[:, :k]
+    else:
+        selected = np.broadcast_to(np.arange(n_products), (n, n_products)).copy()
+
+    values = np.take_along_axis(key, selected, axis=1)
+    order = np.lexsort((selected, -values), axis=1)
+    selected = np.take_along_axis(selected, order, axis=1)
+    selected[~np.take_along_axis(eligible, selected, axis=1)] = -1
+    return selected
+
+
+def score_batch(X: np.ndarray, top_k: int = DEFAULT_TOP_K, chunk_size: int = DEFAULT_CHUNK_SIZE) -> BatchScores:
+    """Топ-k продуктов для каждой строки матрицы метрик; обработка идёт блоками по chunk_size строк"""
+    X = np.asarray(X, dtype=np.float64)
+    k = min(top_k, len(PRODUCTS))
+    products = np.full((X.shape[0], k), -1, dtype=np.int64)
+    benefit = np.zeros((X.shape[0], k))
+    confidence = np.zeros((X.shape[0], k))
+
+    for start in range(0, X.shape[0], chunk_size):
+        block = slice(start, start + chunk_size)
+        b, c, e = product_scores(X[block])
+        idx = top_k_products(b, e, k)
+        safe = np.where(idx >= 0, idx, 0)
+        products[block] = idx
+        benefit[block] = np.where(idx >= 0, np.take_along_axis(b, safe, axis=1), 0)
+        confidence[block] = np.where(idx >= 0, np.take_along_axis(c, safe, axis=1), 0)
+
+    return BatchScores(products, benefit, confidence)
+
+
+def scores_to_tuples(scores: BatchScores, row: int) -> List[Tuple[str, float, float]]:
+    """Строка результата в формате calculate_product_scores: [(product, benefit, confidence), ...]"""
+    result = []
+    for idx, benefit, confidence in zip(scores.products[row], scores.benefit[row], scores.confidence[row]):
+        if idx < 0:
+            break
+        result.append((PRODUCTS[idx], float(benefit), float(confidence)))
+    return result
+
+
+def score_clients(metrics_list: List[Dict], top_k: int = DEFAULT_TOP_K) -> List[List[Tuple[str, float, float]]]:
+    """Пакетный аналог calculate_product_scores для списка словарей metrics"""
+    scores = score_batch(metrics_matrix(metrics_list), top_k)
+    return [scores_to_tuples(scores, i) for i in range(len(metrics_list))]
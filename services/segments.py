@@ -0,0 +1,249 @@
+"""
+Сводки по сегментам клиентов: город x статус x текущий продукт.
+
+Сводка материализуется один раз из таблицы признаков (services/features.py): по каждому
+сегменту — число клиентов, траты по категориям, объём переводов по типам и распределение
+рекомендованных продуктов (места топа, как в /api/diagnose). Запрос /api/segments только
+суммирует строки сегментов (их сотни, а не клиенты) и кэшируется до изменения данных.
+
+При append/expire анализатор вычитает вклад затронутых клиентов до изменения таблицы
+признаков и прибавляет после — сводка не пересчитывается по всем клиентам.
+
+    python -m services.segments --group-by city,status       # сводка по хранилищу config.STORE_DIR
+"""
+import argparse
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from services import config
+from services.features import ClientFeatures, FeatureLayout, _pad
+from services.scoring import PRODUCTS, score_batch
+
+# Измерения сегмента — колонки профиля клиента
+DIMENSIONS = ['city', 'status', 'product']
+# Мест топа рекомендаций в распределении (как top_k в /api/diagnose)
+RECOMMENDATION_TOP_K = 3
+
+# Таблицы сводки: строка — сегмент (в порядке self.codes)
+TABLES = ['clients', 'cat_sum', 'cat_cnt', 'flow_sum', 'flow_cnt', 'recommended']
+
+
+class SegmentRollup:
+    def __init__(self, layout: FeatureLayout, labels: Dict[str, List[str]], codes: np.ndarray,
+                 clients: np.ndarray, cat_sum: np.ndarray, cat_cnt: np.ndarray, flow_sum: np.ndarray,
+                 flow_cnt: np.ndarray, recommended: np.ndarray):
+        """
+        labels — словари значений измерений, codes — (n_segments x DIMENSIONS) коды значений сегментов.
+        recommended — (n_segments x top_k x PRODUCTS): сколько клиентов получили продукт на месте j.
+        """
+        self.layout = layout
+        self.labels = {dim: list(labels[dim]) for dim in DIMENSIONS}
+        self.codes = codes
+        self.clients = clients
+        self.cat_sum = cat_sum
+        self.cat_cnt = cat_cnt
+        self.flow_sum = flow_sum
+        self.flow_cnt = flow_cnt
+        self.recommended = recommended
+        self._lookup = {tuple(key): i for i, key in enumerate(self.codes.tolist())}
+        self._label_index = {dim: {value: i for i, value in enumerate(self.labels[dim])} for dim in DIMENSIONS}
+        # Результаты query по параметрам; сбрасывается при любом изменении сводки
+        self._cache: Dict[Tuple, List[Dict]] = {}
+
+    @classmethod
+    def empty(cls, layout: FeatureLayout, top_k: int = RECOMMENDATION_TOP_K) -> 'SegmentRollup':
+        n_types, n_directions = len(layout.transfer_types), len(layout.directions)
+        return cls(layout, {dim: [] for dim in DIMENSIONS}, np.zeros((0, len(DIMENSIONS)), dtype=np.int64),
+                   np.zeros(0, dtype=np.int64),
+                   np.zeros((0, len(layout.categories))), np.zeros((0, len(layout.categories)), dtype=np.int64),
+                   np.zeros((0, n_types, n_directions)), np.zeros((0, n_types, n_directions), dtype=np.int64),
+                   np.zeros((0, top_k, len(PRODUCTS)), dtype=np.int64))
+
+    @classmethod
+    def build(cls, features: ClientFeatures, top_k: int = RECOMMENDATION_TOP_K) -> 'SegmentRollup':
+        """Сводка по всем клиентам таблицы признаков (с транзакциями, как в analyze_client)"""
+        rollup = cls.empty(features.layout, top_k)
+        rollup._contribute(features, features.rows(), 1)
+        return rollup
+
+    def copy(self) -> 'SegmentRollup':
+        """Независимая копия сводки (для изменения, пока оригинал читают запросы)"""
+        return self.__class__(self.layout, self.labels, np.array(self.codes),
+                              *(np.array(getattr(self, name)) for name in TABLES))
+
+    @property
+    def nbytes(self) -> int:
+        """Объём таблиц сводки"""
+        return self.codes.nbytes + sum(getattr(self, name).nbytes for name in TABLES)
+
+    @property
+    def top_k(self) -> int:
+        return self.recommended.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def save(self, path: str) -> Dict:
+        """Записать таблицы в path (по .npy на массив); возвращает описание для load"""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'codes.npy'), self.codes)
+        for name in TABLES:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        return {'labels': self.labels}
+
+    @classmethod
+    def load(cls, path: str, layout: FeatureLayout, info: Dict, mmap_mode: Optional[str] = 'c') -> 'SegmentRollup':
+        """Открыть сводку, записанную save (mmap с копированием при записи, как ClientFeatures.load)"""
+        def array(name: str) -> np.ndarray:
+            return np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+        return cls(layout, info['labels'], array('codes'), *(array(name) for name in TABLES))
+
+    def extend_layout(self, layout: FeatureLayout):
+        """Новые категории/типы/направления дописаны в конец словарей layout (см. ClientFeatures.extend_layout)"""
+        for name in ('cat_sum', 'cat_cnt'):
+            setattr(self, name, _pad(getattr(self, name), 1, len(layout.categories)))
+        for name in ('flow_sum', 'flow_cnt'):
+            values = _pad(getattr(self, name), 1, len(layout.transfer_types))
+            setattr(self, name, _pad(values, 2, len(layout.directions)))
+        self.layout = layout
+        self._cache.clear()
+
+    def _segments(self, features: ClientFeatures, rows: np.ndarray) -> np.ndarray:
+        """Номер сегмента каждой строки таблицы признаков; новые значения и сегменты дописываются в конец"""
+        keys = np.zeros((len(rows), len(DIMENSIONS)), dtype=np.int64)
+        for j, dim in enumerate(DIMENSIONS):
+            values, inverse = np.unique(features.profile_column(dim)[rows].astype(str), return_inverse=True)
+            index = self._label_index[dim]
+            for value in values.tolist():
+                if value not in index:
+                    index[value] = len(self.labels[dim])
+                    self.labels[dim].append(value)
+            keys[:, j] = np.array([index[value] for value in values.tolist()], dtype=np.int64)[inverse]
+
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        new = [key for key in map(tuple, unique.tolist()) if key not in self._lookup]
+        if new:
+            for key in new:
+                self._lookup[key] = len(self.codes) + new.index(key)
+            self.codes = np.concatenate([self.codes, np.array(new, dtype=np.int64)])
+            for name in TABLES:
+                values = getattr(self, name)
+                setattr(self, name, np.concatenate([values, np.zeros((len(new),) + values.shape[1:],
+                                                                     dtype=values.dtype)]))
+        segments = np.array([self._lookup[key] for key in map(tuple, unique.tolist())], dtype=np.int64)
+        return segments[inverse.reshape(-1)]
+
+    def _contribute(self, features: ClientFeatures, rows: np.ndarray, sign: int):
+        rows = np.asarray(rows, dtype=np.int64)
+        self._cache.clear()
+        if not len(rows):
+            return
+        segments = self._segments(features, rows)
+        np.add.at(self.clients, segments, sign)
+        np.add.at(self.cat_sum, segments, sign * features.cat_sum[rows])
+        np.add.at(self.cat_cnt, segments, sign * features.cat_cnt[rows])
+        np.add.at(self.flow_sum, segments, sign * features.flow_sum[rows])
+        np.add.at(self.flow_cnt, segments, sign * features.flow_cnt[rows])
+
+        products = score_batch(features.matrix(rows), top_k=self.top_k).products
+        for j in range(self.top_k):
+            ranked = products[:, j] >= 0
+            np.add.at(self.recommended, (segments[ranked], j, products[ranked, j]), sign)
+
+        # После вычитания суммы опустевших ячеек могут остаться ненулевыми из-за округления
+        touched = np.unique(segments)
+        for total, count in (('cat_sum', 'cat_cnt'), ('flow_sum', 'flow_cnt')):
+            values = getattr(self, total)
+            values[touched] = np.where(getattr(self, count)[touched] > 0, values[touched], 0.0)
+
+    def apply(self, features: ClientFeatures, client_codes: Iterable[int], sign: int = 1):
+        """
+        Прибавить (sign=1) или вычесть (sign=-1) текущий вклад клиентов client_codes из features.
+        Анализатор вычитает вклад затронутых клиентов до изменения таблицы признаков и прибавляет после.
+        """
+        rows = [features.position(int(client_code)) for client_code in client_codes]
+        self._contribute(features, np.array([row for row in rows if row is not None], dtype=np.int64), sign)
+
+    def query(self, group_by: Sequence[str] = DIMENSIONS, filters: Optional[Dict[str, str]] = None) -> List[Dict]:
+        """
+        Сводка, сгруппированная по измерениям group_by (подмножество DIMENSIONS), по сегментам,
+        подходящим под filters (измерение -> значение). Группы без клиентов не возвращаются.
+        """
+        unknown = [dim for dim in list(group_by) + list(filters or {}) if dim not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Unknown segment dimensions: {', '.join(unknown)} (known: {', '.join(DIMENSIONS)})")
+        filters = {dim: value for dim, value in (filters or {}).items() if value is not None}
+        key = (tuple(group_by), tuple(sorted(filters.items())))
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        selected = self.clients > 0
+        for dim, value in filters.items():
+            code = self._label_index[dim].get(value)
+            if code is None:
+                selected[:] = False
+                break
+            selected &= self.codes[:, DIMENSIONS.index(dim)] == code
+        segments = np.flatnonzero(selected)
+
+        dims = [DIMENSIONS.index(dim) for dim in group_by]
+        groups, inverse = np.unique(self.codes[segments][:, dims], axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        totals = {}
+        for name in TABLES:
+            values = getattr(self, name)
+            totals[name] = np.zeros((len(groups),) + values.shape[1:], dtype=values.dtype)
+            np.add.at(totals[name], inverse, values[segments])
+
+        result = []
+        for g, codes in enumerate(groups.tolist()):
+            item = {dim: self.labels[dim][code] for dim, code in zip(group_by, codes)}
+            item['clients'] = int(totals['clients'][g])
+            item['spending'] = {
+                category: float(amount)
+                for category, amount, count in zip(self.layout.categories, totals['cat_sum'][g], totals['cat_cnt'][g])
+                if count > 0
+            }
+            volume = totals['flow_sum'][g].sum(axis=1)
+            item['transfers'] = {
+                transfer_type: float(amount)
+                for transfer_type, amount, count in zip(self.layout.transfer_types, volume,
+                                                        totals['flow_cnt'][g].sum(axis=1))
+                if count > 0
+            }
+            recommended = totals['recommended'][g]
+            item['recommendations'] = {PRODUCTS[p]: int(n) for p, n in enumerate(recommended.sum(axis=0)) if n}
+            item['top_recommendation'] = {PRODUCTS[p]: int(n) for p, n in enumerate(recommended[0]) if n}
+            result.append(item)
+
+        self._cache[key] = result
+        return result
+
+
+def main():
+    from services.analytics import ClientAnalyzer
+
+    parser = argparse.ArgumentParser(description="Сводка по сегментам город x статус x продукт")
+    parser.add_argument('--store-dir', default=config.STORE_DIR)
+    parser.add_argument('--group-by', default=','.join(DIMENSIONS), help="измерения через запятую")
+    for dim in DIMENSIONS:
+        parser.add_argument(f'--{dim}', help=f"только сегменты с этим значением {dim}")
+    args = parser.parse_args()
+
+    analyzer = ClientAnalyzer.from_store(args.store_dir)
+    group_by = [dim for dim in args.group_by.split(',') if dim]
+    rows = analyzer.segments.query(group_by, {dim: getattr(args, dim) for dim in DIMENSIONS})
+    frame = pd.DataFrame([{**{dim: row[dim] for dim in group_by}, 'clients': row['clients'],
+                           'spending': sum(row['spending'].values()),
+                           'top_recommendation': max(row['top_recommendation'], default=None,
+                                                     key=row['top_recommendation'].get)} for row in rows])
+    print(frame.to_string(index=False) if len(frame) else "No segments")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Сериализация ответов пакетных эндпоинтов: NDJSON, JSON и MessagePack.
+
+NDJSON — одна JSON-строка на элемент, JSON — массив элементов; кодируются orjson
+(в разы быстрее json.dumps, есть в requirements.txt), без него — стандартным json.
+MessagePack — поток объектов подряд (читается msgpack.Unpacker), доступен, если установлен
+msgpack (тоже в requirements.txt; без него MessagePack не предлагается и Accept с ним даёт 406).
+Формат выбирается по заголовку Accept (negotiate).
+"""
+import json
+from typing import Any, Iterable, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+NDJSON = "application/x-ndjson"
+JSON = "application/json"
+MSGPACK = "application/x-msgpack"
+# Варианты названия MessagePack в Accept
+MSGPACK_TYPES = {MSGPACK, "application/msgpack", "application/vnd.msgpack"}
+
+
+def ndjson_line(item: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(item, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def json_value(item: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(item)
+    return json.dumps(item, ensure_ascii=False).encode("utf-8")
+
+
+def msgpack_item(item: Any) -> bytes:
+    return msgpack.packb(item, use_bin_type=True)
+
+
+def available_types() -> list:
+    return [NDJSON, JSON] + ([MSGPACK] if msgpack is not None else [])
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """
+    Формат ответа по заголовку Accept: первый поддерживаемый из перечисленных (q не учитывается).
+    Без Accept или с */* — NDJSON. None — ни один из запрошенных форматов недоступен.
+    """
+    if not accept:
+        return NDJSON
+    for part in accept.split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in MSGPACK_TYPES and msgpack is not None:
+            return MSGPACK
+        if media_type == JSON:
+            return JSON
+        if media_type in (NDJSON, "application/*", "*/*"):
+            return NDJSON
+    return None
+
+
+def encode(items: Iterable[Any], media_type: str) -> bytes:
+    """Тело ответа в формате media_type: элементы подряд (NDJSON, MSGPACK) или JSON-массив (JSON)"""
+    if media_type == JSON:
+        return b"[" + b",".join(json_value(item) for item in items) + b"]"
+    pack = msgpack_item if media_type == MSGPACK else ndjson_line
+    return b"".join(pack(item) for item in items)
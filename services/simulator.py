@@ -0,0 +1,156 @@
+"""
+What-if симулятор констант правил продуктов (services/scoring.py: ScoringParams).
+
+Сетка значений параметров разворачивается в сценарии (декартово произведение), и все клиенты
+пересчитываются для всех сценариев за один проход по готовой матрице метрик: поля ScoringParams
+передаются в product_scores массивами (сценарии x 1), выгода считается сразу для всех сценариев.
+Клиенты идут блоками, чтобы промежуточные массивы (сценарии x блок x продукты) оставались
+в пределах scoring.DEFAULT_CHUNK_SIZE строк.
+
+По каждому сценарию — распределение продуктов на первом месте и во всём топе, средняя
+и суммарная выгода лучшего продукта и сколько клиентов сменили лучший продукт относительно
+текущих констант.
+
+    python -m services.simulator --param travel_rate=0.03,0.04,0.05 --param premium_balance=300000,500000
+"""
+import argparse
+import itertools
+import json
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from services import config
+from services.scoring import DEFAULT_CHUNK_SIZE, DEFAULT_PARAMS, PRODUCTS, ScoringParams, product_scores
+
+# Параметры, которые можно варьировать
+PARAMETERS = list(ScoringParams._fields)
+# Мест топа в распределении (как top_k в /api/diagnose)
+SIMULATION_TOP_K = 3
+
+
+def parameter_grid(grid: Dict[str, Sequence[float]]) -> List[ScoringParams]:
+    """
+    Сценарии — все сочетания значений grid (параметр -> значения); остальные параметры по умолчанию.
+    ValueError — неизвестный параметр, пустой список значений или значение не больше нуля
+    """
+    unknown = [name for name in grid if name not in PARAMETERS]
+    if unknown:
+        raise ValueError(f"Unknown scoring parameters: {', '.join(unknown)} (known: {', '.join(PARAMETERS)})")
+    empty = [name for name, values in grid.items() if not len(values)]
+    if empty:
+        raise ValueError(f"No values for scoring parameters: {', '.join(empty)}")
+    values = {name: [float(value) for value in grid[name]] for name in grid}
+    # Пороги и ставки — положительные числа: premium_balance стоит в знаменателе уверенности
+    # премиальной карты, ноль или отрицательное значение дали бы inf/nan вместо выгоды
+    invalid = [name for name, items in values.items() if not all(np.isfinite(item) and item > 0 for item in items)]
+    if invalid:
+        raise ValueError(f"Scoring parameters must be positive numbers: {', '.join(invalid)}")
+    names = list(values)
+    return [DEFAULT_PARAMS._replace(**dict(zip(names, combination)))
+            for combination in itertools.product(*(values[name] for name in names))]
+
+
+def _ranked(benefit: np.ndarray, eligible: np.ndarray, k: int) -> np.ndarray:
+    """
+    Топ-k продуктов по строкам в порядке scoring.top_k_products (по убыванию выгоды, при равной —
+    по порядку PRODUCTS, -1 — пусто). Продуктов всего восемь, и на строках сценарии x клиенты
+    стабильная сортировка строки быстрее argpartition с досортировкой равных.
+    """
+    key = np.where(eligible, benefit, -np.inf)
+    selected = np.argsort(-key, axis=-1, kind='stable')[..., :k]
+    selected[~np.take_along_axis(eligible, selected, axis=-1)] = -1
+    return selected
+
+
+def simulate(X: np.ndarray, scenarios: Sequence[ScoringParams], top_k: int = SIMULATION_TOP_K,
+             chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[Dict]:
+    """
+    Пересчитать матрицу метрик X (клиенты x scoring.FEATURES) для каждого сценария.
+    Возвращает по словарю на сценарий в порядке scenarios.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    # Сценарий 0 — текущие константы: с ним сравнивается лучший продукт
+    scenarios = [DEFAULT_PARAMS] + list(scenarios)
+    n_scenarios, n_products = len(scenarios), len(PRODUCTS)
+    k = min(top_k, n_products)
+    params = ScoringParams(*(np.array(values, dtype=np.float64)[:, None] for values in zip(*scenarios)))
+
+    placed = np.zeros((n_scenarios, k, n_products), dtype=np.int64)
+    best_benefit = np.zeros(n_scenarios)
+    changed = np.zeros(n_scenarios, dtype=np.int64)
+    step = max(1, chunk_size // n_scenarios)
+    for start in range(0, X.shape[0], step):
+        block = X[start:start + step]
+        benefit, _, eligible = product_scores(block, params)
+        products = _ranked(benefit, eligible, k)
+
+        # Счётчики (сценарий, место, продукт); пустое место (-1) уходит в отбрасываемую колонку 0
+        cells = (np.arange(n_scenarios)[:, None, None] * k + np.arange(k)) * (n_products + 1) + products + 1
+        placed += np.bincount(cells.ravel(), minlength=n_scenarios * k * (n_products + 1)).reshape(
+            n_scenarios, k, n_products + 1)[:, :, 1:]
+
+        best = products[:, :, 0]
+        value = np.take_along_axis(benefit, np.maximum(best, 0)[:, :, None], axis=2)[:, :, 0]
+        best_benefit += np.where(best >= 0, value, 0.0).sum(axis=1)
+        changed += (best != best[0]).sum(axis=1)
+
+    n_clients = X.shape[0]
+    result = []
+    for s in range(1, n_scenarios):
+        top = placed[s, 0]
+        result.append({
+            'params': {name: float(value) for name, value in scenarios[s]._asdict().items()},
+            'clients': n_clients,
+            'top_recommendation': {PRODUCTS[p]: int(count) for p, count in enumerate(top) if count},
+            'recommendations': {PRODUCTS[p]: int(count) for p, count in enumerate(placed[s].sum(axis=0)) if count},
+            'no_recommendation': n_clients - int(top.sum()),
+            'expected_benefit': float(best_benefit[s] / n_clients) if n_clients else 0.0,
+            'total_benefit': float(best_benefit[s]),
+            'changed_top_recommendation': int(changed[s]),
+        })
+    return result
+
+
+def _parse_param(text: str):
+    name, _, values = text.partition('=')
+    try:
+        return name.strip(), [float(value) for value in values.split(',') if value.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается имя=значение,значение,...: {text!r}")
+
+
+def main():
+    from services.analytics import ClientAnalyzer
+
+    parser = argparse.ArgumentParser(description="What-if симулятор констант правил продуктов")
+    parser.add_argument('--store-dir', default=config.STORE_DIR)
+    parser.add_argument('--param', action='append', type=_parse_param, default=[],
+                        help=f"параметр=значения через запятую, можно несколько раз ({', '.join(PARAMETERS)})")
+    parser.add_argument('--top-k', type=int, default=SIMULATION_TOP_K)
+    parser.add_argument('--json', action='store_true', help="полный результат в JSON")
+    args = parser.parse_args()
+
+    try:
+        scenarios = parameter_grid(dict(args.param))
+    except ValueError as e:
+        parser.error(str(e))
+    analyzer = ClientAnalyzer.from_store(args.store_dir)
+    features = analyzer.features
+    result = simulate(features.matrix(features.rows()), scenarios, args.top_k)
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+    varied = [name for name, _ in args.param]
+    frame = pd.DataFrame([{**{name: item['params'][name] for name in varied},
+                           'expected_benefit': round(item['expected_benefit'], 2),
+                           'changed': item['changed_top_recommendation'],
+                           **{product: item['top_recommendation'].get(product, 0) for product in PRODUCTS}}
+                          for item in result])
+    print(frame.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
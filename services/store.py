@@ -0,0 +1,344 @@
+"""
+Колоночное хранилище клиентских данных.
+
+Один раз собирает все data/client_*_transactions_3m.csv и data/client_*_transfers_3m.csv
+в каталог с .npy-колонками. Каждая сборка (и каждая дописанная дельта) — новое поколение:
+
+    store/
+        CURRENT                         # имя текущего поколения
+        gen-<ns>-<version>/
+            meta.json                   # схема, словари категорий, версия данных
+            transactions/<column>.npy
+            transfers/<column>.npy
+            derived/                    # производные массивы (services/loader.py), если собраны
+
+Строки кодируются в категории (коды int8/int16 + общий словарь в meta.json),
+даты хранятся как int64 (наносекунды с эпохи), суммы как float64. Суммы в тенге (amount_kzt)
+пересчитываются по таблице курсов data/fx_rates.csv один раз при сборке (services/fx.py),
+сама таблица курсов сохраняется в meta.json — для дельт, дописываемых позже.
+Строки отсортированы по client_code, порядок внутри клиента сохраняется.
+Колонки открываются через mmap, поэтому воркеры uvicorn делят одни и те же страницы.
+
+Поколение пишется во временный каталог и публикуется атомарной заменой файла CURRENT:
+читатель, открывший поколение, видит его целиком, а старые поколения удаляются только
+после публикации нового (последние config.STORE_KEEP_GENERATIONS сохраняются).
+Каталог с meta.json в корне (хранилище без поколений) читается как одно поколение.
+
+Сборка:  python -m services.store --data-dir data --store-dir store
+         (python -m services.loader — то же вместе с производными массивами для воркеров)
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка сборки между процессами недоступна
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+from services import config
+from services.fx import FX_RATES_FILE, fx_table_for, normalize_amounts
+
+STORE_FORMAT = 2
+
+TRANSACTION_COLUMNS = ['client_code', 'name', 'product', 'status', 'city', 'date', 'category', 'amount', 'currency']
+TRANSFER_COLUMNS = ['client_code', 'name', 'product', 'status', 'city', 'date', 'type', 'direction', 'amount',
+                    'currency']
+
+# Строковые колонки, которые кодируются словарём. Словарь общий для обеих таблиц,
+# поэтому коды name/status/city совпадают в транзакциях и переводах.
+CATEGORICAL_COLUMNS = ['name', 'product', 'status', 'city', 'category', 'type', 'direction', 'currency']
+
+TABLES = {
+    'transactions': ('client_*_transactions_3m.csv', TRANSACTION_COLUMNS),
+    'transfers': ('client_*_transfers_3m.csv', TRANSFER_COLUMNS),
+}
+
+CURRENT_FILE = 'CURRENT'
+GENERATION_PREFIX = 'gen-'
+LOCK_FILE = '.lock'
+
+
+def _data_files(data_dir: str, pattern: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(data_dir, pattern)))
+
+
+def data_fingerprint(data_dir: str) -> str:
+    """Отпечаток исходных CSV и таблицы курсов: имена, размеры и mtime файлов"""
+    digest = hashlib.sha1()
+    for pattern in [pattern for pattern, _ in TABLES.values()] + [FX_RATES_FILE]:
+        for path in _data_files(data_dir, pattern):
+            stat = os.stat(path)
+            digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:16]
+
+
+def _read_table(data_dir: str, pattern: str, columns: List[str]) -> pd.DataFrame:
+    frames = [pd.read_csv(path) for path in _data_files(data_dir, pattern)]
+    if not frames:
+        return pd.DataFrame({col: pd.Series(dtype='object') for col in columns})
+    df = pd.concat(frames, ignore_index=True)[columns]
+    # mergesort стабилен: порядок строк внутри клиента не меняется
+    return df.sort_values('client_code', kind='mergesort').reset_index(drop=True)
+
+
+def _encode_table(df: pd.DataFrame, vocab: Dict[str, List[str]]) -> Dict[str, np.ndarray]:
+    """Перевод DataFrame в набор типизированных колонок"""
+    columns = {}
+    for col in df.columns:
+        if col in CATEGORICAL_COLUMNS:
+            # codes получают тот же dtype, что выберет pandas (int8/int16) — это позволяет
+            # собрать Categorical поверх mmap без копирования
+            columns[col] = pd.Categorical(df[col].astype(str), categories=vocab[col]).codes
+        elif col == 'date':
+            columns[col] = pd.to_datetime(df[col]).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        elif col == 'client_code':
+            columns[col] = df[col].to_numpy(dtype=np.int64)
+        else:
+            columns[col] = df[col].to_numpy(dtype=np.float64)
+    return columns
+
+
+def current_generation(store_dir: str = config.STORE_DIR) -> Optional[str]:
+    """
+    Имя текущего поколения — дешёвая проверка, не сменилось ли оно (одно чтение CURRENT).
+    None — поколений нет (хранилища нет или оно записано без поколений).
+    """
+    try:
+        with open(os.path.join(store_dir, CURRENT_FILE), encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def generation_dir(store_dir: str = config.STORE_DIR) -> Optional[str]:
+    """Каталог текущего поколения хранилища или None, если хранилища нет"""
+    generation = current_generation(store_dir)
+    if generation is not None:
+        return os.path.join(store_dir, generation)
+    # Хранилище без поколений (или каталог самого поколения): meta.json в корне
+    if os.path.exists(os.path.join(store_dir, 'meta.json')):
+        return store_dir
+    return None
+
+
+def _publish(store_dir: str, generation: str):
+    """Атомарно переключить CURRENT на generation"""
+    tmp_path = os.path.join(store_dir, f"{CURRENT_FILE}.tmp-{os.getpid()}")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(generation)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(store_dir, CURRENT_FILE))
+
+    # Хранилище без поколений, записанное раньше, больше не нужно
+    for name in ['meta.json'] + list(TABLES):
+        path = os.path.join(store_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def prune_generations(store_dir: str = config.STORE_DIR, keep: int = config.STORE_KEEP_GENERATIONS) -> List[str]:
+    """
+    Удалить старые поколения, кроме последних keep и текущего. Процессы, которые ещё держат
+    удалённое поколение через mmap, продолжают работать: файлы исчезают после их закрытия.
+    """
+    current = current_generation(store_dir)
+    generations = sorted((name for name in os.listdir(store_dir) if name.startswith(GENERATION_PREFIX)),
+                         key=lambda name: int(name.split('-')[1]))
+    removed = []
+    for name in generations[:-keep] if keep > 0 else generations:
+        if name != current:
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+            removed.append(name)
+    return removed
+
+
+@contextmanager
+def store_lock(store_dir: str = config.STORE_DIR):
+    """Блокировка сборки: несколько воркеров не собирают одно и то же хранилище параллельно"""
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, LOCK_FILE), 'w') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_meta(path: str, meta: Dict):
+    with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+def write_store(tables: Dict[str, pd.DataFrame], store_dir: str, source: str, version: str,
+                derive: Optional[Callable[[str], Dict]] = None, **extra) -> Dict:
+    """
+    Записать таблицы новым поколением хранилища. Запись идёт во временный каталог, который
+    затем переименовывается и публикуется через CURRENT, так что читатели никогда не видят
+    наполовину записанные данные. source — отпечаток исходных CSV, version — версия содержимого
+    (source + применённые дельты). derive(каталог поколения) вызывается до публикации и может
+    дописать в поколение производные массивы; возвращённый словарь добавляется в meta.
+    """
+    vocab = {}
+    for col in CATEGORICAL_COLUMNS:
+        ordered: Dict[str, None] = {}
+        values = set()
+        for df in tables.values():
+            if col not in df.columns:
+                continue
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                # Словарь категориальной колонки сохраняется как есть — с порядком и неиспользуемыми
+                # значениями: производные массивы дописанного поколения (services/ingest.py) посчитаны в нём
+                ordered.update(dict.fromkeys(df[col].cat.categories.astype(str)))
+            else:
+                values.update(df[col].dropna().astype(str).unique())
+        vocab[col] = list(ordered) + sorted(values - ordered.keys())
+
+    generation = f"{GENERATION_PREFIX}{time.time_ns()}-{version[:16]}"
+    meta = {
+        'format': STORE_FORMAT,
+        'generation': generation,
+        'source': source,
+        'version': version,
+        'built_at': time.time(),
+        'vocab': vocab,
+        'tables': {},
+        **extra,
+    }
+
+    os.makedirs(store_dir, exist_ok=True)
+    tmp_dir = os.path.join(store_dir, f".tmp-{generation}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for name, df in tables.items():
+        os.makedirs(os.path.join(tmp_dir, name))
+        columns = _encode_table(df, vocab)
+        for col, values in columns.items():
+            np.save(os.path.join(tmp_dir, name, f"{col}.npy"), values)
+        meta['tables'][name] = {
+            'rows': int(len(df)),
+            'columns': {col: str(values.dtype) for col, values in columns.items()},
+        }
+    _write_meta(tmp_dir, meta)
+
+    try:
+        if derive is not None:
+            meta.update(derive(tmp_dir))
+            _write_meta(tmp_dir, meta)
+        os.replace(tmp_dir, os.path.join(store_dir, generation))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    _publish(store_dir, generation)
+    prune_generations(store_dir)
+    return meta
+
+
+def build_store(data_dir: str = config.DATA_DIR, store_dir: str = config.STORE_DIR,
+                derive: Optional[Callable[[str], Dict]] = None) -> Dict:
+    """Собрать хранилище из CSV в data_dir (новым поколением)"""
+    started = time.perf_counter()
+    fx = fx_table_for(data_dir, config.FX_RATES)
+    tables = {name: normalize_amounts(_read_table(data_dir, pattern, columns), fx)
+              for name, (pattern, columns) in TABLES.items()}
+    source = data_fingerprint(data_dir)
+    meta = write_store(tables, store_dir, source=source, version=source, derive=derive, deltas=[],
+                       fx_rates=fx.to_records())
+    meta['build_seconds'] = time.perf_counter() - started
+    return meta
+
+
+def store_exists(store_dir: str = config.STORE_DIR) -> bool:
+    return generation_dir(store_dir) is not None
+
+
+def store_compatible(store_dir: str = config.STORE_DIR) -> bool:
+    """Хранилище есть и записано в текущем формате (иначе его нужно пересобрать)"""
+    return store_exists(store_dir) and read_meta(store_dir).get('format') == STORE_FORMAT
+
+
+def ensure_store(data_dir: str = config.DATA_DIR, store_dir: str = config.STORE_DIR, rebuild: bool = False,
+                 derive: Optional[Callable[[str], Dict]] = None) -> bool:
+    """
+    Собрать хранилище, если его нет, формат устарел или (при rebuild) исходные данные изменились.
+    Сборка идёт под блокировкой: остальные процессы ждут и открывают уже собранное поколение.
+    Возвращает True, если сборку выполнил этот вызов.
+    """
+    def stale() -> bool:
+        return not store_compatible(store_dir) or (
+            rebuild and read_meta(store_dir)['source'] != data_fingerprint(data_dir))
+
+    if not stale():
+        return False
+    with store_lock(store_dir):
+        # Пока ждали блокировку, хранилище мог собрать другой процесс
+        if not stale():
+            return False
+        print(f"Building column store {store_dir} from {data_dir}...")
+        build_store(data_dir, store_dir, derive)
+        return True
+
+
+def read_meta(store_dir: str = config.STORE_DIR) -> Dict:
+    path = generation_dir(store_dir) or store_dir
+    with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_store(store_dir: str = config.STORE_DIR, mmap: bool = True) -> Tuple[pd.DataFrame, pd.DataFrame, Dict]:
+    """
+    Открыть текущее поколение хранилища. Возвращает (transactions_df, transfers_df, meta);
+    meta['path'] — каталог открытого поколения.
+    Числовые колонки и коды категорий — представления над mmap, без копирования.
+    """
+    path = generation_dir(store_dir) or store_dir
+    meta = read_meta(path)
+    if meta.get('format') != STORE_FORMAT:
+        raise ValueError(f"Unsupported store format: {meta.get('format')}")
+    meta['path'] = path
+
+    vocab = meta['vocab']
+    frames = []
+    for name in TABLES:
+        columns = {}
+        for col in meta['tables'][name]['columns']:
+            values = np.load(os.path.join(path, name, f"{col}.npy"), mmap_mode='r' if mmap else None)
+            if col in CATEGORICAL_COLUMNS:
+                columns[col] = pd.Categorical.from_codes(values, categories=vocab[col])
+            elif col == 'date':
+                columns[col] = values.view('datetime64[ns]')
+            else:
+                columns[col] = values
+        frames.append(pd.DataFrame(columns, copy=False))
+
+    transactions_df, transfers_df = frames
+    return transactions_df, transfers_df, meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка колоночного хранилища из CSV")
+    parser.add_argument('--data-dir', default=config.DATA_DIR)
+    parser.add_argument('--store-dir', default=config.STORE_DIR)
+    args = parser.parse_args()
+
+    meta = build_store(args.data_dir, args.store_dir)
+    rows = ", ".join(f"{name}: {info['rows']}" for name, info in meta['tables'].items())
+    print(f"Store {args.store_dir} built in {meta['build_seconds']:.2f}s "
+          f"(generation {meta['generation']}, version {meta['version']}; {rows})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Потоковая (out-of-core) сборка таблицы признаков для данных, которые не помещаются в память.
+
+Транзакции и переводы читаются блоками по chunk_rows строк (pd.read_csv(chunksize=...)).
+Каждый блок сворачивается в частичные сводные таблицы своих клиентов (services/features.aggregate)
+со своими словарями категорий и диапазоном месяцев и сразу добавляется в накопленные таблицы
+(FeatureAccumulator), после чего и строки блока, и его частичные таблицы освобождаются.
+Накопленные таблицы расширяются по мере появления новых клиентов, категорий и месяцев;
+словари остаются отсортированными, как у pandas-категорий в памяти. В конце получается одна
+ClientFeatures — дальше скоринг и уведомления идут тем же офлайн-путём движка
+(analytics.recommend_features).
+
+Пик памяти — один блок строк плюс накопленные таблицы клиентов (они растут с числом клиентов,
+а не строк или блоков). Если строки клиента в файле идут подряд (выгрузка отсортирована по client_code,
+как data/ и хранилище), блок режется по границе клиента: все его строки сворачиваются одним
+bincount, и метрики совпадают с путём в памяти бит в бит. Если клиент встречается в нескольких
+несмежных местах, его частичные суммы складываются — результат верный, но может отличаться
+от пути в памяти в последнем бите.
+"""
+import os
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from services import config
+from services.features import TABLES as FEATURE_TABLES
+from services.features import (PROFILE_COLUMNS, ClientFeatures, FeatureLayout, _realign_months, aggregate,
+                               category_codes, month_ordinals, month_range)
+from services.fx import AMOUNT_COLUMN, FxTable, fx_table_for, normalize_amounts
+from services.store import TABLES, TRANSACTION_COLUMNS, TRANSFER_COLUMNS, _data_files
+
+
+def client_chunks(paths: List[str], columns: List[str], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """
+    Блоки строк из CSV paths (по порядку), разрезанные по границе клиента: хвост последнего
+    клиента блока переносится в следующий блок, в том числе через границу файлов.
+    """
+    carry: Optional[pd.DataFrame] = None
+    for path in paths:
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunk_rows):
+            chunk = chunk[columns]
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+            codes = chunk['client_code'].to_numpy()
+            other = np.flatnonzero(codes != codes[-1])
+            if not len(other):
+                # Весь блок — один клиент: ждём конца его строк
+                carry = chunk
+                continue
+            yield chunk.iloc[:other[-1] + 1]
+            carry = chunk.iloc[other[-1] + 1:].reset_index(drop=True)
+    if carry is not None and len(carry):
+        yield carry
+
+
+class PartialAggregate:
+    """Сводные таблицы клиентов одного блока строк в словарях этого блока"""
+
+    def __init__(self, client_codes: np.ndarray, profile: pd.DataFrame, layout: FeatureLayout,
+                 tables: Dict[str, np.ndarray]):
+        self.client_codes = client_codes
+        self.profile = profile
+        self.layout = layout
+        self.tables = tables
+
+    @classmethod
+    def from_transactions(cls, chunk: pd.DataFrame, fx: FxTable) -> 'PartialAggregate':
+        chunk = _prepare_chunk(chunk, fx)
+        category, categories = category_codes(chunk['category'])
+        months = month_ordinals(chunk['date'])
+        layout = FeatureLayout(categories, [], [], month_range(months))
+        clients = chunk['client_code'].to_numpy(dtype=np.int64)
+        client_codes = np.unique(clients)
+        none = np.zeros(0, dtype=np.int64)
+        sums = aggregate(layout, client_codes, clients, category, chunk[AMOUNT_COLUMN].to_numpy(dtype=np.float64),
+                         layout.month_codes(months), none, none, np.zeros(0), none)
+        tables = dict(zip(['cat_sum', 'cat_cnt', 'month_cat_sum', 'month_cat_cnt'], sums[:2] + sums[4:6]))
+        return cls(client_codes, _first_profile(chunk), layout, tables)
+
+    @classmethod
+    def from_transfers(cls, chunk: pd.DataFrame, fx: FxTable) -> 'PartialAggregate':
+        chunk = _prepare_chunk(chunk, fx)
+        types, transfer_types = category_codes(chunk['type'])
+        directions, direction_names = category_codes(chunk['direction'])
+        months = month_ordinals(chunk['date'])
+        layout = FeatureLayout([], transfer_types, direction_names, month_range(months))
+        clients = chunk['client_code'].to_numpy(dtype=np.int64)
+        client_codes = np.unique(clients)
+        none = np.zeros(0, dtype=np.int64)
+        sums = aggregate(layout, client_codes, none, none, np.zeros(0), none,
+                         clients, layout.flow_codes(types, directions), chunk[AMOUNT_COLUMN].to_numpy(dtype=np.float64),
+                         layout.month_codes(months))
+        tables = dict(zip(['flow_sum', 'flow_cnt', 'month_flow_sum', 'month_flow_cnt'], sums[2:4] + sums[6:]))
+        return cls(client_codes, _first_profile(chunk), layout, tables)
+
+    def conform(self, name: str, layout: FeatureLayout) -> np.ndarray:
+        """Таблица name в словарях и на оси месяцев итогового layout"""
+        return conform_table(name, self.tables[name], self.layout, layout)
+
+
+def conform_table(name: str, values: np.ndarray, own: FeatureLayout, layout: FeatureLayout) -> np.ndarray:
+    """
+    Переложить сводную таблицу name из словарей и оси месяцев own в layout (словари layout
+    включают словари own); строки (клиенты) не меняются
+    """
+    if name.startswith('month_') and not np.array_equal(own.months, layout.months):
+        values = _realign_months(values, own.months, layout.months)
+    if 'cat_' in name:
+        axes = [(own.categories, layout.categories)]
+    else:
+        axes = [(own.transfer_types, layout.transfer_types), (own.directions, layout.directions)]
+    for offset, (names, final) in enumerate(axes):
+        if names == final:
+            continue
+        axis = values.ndim - len(axes) + offset
+        shape = list(values.shape)
+        shape[axis] = len(final)
+        result = np.zeros(shape, dtype=values.dtype)
+        index = [slice(None)] * values.ndim
+        index[axis] = np.searchsorted(final, names) if names else slice(0, 0)
+        result[tuple(index)] = values
+        values = result
+    return values
+
+
+def _prepare_chunk(chunk: pd.DataFrame, fx: FxTable) -> pd.DataFrame:
+    chunk = chunk.copy()
+    chunk['date'] = pd.to_datetime(chunk['date'])
+    return normalize_amounts(chunk, fx)
+
+
+def _first_profile(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Профиль клиентов блока — из первой строки клиента"""
+    profile = chunk[['client_code'] + PROFILE_COLUMNS].drop_duplicates('client_code')
+    return profile.astype({col: str for col in PROFILE_COLUMNS})
+
+
+def _empty_tables(n: int, layout: FeatureLayout) -> Dict[str, np.ndarray]:
+    n_months, n_categories = layout.n_months, len(layout.categories)
+    n_types, n_directions = len(layout.transfer_types), len(layout.directions)
+    return {
+        'cat_sum': np.zeros((n, n_categories)),
+        'cat_cnt': np.zeros((n, n_categories), dtype=np.int64),
+        'flow_sum': np.zeros((n, n_types, n_directions)),
+        'flow_cnt': np.zeros((n, n_types, n_directions), dtype=np.int64),
+        'month_cat_sum': np.zeros((n, n_months, n_categories)),
+        'month_cat_cnt': np.zeros((n, n_months, n_categories), dtype=np.int32),
+        'month_flow_sum': np.zeros((n, n_months, n_types, n_directions)),
+        'month_flow_cnt': np.zeros((n, n_months, n_types, n_directions), dtype=np.int32),
+    }
+
+
+class FeatureAccumulator:
+    """
+    Накопленные сводные таблицы: частичные таблицы блоков прибавляются по одной, по мере чтения.
+    Строки клиентов идут в порядке появления (ёмкость растёт удвоением), словари и ось месяцев
+    расширяются, когда блок приносит новые; к порядку client_code строки приводятся в result.
+    """
+
+    def __init__(self):
+        self.layout = FeatureLayout([], [], [])
+        self.size = 0
+        self.tables = _empty_tables(0, self.layout)
+        # client_code по возрастанию и строки таблиц этих клиентов
+        self._codes = np.zeros(0, dtype=np.int64)
+        self._rows = np.zeros(0, dtype=np.int64)
+        # Профиль — из первой строки клиента: транзакции раньше переводов, блоки по порядку
+        self._profiles: List[pd.DataFrame] = []
+
+    def _grow_layout(self, own: FeatureLayout):
+        layout = FeatureLayout(sorted(set(self.layout.categories) | set(own.categories)),
+                               sorted(set(self.layout.transfer_types) | set(own.transfer_types)),
+                               sorted(set(self.layout.directions) | set(own.directions)),
+                               month_range(self.layout.months, own.months))
+        if (layout.categories, layout.transfer_types, layout.directions) == \
+                (self.layout.categories, self.layout.transfer_types, self.layout.directions) \
+                and np.array_equal(layout.months, self.layout.months):
+            return
+        self.tables = {name: conform_table(name, values, self.layout, layout) for name, values in self.tables.items()}
+        self.layout = layout
+
+    def _client_rows(self, partial: PartialAggregate) -> np.ndarray:
+        """Строки таблиц для клиентов блока; новым клиентам выделяются следующие строки"""
+        codes = partial.client_codes
+        pos = np.searchsorted(self._codes, codes)
+        known = pos < len(self._codes)
+        known[known] = self._codes[pos[known]] == codes[known]
+        rows = np.empty(len(codes), dtype=np.int64)
+        rows[known] = self._rows[pos[known]]
+
+        new = ~known
+        if new.any():
+            n_new = int(new.sum())
+            rows[new] = np.arange(self.size, self.size + n_new)
+            capacity = len(self.tables['cat_sum'])
+            if self.size + n_new > capacity:
+                capacity = max(self.size + n_new, 2 * capacity)
+                grown = _empty_tables(capacity, self.layout)
+                for name, values in self.tables.items():
+                    grown[name][:self.size] = values[:self.size]
+                self.tables = grown
+            self.size += n_new
+            order = np.argsort(np.concatenate([self._codes, codes[new]]), kind='stable')
+            self._codes = np.concatenate([self._codes, codes[new]])[order]
+            self._rows = np.concatenate([self._rows, rows[new]])[order]
+            self._profiles.append(partial.profile[partial.profile['client_code'].isin(codes[new])])
+        return rows
+
+    def add(self, partial: PartialAggregate):
+        self._grow_layout(partial.layout)
+        rows = self._client_rows(partial)
+        for name in partial.tables:
+            self.tables[name][rows] += partial.conform(name, self.layout)
+
+    def result(self) -> ClientFeatures:
+        """ClientFeatures по накопленному: строки в порядке client_code"""
+        profile = pd.concat(self._profiles, ignore_index=True) if self._profiles else \
+            pd.DataFrame(columns=['client_code'] + PROFILE_COLUMNS)
+        profile = profile.drop_duplicates('client_code').set_index('client_code').loc[self._codes]
+        tables = self.tables
+        self.tables = _empty_tables(0, self.layout)
+        return ClientFeatures(self.layout, self._codes, profile,
+                              *(tables.pop(name)[self._rows] for name in FEATURE_TABLES))
+
+
+def merge_partials(partials: Iterable[PartialAggregate]) -> ClientFeatures:
+    """
+    Сложить частичные таблицы в ClientFeatures. Словари — отсортированные объединения словарей
+    блоков (как у pandas-категорий), месяцы — общий диапазон. partials может быть генератором:
+    каждая частичная таблица прибавляется, как только получена, и дальше не держится.
+    """
+    accumulator = FeatureAccumulator()
+    for partial in partials:
+        accumulator.add(partial)
+    return accumulator.result()
+
+
+def stream_features(transaction_paths: List[str], transfer_paths: List[str],
+                    chunk_rows: int = config.STREAM_CHUNK_ROWS, fx: Optional[FxTable] = None) -> ClientFeatures:
+    """Таблица признаков по CSV транзакций и переводов, прочитанным блоками по chunk_rows строк"""
+    if fx is None:
+        paths = transaction_paths + transfer_paths
+        fx = fx_table_for(os.path.dirname(paths[0]) if paths else config.DATA_DIR, config.FX_RATES)
+    accumulator = FeatureAccumulator()
+    for chunk in client_chunks(transaction_paths, TRANSACTION_COLUMNS, chunk_rows):
+        accumulator.add(PartialAggregate.from_transactions(chunk, fx))
+    for chunk in client_chunks(transfer_paths, TRANSFER_COLUMNS, chunk_rows):
+        accumulator.add(PartialAggregate.from_transfers(chunk, fx))
+    return accumulator.result()
+
+
+def stream_data_dir(data_dir: str = config.DATA_DIR, chunk_rows: int = config.STREAM_CHUNK_ROWS) -> ClientFeatures:
+    """Таблица признаков по всем CSV каталога данных (те же файлы и порядок, что у services/store.py)"""
+    (tx_pattern, _), (tr_pattern, _) = TABLES['transactions'], TABLES['transfers']
+    return stream_features(_data_files(data_dir, tx_pattern), _data_files(data_dir, tr_pattern), chunk_rows,
+                           fx_table_for(data_dir, config.FX_RATES))
@@ -0,0 +1,220 @@
+"""
+Шаблоны push-уведомлений: разбор один раз при загрузке, рендер только выбранного шаблона.
+
+Тексты лежат в версионируемом JSON (config.NOTIFICATION_TEMPLATES):
+
+    {
+      "version": 1,
+      "max_length": 220,
+      "default_locale": "ru",
+      "locales": {
+        "ru": {
+          "fallback": "{name}, откройте новые возможности с {product}. Узнать больше.",
+          "products": {
+            "Кредитная карта": "{name}, ваши топ-категории — {top_categories}. ...",
+            "Инвестиции": [
+              {"id": "a", "weight": 1, "text": "..."},
+              {"id": "b", "weight": 1, "text": "..."}
+            ]
+          }
+        }
+      }
+    }
+
+Поля шаблона — синтаксис str.format: name, product, любая метрика analyze_client
+(travel_spending, avg_monthly_balance, ...) и производные поля из DERIVED_FIELDS.
+A/B-вариант выбирается детерминированно по client_code (слоты по весам подготовлены заранее),
+локаль — поиском в словаре; на горячем пути нет ни разбора, ни форматирования лишних шаблонов.
+"""
+import json
+import threading
+from math import gcd
+from string import Formatter
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services import config
+from services.scoring import FEATURES
+
+# Производное поле -> (значение по metrics одного клиента, значения по колонкам и номерам строк)
+DERIVED_FIELDS: Dict[str, Tuple[Callable, Callable]] = {
+    # Кешбэк карты для путешествий
+    'travel_cashback': (
+        lambda metrics: metrics['travel_spending'] * 0.04,
+        lambda columns, rows: (np.asarray(columns['travel_spending'])[rows] * 0.04).tolist(),
+    ),
+    # Две первые категории из топа через запятую
+    'top_categories': (
+        lambda metrics: ', '.join(metrics['top_categories'][:2]),
+        lambda columns, rows: [', '.join(columns['top_categories'][row][:2]) for row in rows],
+    ),
+}
+# Метрики, которые analyze_client кладёт в metrics: top_spending — только колонка матрицы скоринга
+# (scoring.metrics_matrix), в словаре её нет
+METRIC_FIELDS = set(FEATURES) - {'top_spending'}
+KNOWN_FIELDS = {'name', 'product'} | METRIC_FIELDS | set(DERIVED_FIELDS)
+
+
+class CompiledTemplate:
+    """Шаблон, разобранный в позиционную форму: список полей + строка для str.format"""
+
+    def __init__(self, text: str, product: Optional[str], variant: str, max_length: int):
+        self.text = text
+        self.product = product
+        self.variant = variant
+        self.max_length = max_length
+
+        self.fields: List[str] = []
+        parts = []
+        for literal, field, spec, conversion in Formatter().parse(text):
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field is None:
+                continue
+            if field not in KNOWN_FIELDS:
+                raise ValueError(f"Unknown template field {field!r} in {product or 'fallback'} ({variant})")
+            if field not in self.fields:
+                self.fields.append(field)
+            parts.append('{' + str(self.fields.index(field)) + ('!' + conversion if conversion else '')
+                         + (':' + spec if spec else '') + '}')
+        self.format = ''.join(parts).format
+
+    def _truncate(self, text: str) -> str:
+        if len(text) > self.max_length:
+            return text[:self.max_length - 3] + "..."
+        return text
+
+    def render(self, product: str, client_info: Dict, metrics: Dict) -> str:
+        values = []
+        for field in self.fields:
+            if field == 'name':
+                values.append(client_info['name'])
+            elif field == 'product':
+                values.append(product)
+            elif field in DERIVED_FIELDS:
+                values.append(DERIVED_FIELDS[field][0](metrics))
+            else:
+                values.append(metrics[field])
+        return self._truncate(self.format(*values))
+
+    def render_rows(self, product: str, columns: Mapping[str, Sequence], rows: List[int]) -> List[str]:
+        values = []
+        for field in self.fields:
+            if field == 'product':
+                values.append([product] * len(rows))
+            elif field in DERIVED_FIELDS:
+                values.append(DERIVED_FIELDS[field][1](columns, rows))
+            else:
+                values.append(np.asarray(columns[field])[rows].tolist())
+        if not values:
+            return [self._truncate(self.format())] * len(rows)
+        return [self._truncate(self.format(*row)) for row in zip(*values)]
+
+
+class LazyColumns(dict):
+    """Колонки для render_batch, которые вычисляются при первом обращении (только нужные шаблонам)"""
+
+    def __init__(self, loaders: Mapping[str, Callable[[], Sequence]]):
+        super().__init__()
+        self.loaders = loaders
+
+    def __missing__(self, key):
+        value = self[key] = self.loaders[key]()
+        return value
+
+
+class TemplateRegistry:
+    def __init__(self, spec: Dict):
+        self.version = spec.get('version')
+        self.max_length = spec.get('max_length', 220)
+        self.default_locale = spec['default_locale']
+        # locale -> product -> слоты вариантов (кортеж CompiledTemplate, повторённых по весу)
+        self._slots: Dict[str, Dict[str, Tuple[CompiledTemplate, ...]]] = {}
+        self._fallback: Dict[str, CompiledTemplate] = {}
+
+        for locale, entry in spec['locales'].items():
+            self._fallback[locale] = CompiledTemplate(entry['fallback'], None, 'default', self.max_length)
+            self._slots[locale] = {
+                product: self._compile_variants(product, variants)
+                for product, variants in entry.get('products', {}).items()
+            }
+        if self.default_locale not in self._slots:
+            raise ValueError(f"Default locale {self.default_locale!r} has no templates")
+
+    def _compile_variants(self, product: str, variants) -> Tuple[CompiledTemplate, ...]:
+        if isinstance(variants, str):
+            return (CompiledTemplate(variants, product, 'default', self.max_length),)
+        compiled = [(CompiledTemplate(v['text'], product, v['id'], self.max_length), int(v.get('weight', 1)))
+                    for v in variants]
+        if not compiled or any(weight <= 0 for _, weight in compiled):
+            raise ValueError(f"Variants of {product!r} need positive weights")
+        divisor = 0
+        for _, weight in compiled:
+            divisor = gcd(divisor, weight)
+        return tuple(template for template, weight in compiled for _ in range(weight // divisor))
+
+    @classmethod
+    def load(cls, path: str) -> 'TemplateRegistry':
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    @property
+    def locales(self) -> List[str]:
+        return list(self._slots)
+
+    def select(self, product: str, client_code: Optional[int] = None,
+               locale: Optional[str] = None) -> CompiledTemplate:
+        """Шаблон для продукта: локаль (или локаль по умолчанию) и A/B-вариант по client_code"""
+        slots = self._slots.get(locale) or self._slots[self.default_locale]
+        variants = slots.get(product)
+        if variants is None:
+            return self._fallback.get(locale) or self._fallback[self.default_locale]
+        if len(variants) == 1 or client_code is None:
+            return variants[0]
+        return variants[client_code % len(variants)]
+
+    def render(self, product: str, client_info: Dict, metrics: Dict, locale: Optional[str] = None) -> str:
+        """Уведомление одного клиента (client_info — результат analyze_client)"""
+        template = self.select(product, client_info.get('client_code'), locale)
+        return template.render(product, client_info, metrics)
+
+    def render_batch(self, products: Sequence[Optional[str]], columns: Mapping[str, Sequence],
+                     client_codes: Sequence[int], locale: Optional[str] = None) -> List[Optional[str]]:
+        """
+        Уведомления для строк: products[i] — продукт строки i (None — без уведомления),
+        columns — колонки полей (name, метрики, top_categories — списки категорий) по тем же строкам.
+        Строки группируются по шаблону, каждый шаблон форматируется по своим колонкам.
+        """
+        groups: Dict[Tuple[CompiledTemplate, str], List[int]] = {}
+        for i, (product, client_code) in enumerate(zip(products, client_codes)):
+            if product is not None:
+                groups.setdefault((self.select(product, int(client_code), locale), product), []).append(i)
+
+        messages: List[Optional[str]] = [None] * len(products)
+        for (template, product), rows in groups.items():
+            for i, message in zip(rows, template.render_rows(product, columns, rows)):
+                messages[i] = message
+        return messages
+
+
+_registry: Optional[TemplateRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_templates() -> TemplateRegistry:
+    """Реестр шаблонов процесса (загружается из config.NOTIFICATION_TEMPLATES при первом обращении)"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = TemplateRegistry.load(config.NOTIFICATION_TEMPLATES)
+    return _registry
+
+
+def reload_templates(path: Optional[str] = None) -> TemplateRegistry:
+    """Перечитать шаблоны (например, после правки текстов) и подменить реестр процесса"""
+    global _registry
+    registry = TemplateRegistry.load(path or config.NOTIFICATION_TEMPLATES)
+    with _registry_lock:
+        _registry = registry
+    return registry
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Тесты запускаются из корня репозитория или из tests/ — пакет services должен импортироваться в обоих случаях
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+DATA_DIR = os.path.join(ROOT, 'data')
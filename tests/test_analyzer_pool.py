@@ -0,0 +1,53 @@
+"""Пул анализаторов шардов (services/analyzer_pool.py): параллельная загрузка и прогрев"""
+import threading
+
+import pytest
+
+from conftest import DATA_DIR
+from services.analyzer_pool import AnalyzerPool
+from services.manifest import Manifest, build_manifest, file_pairs
+
+pytestmark = pytest.mark.skipif(not file_pairs(DATA_DIR), reason="нет CSV в data/")
+
+
+def _pool(tmp_path, **kwargs) -> AnalyzerPool:
+    return AnalyzerPool(Manifest(build_manifest(DATA_DIR, str(tmp_path / 'manifest.json'))), **kwargs)
+
+
+def test_concurrent_loads_share_one_analyzer(tmp_path):
+    # Одновременные запросы одного шарда загружают его один раз; блокировки загрузки не копятся
+    pool = _pool(tmp_path, max_analyzers=2)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def load(shard):
+        barrier.wait()
+        results.append(pool.get(shard))
+
+    threads = [threading.Thread(target=load, args=(i % 2,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pool.loads == 2 and len({id(analyzer) for analyzer in results}) == 2
+    for shard in range(2, 6):
+        pool.get(shard)
+    assert pool.evictions == 4 and pool._loading == {}
+
+
+def test_warmup_not_done_before_thread_runs(tmp_path):
+    # Поток прогрева ждёт, пока проверка не увидит состояние: ready не должен считать прогрев законченным
+    pool = _pool(tmp_path)
+    started = threading.Event()
+    get = pool.get
+
+    def gated(shard):
+        started.wait()
+        return get(shard)
+
+    pool.get = gated
+    thread = pool.start_warm_up(range(2))
+    assert pool.warmup == {"target": 2, "loaded": 0, "done": False, "error": None}
+    started.set()
+    thread.join()
+    assert pool.warmup["done"] and pool.warmup["loaded"] == 2 and pool.loads == 2
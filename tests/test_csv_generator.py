@@ -0,0 +1,41 @@
+"""Генерация CSV рекомендаций (csv_generator.py): порядок client_code в однопроцессном и шардированном режимах"""
+import csv
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from conftest import DATA_DIR
+from csv_generator import generate_recommendations_csv, generate_recommendations_csv_sharded
+from services.manifest import file_pairs
+
+PAIRS = file_pairs(DATA_DIR)
+
+
+def _client_codes(path):
+    with open(path, encoding='utf-8') as f:
+        return [int(row['client_code']) for row in csv.DictReader(f)]
+
+
+@pytest.mark.skipif(len(PAIRS) < 12, reason="нет CSV в data/")
+def test_rows_ordered_by_client_code(tmp_path):
+    # Файлы по три клиента с перемешанными client_code: номер файла не совпадает с порядком клиентов,
+    # диапазоны client_code файлов (и шардов) пересекаются
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    shutil.copy(os.path.join(DATA_DIR, 'fx_rates.csv'), data_dir)
+    codes = [7, 2, 11, 4, 12, 1, 9, 3, 10, 5, 8, 6]
+    for number in range(4):
+        for kind, index in (('transactions', 0), ('transfers', 1)):
+            frames = [pd.read_csv(PAIRS[i][index]).assign(client_code=codes[i] * 100)
+                      for i in range(number * 3, number * 3 + 3)]
+            pd.concat(frames).to_csv(data_dir / f'client_{number + 1}_{kind}_3m.csv', index=False)
+
+    single = str(tmp_path / 'single.csv')
+    sharded = str(tmp_path / 'sharded.csv')
+    generate_recommendations_csv(single, str(data_dir))
+    generate_recommendations_csv_sharded(sharded, str(data_dir), workers=2, chunk_size=1)
+    assert _client_codes(single) == sorted(code * 100 for code in codes)
+    with open(single, encoding='utf-8') as a, open(sharded, encoding='utf-8') as b:
+        assert a.read() == b.read()
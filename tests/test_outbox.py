@@ -0,0 +1,203 @@
+"""Outbox push-уведомлений (services/outbox.py): доставка, cooldown, повторы, журнал, сбои потребителя"""
+import asyncio
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from services.outbox import HttpSink, JsonlSink, Journal, JournalLocked, Outbox
+
+
+class StubServer:
+    """
+    HTTP-приёмник для проверок HttpSink: принимает POST с пакетом и запоминает уведомления.
+    Первые fail_first запросов получают 503 — чтобы проверить повторы.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, fail_first: int = 0):
+        self.batches: List[List[Dict]] = []
+        self.requests = 0
+        self.fail_first = fail_first
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stub._lock:
+                    stub.requests += 1
+                    failed = stub.requests <= stub.fail_first
+                    if not failed:
+                        stub.batches.append(json.loads(body)['notifications'])
+                self.send_response(503 if failed else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/push'
+
+    @property
+    def notifications(self) -> List[Dict]:
+        with self._lock:
+            return [item for batch in self.batches for item in batch]
+
+    def start(self) -> 'StubServer':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='outbox-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SlowSink:
+    """Приёмник, который не успевает отправить пакет до остановки outbox"""
+
+    async def send(self, batch: List[Dict]):
+        await asyncio.sleep(10)
+
+
+class FlakyJournal(Journal):
+    """Журнал, первая запись в который падает"""
+
+    def __init__(self, path: str):
+        super().__init__(path, fsync=False)
+        self.failed = False
+
+    def append(self, records, path=None):
+        if not self.failed:
+            self.failed = True
+            raise OSError("disk full")
+        super().append(records, path)
+
+
+def test_delivery_and_cooldown(tmp_path):
+    sent = tmp_path / 'sent.jsonl'
+
+    async def run():
+        outbox = Outbox(JsonlSink(str(sent)), str(tmp_path / 'journal.jsonl'), max_queue=10, batch_size=4,
+                        batch_seconds=0.01, rate=0)
+        await outbox.start()
+        queued, duplicates = await outbox.put_many((i, 'Кредитная карта', 'm') for i in range(25))
+        repeated = await outbox.put(3, 'Кредитная карта', 'm')
+        await outbox.drain()
+        await outbox.stop()
+        return queued, duplicates, repeated, outbox.stats()
+
+    queued, duplicates, repeated, stats = asyncio.run(run())
+    assert (queued, duplicates, repeated) == (25, 0, False)
+    assert len(sent.read_text(encoding='utf-8').splitlines()) == 25
+    assert stats['sent'] == 25 and stats['deduplicated'] == 1 and stats['failures'] == 0
+
+
+def test_retry_and_dead_letter(tmp_path):
+    async def run(stub, journal, **kwargs):
+        outbox = Outbox(HttpSink(stub.url), str(tmp_path / journal), batch_size=50, batch_seconds=0.01, rate=0,
+                        retry_seconds=0.01, **kwargs)
+        await outbox.start()
+        await outbox.put_many((i, 'Депозит', 'm') for i in range(60))
+        await outbox.drain()
+        await outbox.stop()
+        return outbox.stats()
+
+    stub = StubServer(fail_first=2).start()
+    try:
+        stats = asyncio.run(run(stub, 'retry.jsonl'))
+    finally:
+        stub.stop()
+    assert sorted(item['client_code'] for item in stub.notifications) == list(range(60))
+    assert stats['retries'] == 2 and stats['dead'] == 0
+
+    stub = StubServer(fail_first=100).start()
+    try:
+        stats = asyncio.run(run(stub, 'dead.jsonl', max_attempts=2))
+    finally:
+        stub.stop()
+    assert stats['dead'] == 60
+    assert len((tmp_path / 'dead.dead.jsonl').read_text(encoding='utf-8').splitlines()) == 60
+
+
+def test_journal_replay_after_restart(tmp_path):
+    journal = str(tmp_path / 'journal.jsonl')
+
+    async def interrupted():
+        outbox = Outbox(SlowSink(), journal, batch_size=7, batch_seconds=0.01, rate=0)
+        await outbox.start()
+        await outbox.put_many((i, 'Инвестиции', f'm{i}') for i in range(20))
+        await asyncio.sleep(0.05)
+        await outbox.stop()
+
+    async def restarted(stub):
+        outbox = Outbox(HttpSink(stub.url), journal, batch_size=7, batch_seconds=0.01, rate=0)
+        await outbox.start()
+        pending = outbox.pending
+        repeated = await outbox.put(5, 'Инвестиции', 'x')
+        await outbox.drain()
+        await outbox.stop()
+        return pending, repeated
+
+    asyncio.run(interrupted())
+    stub = StubServer().start()
+    try:
+        pending, repeated = asyncio.run(restarted(stub))
+    finally:
+        stub.stop()
+    assert pending == 20 and repeated is False
+    assert sorted(item['client_code'] for item in stub.notifications) == list(range(20))
+    assert Journal(journal).replay()[0] == []
+
+
+def test_consumer_survives_journal_error(tmp_path):
+    sent = tmp_path / 'sent.jsonl'
+
+    async def run():
+        outbox = Outbox(JsonlSink(str(sent)), str(tmp_path / 'journal.jsonl'), batch_size=10, batch_seconds=0.01,
+                        rate=0, retry_seconds=0.01)
+        outbox.journal = FlakyJournal(outbox.journal.path)
+        await outbox.start()
+        for i in range(5):
+            assert outbox.offer(i, 'Кредитная карта', 'm')
+        await outbox.drain()
+        stats = outbox.stats()
+        await outbox.stop()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats['running'] and stats['failures'] == 1 and 'disk full' in stats['last_error']
+    assert stats['sent'] == 5
+    assert len(sent.read_text(encoding='utf-8').splitlines()) == 5
+
+
+def test_journal_owned_by_one_process(tmp_path):
+    # Второй outbox на том же журнале (как второй воркер uvicorn) не стартует, пока первый не остановлен
+    journal = str(tmp_path / 'journal.jsonl')
+
+    async def run():
+        first = Outbox(JsonlSink(str(tmp_path / 'sent.jsonl')), journal, rate=0)
+        second = Outbox(JsonlSink(str(tmp_path / 'sent.jsonl')), journal, rate=0)
+        await first.start()
+        try:
+            await second.start()
+        except JournalLocked as e:
+            error = str(e)
+        else:
+            error = None
+        await first.stop()
+        await second.start()
+        running = second.stats()['running']
+        await second.stop()
+        return error, running
+
+    error, running = asyncio.run(run())
+    assert error is not None and str(os.getpid()) in error
+    assert running
@@ -0,0 +1,82 @@
+"""Паритет онлайн- и офлайн-стратегий движка рекомендаций (services/parity.py) на data/"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import DATA_DIR
+from services import config
+from services.analytics import ClientAnalyzer
+from services.features import TABLES
+from services.ingest import append_store
+from services.loader import derive_generation
+from services.manifest import file_pairs
+from services.parity import compare
+from services.store import build_store
+
+PAIRS = file_pairs(DATA_DIR)
+
+
+@pytest.mark.skipif(not PAIRS, reason="нет CSV в data/")
+@pytest.mark.parametrize('transactions, transfers', PAIRS, ids=lambda path: str(path).rsplit('/', 1)[-1])
+def test_csv_pair_parity(transactions, transfers):
+    analyzer = ClientAnalyzer(transactions, transfers)
+    assert len(analyzer.transactions_index) > 0
+    assert compare(analyzer) == []
+
+
+@pytest.mark.skipif(not PAIRS, reason="нет CSV в data/")
+def test_store_parity(tmp_path):
+    # Онлайн-путь считается заново по хранилищу, офлайн — по таблице признаков из поколения
+    store_dir = str(tmp_path / 'store')
+    build_store(DATA_DIR, store_dir, derive=derive_generation)
+    online = ClientAnalyzer.from_store(store_dir, use_derived=False)
+    offline = ClientAnalyzer.from_store(store_dir)
+    assert len(online.transactions_index) == sum(len(ClientAnalyzer(*pair).transactions_index) for pair in PAIRS)
+    assert compare(online, offline_analyzer=offline) == []
+
+
+def _shifted(path: str, days: int) -> pd.DataFrame:
+    df = pd.read_csv(path)
+    df['date'] = (pd.to_datetime(df['date']) + pd.Timedelta(days=days)).astype(str)
+    return df
+
+
+def _assert_derived_match(store_dir: str):
+    online = ClientAnalyzer.from_store(store_dir, use_derived=False)
+    offline = ClientAnalyzer.from_store(store_dir)
+    assert list(offline.layout.categories) == list(online.layout.categories)
+    np.testing.assert_array_equal(offline.features.client_codes, online.features.client_codes)
+    for name in TABLES:
+        np.testing.assert_allclose(getattr(offline.features, name), getattr(online.features, name), atol=1e-6)
+    for name, values in online.features.metrics.items():
+        np.testing.assert_allclose(offline.features.metrics[name], values, atol=1e-6)
+    np.testing.assert_allclose(offline.segments.cat_sum, online.segments.cat_sum, atol=1e-6)
+    index = offline.lookalikes
+    np.testing.assert_array_equal(index.client_codes, online.lookalikes.client_codes)
+    np.testing.assert_allclose(index.vectors, online.lookalikes.vectors, atol=1e-6)
+    assert sorted(index.clusters.members) == list(range(len(index.client_codes)))
+    return offline
+
+
+@pytest.mark.skipif(not PAIRS, reason="нет CSV в data/")
+def test_appended_store_parity(tmp_path, monkeypatch):
+    # Производные массивы дописанного поколения — инкрементально обновлённый анализатор; они должны
+    # совпадать с пересчётом поколения заново с точностью до округления: expire вычитает суммы,
+    # а не складывает оставшиеся строки. Первая дельта меняет словари (индекс похожих клиентов
+    # собирается заново), вторая — нет (изменения из буфера индекса переносятся в матрицу)
+    monkeypatch.setattr(config, 'LOOKALIKE_IVF_MIN_CLIENTS', 1)
+    store_dir = str(tmp_path / 'store')
+    build_store(DATA_DIR, store_dir, derive=derive_generation)
+    (transactions, transfers), (other, _), (_, other_transfers) = PAIRS[:3]
+    delta_tx = _shifted(transactions, 30)
+    delta_tx.loc[delta_tx.index[:3], 'category'] = 'Новая категория'
+    new_client = _shifted(other, 30).assign(client_code=100000)
+    pd.concat([delta_tx, new_client]).to_csv(tmp_path / 'delta_tx.csv', index=False)
+    _shifted(transfers, 30).to_csv(tmp_path / 'delta_tr.csv', index=False)
+    meta = append_store(store_dir, str(tmp_path / 'delta_tx.csv'), str(tmp_path / 'delta_tr.csv'), window_days=92)
+    assert meta['affected_clients'] > 2
+    assert 100000 in _assert_derived_match(store_dir).features.client_codes
+
+    _shifted(other_transfers, 31).to_csv(tmp_path / 'delta_tr2.csv', index=False)
+    append_store(store_dir, transfers_path=str(tmp_path / 'delta_tr2.csv'))
+    _assert_derived_match(store_dir)
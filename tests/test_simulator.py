@@ -0,0 +1,33 @@
+"""What-if симулятор (services/simulator.py): сетка параметров"""
+import numpy as np
+import pytest
+
+from services.scoring import DEFAULT_PARAMS, FEATURES
+from services.simulator import parameter_grid, simulate
+
+
+def test_grid_expands_scenarios():
+    scenarios = parameter_grid({'travel_rate': [0.03, 0.05], 'premium_balance': [300000]})
+    assert [(s.travel_rate, s.premium_balance) for s in scenarios] == [(0.03, 300000.0), (0.05, 300000.0)]
+    assert scenarios[0].invest_rate == DEFAULT_PARAMS.invest_rate
+
+
+@pytest.mark.parametrize('grid', [
+    {'premium_balance': [0]},
+    {'premium_balance': [500000, -1]},
+    {'credit_threshold': [float('nan')]},
+    {'travel_rate': [0.0]},
+    {'deposit_rate': [float('inf')]},
+])
+def test_grid_rejects_non_positive_values(grid):
+    # premium_balance = 0 делил бы уверенность премиальной карты на ноль (inf/nan в результатах)
+    with pytest.raises(ValueError, match='positive'):
+        parameter_grid(grid)
+
+
+def test_simulation_results_are_finite():
+    X = np.zeros((4, len(FEATURES)))
+    X[:, FEATURES.index('avg_monthly_balance')] = [0, 100000, 600000, 2000000]
+    X[:, FEATURES.index('total_spending')] = 300000
+    results = simulate(X, parameter_grid({'premium_balance': [1, 1e6]}))
+    assert all(np.isfinite([result['expected_benefit'], result['total_benefit']]).all() for result in results)
@@ -0,0 +1,67 @@
+"""Потоковая сборка таблицы признаков (services/streaming.py): пик памяти не растёт с числом блоков"""
+import gc
+import glob
+import os
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import DATA_DIR
+from services import config, streaming
+from services.features import TABLES
+from services.fx import fx_table_for
+from services.store import TRANSACTION_COLUMNS, TRANSFER_COLUMNS
+
+TRANSACTIONS = sorted(glob.glob(os.path.join(DATA_DIR, 'client_*_transactions_3m.csv')))
+TRANSFERS = sorted(glob.glob(os.path.join(DATA_DIR, 'client_*_transfers_3m.csv')))
+pytestmark = pytest.mark.skipif(not TRANSACTIONS, reason="нет CSV в data/")
+
+
+def _date_ordered(paths, columns):
+    """Выгрузка, отсортированная по дате, а не по клиенту: строки клиентов перемешаны по всему файлу"""
+    frame = pd.concat([pd.read_csv(path, usecols=columns) for path in paths], ignore_index=True)
+    return frame[columns].sort_values('date', kind='stable').reset_index(drop=True)
+
+
+def _peak(monkeypatch, frames, copies, chunk_rows=1000):
+    """
+    Пик памяти stream_features на выгрузке из copies повторов frames. Блоки собираются из колонок
+    frames в памяти, а не читаются из CSV, и каждый раз — новой таблицей: буферы парсера pandas
+    (растут с размером файла) и ссылки copy-on-write на общую исходную таблицу не должны
+    смешиваться с тем, что держит сама сборка. Перед каждым блоком собирается циклический
+    мусор объектов pandas, иначе пик зависит от того, когда сработает сборщик
+    """
+    blocks = {name: [{column: frame[column].to_numpy()[start:start + chunk_rows].copy() for column in frame}
+                     for start in range(0, len(frame), chunk_rows)]
+              for name, frame in frames.items()}
+
+    def chunks(paths, columns, rows):
+        for _ in range(copies):
+            for block in blocks[paths[0]]:
+                gc.collect()
+                yield pd.DataFrame(block, copy=True)
+
+    monkeypatch.setattr(streaming, 'client_chunks', chunks)
+    fx = fx_table_for(DATA_DIR, config.FX_RATES)
+    tracemalloc.start()
+    try:
+        features = streaming.stream_features(['transactions'], ['transfers'], chunk_rows, fx)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, features
+
+
+def test_peak_memory_does_not_grow_with_chunks(monkeypatch):
+    # Те же клиенты, категории и месяцы, но в 4 раза больше строк и блоков (в каждом блоке — почти
+    # все клиенты): пик — блок строк плюс накопленные таблицы, а не частичные таблицы всех блоков
+    frames = {'transactions': _date_ordered(TRANSACTIONS, TRANSACTION_COLUMNS),
+              'transfers': _date_ordered(TRANSFERS, TRANSFER_COLUMNS)}
+    small_peak, small = _peak(monkeypatch, frames, copies=1)
+    large_peak, large = _peak(monkeypatch, frames, copies=4)
+    assert np.array_equal(small.client_codes, large.client_codes)
+    for name in TABLES:
+        np.testing.assert_allclose(getattr(large, name), getattr(small, name) * 4)
+    assert large_peak < 1.2 * small_peak
@@ -0,0 +1,29 @@
+"""Шаблоны уведомлений (services/templates.py): все поля KNOWN_FIELDS рендерятся в обоих путях движка"""
+import pytest
+
+from conftest import DATA_DIR
+from services import templates
+from services.analytics import ClientAnalyzer
+from services.manifest import file_pairs
+from services.parity import compare
+from services.templates import KNOWN_FIELDS, TemplateRegistry
+
+PAIRS = file_pairs(DATA_DIR)
+
+
+@pytest.mark.skipif(not PAIRS, reason="нет CSV в data/")
+def test_every_known_field_renders(monkeypatch):
+    # Шаблон со всеми полями для всех продуктов: поле, которое проходит проверку при разборе, но которого
+    # нет в metrics (или в колонках пакетного рендера), упало бы здесь KeyError
+    text = ' '.join(f'{field}={{{field}}}' for field in sorted(KNOWN_FIELDS))
+    registry = TemplateRegistry({'default_locale': 'ru', 'max_length': 10000, 'locales': {'ru': {'fallback': text}}})
+    monkeypatch.setattr(templates, '_registry', registry)
+
+    analyzer = ClientAnalyzer(*PAIRS[0])
+    client_code = int(analyzer.transactions_index.codes[0])
+    _, client_info, products = next(analyzer.recommend([client_code], top_k=1))
+    message = products[0][3]
+    assert all(f'{field}=' in message for field in KNOWN_FIELDS)
+    assert str(client_info['metrics']['avg_monthly_balance']) in message
+    # Офлайн-путь рендерит те же поля по колонкам таблицы признаков
+    assert compare(analyzer) == []